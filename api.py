@@ -1,12 +1,133 @@
-from flask import Flask, jsonify, request, send_file, send_from_directory
+import atexit
+import csv
+from flask import Flask, g, jsonify, request, Response, stream_with_context
+import io
+from itertools import islice
+import json
 import logging
+import os
+import time
+import zlib
 
-from db import Db
+from avatar_cache import AvatarCache, AvatarError
+from db import ConnectionPool, Db
+from metrics import format_metric, Metrics
+from page_prefetcher import PagePrefetcher
+from response_cache import ResponseCache
+from response_encoder import parse_accept_encoding, ResponseEncoder
+from snapshot import TableSnapshot
+from static_assets import StaticAssets
 from user_dao import UserDao
 
 app = Flask("user_api")
 # logging.basicConfig(level=logging.DEBUG)
 
+# Time every request and statement, logging statements slower than USER_API_SLOW_QUERY_MS with their query plans
+slow_query_ms = os.environ.get("USER_API_SLOW_QUERY_MS", "100")
+metrics = Metrics("user_api", slow_seconds=float(slow_query_ms) / 1000 if slow_query_ms else None)
+
+# Share a bounded set of read-only database connections between request threads, so the seeder can write alongside
+pool = ConnectionPool(os.environ.get("USER_API_DB", "github"), size=int(os.environ.get("USER_API_POOL_SIZE", 4)),
+                      profile=os.environ.get("USER_API_DB_PROFILE", "performance"), read_only=True, metrics=metrics)
+atexit.register(pool.close)
+
+# Set USER_API_SNAPSHOT to serve pages from an in-memory copy of the user table, rebuilt in the background after writes
+snapshot = TableSnapshot(UserDao(), connect=lambda: Db(pool=pool)) if os.environ.get("USER_API_SNAPSHOT") else None
+
+# Count users with USER_API_COUNT_STRATEGY: exact, cached (exact, recounted once the table changes) or estimated
+count_strategy = os.environ.get("USER_API_COUNT_STRATEGY") or UserDao().count_strategy
+if count_strategy not in UserDao.count_strategies:
+    raise ValueError(f"Unknown count strategy {count_strategy}, expected one of {', '.join(UserDao.count_strategies)}")
+
+# Remember recently served pages until the table is written
+response_cache = ResponseCache(max_entries=int(os.environ.get("USER_API_CACHE_SIZE", 256)),
+                               ttl=float(os.environ.get("USER_API_CACHE_TTL", 60)))
+
+# Read USER_API_PREFETCH_PAGES pages either side of each page of search results not already in memory, keeping them
+# for USER_API_PREFETCH_TTL seconds so paging through a search is served from memory; set the pages to 0 to turn it off
+prefetch_pages = int(os.environ.get("USER_API_PREFETCH_PAGES", 2))
+page_prefetcher = PagePrefetcher(pages=prefetch_pages, ttl=float(os.environ.get("USER_API_PREFETCH_TTL", 30))) \
+    if prefetch_pages > 0 else None
+
+# Encode /user with USER_API_JSON_ENCODER (the fastest installed by default), compressing bodies of at least
+# USER_API_COMPRESS_MIN_BYTES when the client accepts it
+compress_min_bytes = os.environ.get("USER_API_COMPRESS_MIN_BYTES", "1024")
+response_encoder = ResponseEncoder(os.environ.get("USER_API_JSON_ENCODER") or None,
+                                   min_size=int(compress_min_bytes) if compress_min_bytes else None)
+
+# Serve avatars as thumbnails of USER_API_AVATAR_SIZE pixels, cached on disk up to USER_API_AVATAR_CACHE_MB
+avatar_cache = AvatarCache(os.environ.get("USER_API_AVATAR_DIR", "avatar_cache"),
+                           max_bytes=int(os.environ.get("USER_API_AVATAR_CACHE_MB", 64)) * pow(2, 20),
+                           size=int(os.environ.get("USER_API_AVATAR_SIZE", 100)),
+                           allowed_hosts=os.environ.get("USER_API_AVATAR_HOSTS",
+                                                        "avatars.githubusercontent.com").split(","))
+avatar_max_age = int(os.environ.get("USER_API_AVATAR_MAX_AGE", 86400))
+
+# Hold the page and its images in memory, fingerprinted and precompressed; restart to pick up changed files
+static_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_db():
+    """
+    Get the database for the current request, borrowing a connection from the pool on first use.
+
+    Parameters: None
+
+    Returns:
+        Db: the request's database object.
+    """
+
+    if "db" not in g:
+        g.db = Db(pool=pool)
+    return g.db
+
+
+@app.before_request
+def start_timer():
+    """
+    Note when the current request started.
+
+    Parameters: None
+    Returns: None
+    """
+
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """
+    Record the time taken to build the current request's response. Streamed responses are timed until they start.
+
+    Parameters:
+        response (Response): the response to the current request.
+
+    Returns:
+        Response: the response, unchanged.
+    """
+
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    """
+    Return the current request's database connection to the pool.
+
+    Parameters:
+        exception (Exception): the exception that ended the request, if any.
+
+    Returns: None
+    """
+
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+
 
 @app.route('/')
 def get_index():
@@ -19,8 +140,7 @@ def get_index():
         Response: A Flask Response object containing index.html
     """
 
-    logging.info("Serving file index.html")
-    return send_file('index.html')
+    return serve_asset(static_assets.index)
 
 
 @app.route("/images/<filename>")
@@ -35,8 +155,53 @@ def get_image(filename):
         Response: A Flask Response object containing the requested file
     """
 
-    logging.info(f"Serving file images/{filename}")
-    return send_from_directory("images", filename)
+    return serve_asset(f"images/{filename}")
+
+
+def serve_asset(path):
+    """
+    Answer the current request for a static asset from memory
+
+    Parameters:
+        path (str): The path of the asset relative to the project root.
+
+    Returns:
+        Response: A Flask Response object containing the asset, or a 304 or 404 response
+    """
+
+    status, body, headers = static_assets.respond(path, request.args.get("v"), request.headers.get("Accept-Encoding"),
+                                                  request.headers.get("If-None-Match"))
+    logging.info(f"Serving file {path} with status {status}")
+    return Response(body, status=status, headers=headers)
+
+
+@app.route("/avatar/<int:user_id>")
+def get_avatar(user_id):
+    """
+    Flask route to serve a user's avatar as a thumbnail from the on-disk avatar cache
+
+    Parameters:
+        user_id (int): The id of the user.
+
+    Returns:
+        Response: A Flask Response object containing the thumbnail, cacheable by the browser
+    """
+
+    user_dao = UserDao()
+    row = user_dao.read_by_key(get_db(), user_id)
+    if row is None:
+        return jsonify({"error": f"Unable to find user {user_id}"}), 404
+
+    try:
+        data, content_type, etag = avatar_cache.get(row[user_dao.schema.column_index["avatar_url"]])
+    except AvatarError as e:
+        logging.warning(f"Unable to serve avatar of user {user_id}: {e}")
+        return jsonify({"error": str(e)}), e.status
+
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={avatar_max_age}"}
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype=content_type, headers=headers)
 
 
 @app.route('/user')
@@ -50,40 +215,312 @@ def get_user():
         Response: A Flask Response object containing requested users encoded in the DataTable expected JSON format
     """
 
+    status, payload, headers = read_user_page(request.args, request.headers.get("If-None-Match"), get_db)
+    if payload is None:
+        return Response(status=status, headers=headers)
+
+    body, headers = encode_user_page(payload, headers, request.headers.get("Accept-Encoding"))
+    return Response(body, status=status, headers=headers, mimetype="application/json")
+
+
+def read_user_page(args, if_none_match, get_db):
+    """
+    Answer a DataTable request for a page of users, from the response cache when the table is unchanged. This is the
+    /user contract shared by the Flask route and the ASGI app.
+
+    Parameters:
+        args (MultiDict): the request's query parameters.
+        if_none_match (str): the value of the request's If-None-Match header, if any.
+        get_db (callable): returns the database to read from, only called when the database is needed.
+
+    Returns:
+        tuple: the status code, the JSON payload or None for a 304 response, and a dict of response headers
+    """
+
     error_list = []
     user_dao = UserDao()
 
     # Get the parameters from the request URL
-    draw = request.args.get('draw', default=1, type=int)
-    start = request.args.get('start', default=0, type=int)
-    length = request.args.get('length', default=25, type=int)
-    sort_index = request.args.get('order[0][column]', default=0, type=str)
-    sort_by = request.args.get('columns[' + sort_index + '][name]', type=str).lower()
-
-    # Verify the order string
-    if sort_by not in user_dao.columns:
-        error_list.append(f"Unable to sort on column {sort_by} as it was not found")
-        sort_by = user_dao.columns[0]
-
-    # Sort in descending order when requested
-    desc_flag = False
-    if request.args.get('order[0][dir]', type=str) == "desc":
-        desc_flag = True
+    draw = args.get('draw', default=1, type=int)
+    start = args.get('start', default=0, type=int)
+    length = args.get('length', default=25, type=int)
+
+    # Read every sort column in order of precedence, as sent by a shift-click multi-column sort
+    sort_by = []
+    i = 0
+    while i == 0 or f'order[{i}][column]' in args:
+        sort_index = args.get(f'order[{i}][column]', default=0, type=str)
+        column = args.get('columns[' + sort_index + '][name]', default='', type=str).lower()
+        direction = "desc" if args.get(f'order[{i}][dir]', type=str) == "desc" else "asc"
+
+        # Verify the order string
+        if column not in user_dao.sortable_columns:
+            error_list.append(f"Unable to sort on column {column} as it was not found")
+        else:
+            sort_by.append((column, direction))
+        i += 1
+
+    # Filter by the search box; terms of three or more characters match anywhere, shorter ones the start of a column
+    search = args.get('search[value]', default='', type=str).strip()
+
+    # Only send the row values the table's columns read
+    fields = read_fields(args, len(user_dao.columns))
+
+    if error_list:
+        count, estimated = user_dao.count_records(get_db(), strategy=count_strategy)
+        return 200, {"draw": draw, "recordsTotal": count, "recordsFiltered": count, "estimated": estimated,
+                     "error": '; '.join(error_list)}, {}
+
+    # Answer from the response cache while the table is unchanged
+    key = ("user", start, length, tuple(sort_by), search, fields)
+    headers = {}
+    version = response_cache.get_version(lambda: get_db().get_data_version(user_dao))
+    if version is not None:
+        headers = {"ETag": ResponseCache.make_etag(key, version), "Cache-Control": "no-cache"}
+        etag = response_cache.is_not_modified(key, version, if_none_match)
+        if etag:
+            return 304, None, dict(headers, ETag=etag)
+        payload = response_cache.get(key, version)
+    else:
+        payload = None
 
     # Return the requested data in json format
-    logging.info(f"Serving user data (start={start}, length={length}, sort_by={sort_by})")
-    db = Db()
-    count = user_dao.get_count(db)
+    if payload is None:
+        logging.info(f"Serving user data (start={start}, length={length}, sort_by={sort_by}, search={search})")
+        cursor_tokens = args.get('cursor', default='', type=str).split(',')
+        payload = build_user_payload(get_db(), user_dao, start, length, sort_by, search, cursor_tokens, fields)
+        if version is not None:
+            response_cache.put(key, version, payload)
 
+    return 200, dict(payload, draw=draw), headers
+
+
+def encode_user_page(payload, headers, accept_encoding):
+    """
+    Encode a /user payload for a client, giving the entity tag from read_user_page the suffix of the body's content
+    coding as ResponseCache.make_etag does, so each coding of the page has its own tag.
+
+    Parameters:
+        payload (dict): the JSON payload returned by read_user_page.
+        headers (dict): the response headers returned by read_user_page.
+        accept_encoding (str): the value of the request's Accept-Encoding header, if any.
+
+    Returns:
+        tuple: the response body and a dict of response headers.
+    """
+
+    body, encoding_headers = response_encoder.encode(payload, accept_encoding)
+    headers = {**headers, **encoding_headers}
+    if "ETag" in headers and "Content-Encoding" in headers:
+        headers["ETag"] = f'{headers["ETag"][:-1]}-{headers["Content-Encoding"]}"'
+
+    return body, headers
+
+
+def read_fields(args, column_count):
+    """
+    Read the row indexes the DataTable's columns display from their columns[i][data] parameters.
+
+    Parameters:
+        args (MultiDict): the request's query parameters.
+        column_count (int): the number of values in each row.
+
+    Returns:
+        tuple: the row indexes in increasing order, or None to send whole rows when a column reads anything else.
+    """
+
+    fields = set()
+    i = 0
+    while f'columns[{i}][data]' in args:
+        value = args.get(f'columns[{i}][data]', type=str)
+        if not value.isdigit() or int(value) >= column_count:
+            return None
+        fields.add(int(value))
+        i += 1
+
+    return tuple(sorted(fields)) or None
+
+
+def project_rows(rows, fields):
+    """
+    Blank the values of each row the client does not read, keeping every value at its index so the DataTable's
+    columns[i][data] still find them, and drop the blanks after the last index read.
+
+    Parameters:
+        rows (list): the records to project.
+        fields (tuple): the row indexes to keep, in increasing order.
+
+    Returns:
+        list: the projected records.
+    """
+
+    keep = [i in fields for i in range(fields[-1] + 1)]
+    return [[value if kept else None for value, kept in zip(row, keep)] for row in rows]
+
+
+def build_user_payload(db, user_dao, start, length, sort_by, search, cursor_tokens, fields=None):
+    """
+    Read a page of users and the table counts in the DataTable expected format, less the draw counter. The estimated
+    flag is set when either count is an estimate under the count strategy
+
+    Parameters:
+        db (Db): the database on which to operate.
+        user_dao (UserDao): the user table.
+        start (int): The number of records to skip before returning results
+        length (int): The maximum number of records to return
+        sort_by (list): (column name, direction) pairs to sort on in order of precedence
+        search (str): Only return records matching this search term
+        cursor_tokens (list): Continuation tokens held by the client
+        fields (tuple): the row indexes to send, in increasing order, or None to send whole rows
+
+    Returns:
+        dict: the counts, records and continuation tokens for the neighbouring pages
+    """
+
+    count, estimated = user_dao.count_records(db, strategy=count_strategy)
+    filtered, filtered_estimated = user_dao.count_records(db, search, count_strategy) if search else (count, False)
     payload = {
-        "draw": draw,
         "recordsTotal": count,
-        "recordsFiltered": count
+        "recordsFiltered": filtered,
+        "estimated": estimated or filtered_estimated
     }
 
-    if len(error_list) == 0:
-        payload["data"] = user_dao.read(db, start, length, sort_by, desc_flag)
-    else:
-        payload["error"] = '; '.join(error_list)
+    # Seek from a continuation token when the client holds one for this page, otherwise fall back to the offset
+    limit = min(max(length, 0), Db.max_limit)
+    cursor = None
+    for token in cursor_tokens:
+        cursor = user_dao.decode_cursor(token, start, limit, sort_by, search=search)
+        if cursor:
+            break
+
+    # Only searches are worth prefetching; pages served by an index are quicker to read one at a time
+    data = user_dao.read(db, start, length, sort_by, cursor=cursor, search=search, snapshot=snapshot,
+                         prefetcher=page_prefetcher if search else None)
+    payload["data"] = data
+
+    # Hand out tokens for the neighbouring pages so sequential paging never needs an offset
+    if data:
+        payload["cursor_next"] = user_dao.encode_cursor(data[-1], start + len(data) - 1, sort_by, search=search)
+        if start >= limit:
+            payload["cursor_prev"] = user_dao.encode_cursor(data[0], start, sort_by, backward=True, search=search)
+    if fields is not None:
+        payload["data"] = project_rows(data, fields)
+
+    return payload
+
+
+@app.route('/user/export')
+def get_user_export():
+    """
+    Flask route that streams every user as newline-delimited JSON or CSV, gzipped when the client accepts it
+
+    Parameters: None
+
+    Returns:
+        Response: A Flask Response object streaming the requested columns of every user in id order
+    """
+
+    user_dao = UserDao()
+    export_format = request.args.get('format', default='ndjson', type=str).lower()
+    columns = [c.strip().lower() for c in request.args.get('columns', default='', type=str).split(',') if c.strip()]
+    columns = columns or user_dao.columns
+
+    # Verify the parameters before the response starts
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": f"Unable to export in format {export_format}"}), 400
+    try:
+        rows = user_dao.iterate(get_db(), columns)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    codings = parse_accept_encoding(request.headers.get("Accept-Encoding"))
+    compress = codings.get("gzip", codings.get("*", 0.0)) > 0
+    logging.info(f"Exporting user data (format={export_format}, columns={columns}, gzip={compress})")
+
+    def encode(batch):
+        if export_format == "ndjson":
+            return ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + "\n" for row in batch)
+
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(batch)
+        return buffer.getvalue()
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if compress else None
+
+        # Encode a batch of rows at a time so each chunk is a useful size
+        batch = [columns] if export_format == "csv" else []
+        batch += list(islice(rows, 1000))
+        while batch:
+            chunk = encode(batch)
+            yield chunk if compressor is None else compressor.compress(chunk.encode())
+            batch = list(islice(rows, 1000))
+
+        if compressor is not None:
+            yield compressor.flush()
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={user_dao.table_name}.{export_format}"
+    response.headers["Vary"] = "Accept-Encoding"
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+
+    return response
+
+
+@app.route('/stats')
+def get_stats():
+    """
+    Flask route that reports the API's internal usage metrics
+
+    Parameters: None
+
+    Returns:
+        Response: A Flask Response object containing the metrics in JSON format
+    """
+
+    return jsonify({"pool": pool.stats(), "response_cache": response_cache.stats(), "queries": metrics.stats(),
+                    "slow_queries": metrics.slow_queries(), "snapshot": snapshot.stats() if snapshot else None,
+                    "encoding": response_encoder.stats(), "avatars": avatar_cache.stats(),
+                    "count_strategy": count_strategy,
+                    "prefetch": page_prefetcher.stats() if page_prefetcher else None})
+
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    Flask route that reports request latency, statement timings, pool and cache metrics for Prometheus
+
+    Parameters: None
+
+    Returns:
+        Response: A Flask Response object containing the metrics in the Prometheus text format
+    """
+
+    pool_stats = pool.stats()
+    cache_stats = response_cache.stats()
+    encoder_stats = response_encoder.stats()
+    prefetch_stats = page_prefetcher.stats() if page_prefetcher else None
+    text = metrics.render() + \
+        format_metric("user_api_pool_connections", "gauge", "Database connections in the pool.",
+                      [("", {"state": "open"}, pool_stats["open"]), ("", {"state": "idle"}, pool_stats["idle"])]) + \
+        format_metric("user_api_pool_checkouts_total", "counter", "Connections borrowed from the pool.",
+                      [("", {}, pool_stats["checkouts"])]) + \
+        format_metric("user_api_pool_timeouts_total", "counter", "Requests that found no free connection.",
+                      [("", {}, pool_stats["timeouts"])]) + \
+        format_metric("user_api_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection.",
+                      [("", {}, pool_stats["wait_seconds_total"])]) + \
+        format_metric("user_api_response_cache_entries", "gauge", "Payloads held by the response cache.",
+                      [("", {}, cache_stats["entries"])]) + \
+        format_metric("user_api_response_cache_events_total", "counter", "Response cache events by kind.",
+                      [("", {"event": event}, cache_stats[event])
+                       for event in ("hits", "misses", "evictions", "not_modified")]) + \
+        format_metric("user_api_prefetch_events_total", "counter", "Page prefetch cache events by kind.",
+                      [("", {"event": event}, prefetch_stats[event]) for event in ("hits", "misses", "evictions")]
+                      if prefetch_stats else []) + \
+        format_metric("user_api_response_bytes_total", "counter", "Bytes of /user responses, before and after "
+                      "compression.", [("", {"stage": "json"}, encoder_stats["json_bytes"]),
+                                       ("", {"stage": "sent"}, encoder_stats["sent_bytes"])])
 
-    return jsonify(payload)
+    return Response(text, mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,251 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+import api
+from db import Db
+
+# Database work runs on a bounded set of threads, no more than the connections in the pool so none wait for one
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("USER_API_WORKERS", api.pool.size)),
+                              thread_name_prefix="user_api")
+
+# Routes passed through to the Flask app get their own threads, so a slow avatar fetch never holds up database work
+wsgi_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("USER_API_WSGI_WORKERS", 0)) or None,
+                                   thread_name_prefix="user_api_wsgi")
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point of the user API. /user is answered by the event loop with its database work on the executor, so
+    many concurrent clients share a few threads; every other route is passed through to the Flask app.
+
+    Parameters:
+        scope (dict): the ASGI connection scope.
+        receive (callable): awaits the next ASGI event from the client.
+        send (callable): sends an ASGI event to the client.
+
+    Returns: None
+    """
+
+    if scope["type"] == "lifespan":
+        await serve_lifespan(receive, send)
+    elif scope["type"] != "http":
+        return
+    elif scope["path"] == "/user" and scope["method"] in ("GET", "HEAD"):
+        await serve_user(scope, send)
+    else:
+        await serve_wsgi(scope, receive, send)
+
+
+async def serve_lifespan(receive, send):
+    """
+    Answer the ASGI server's startup and shutdown events, closing the executors and connection pool on shutdown.
+
+    Parameters:
+        receive (callable): awaits the next ASGI lifespan event.
+        send (callable): sends an ASGI lifespan event.
+
+    Returns: None
+    """
+
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            wsgi_executor.shutdown(wait=True)
+            api.pool.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def serve_user(scope, send):
+    """
+    Answer a /user request with the same contract as the Flask route, reading the page on the executor.
+
+    Parameters:
+        scope (dict): the ASGI connection scope of the request.
+        send (callable): sends an ASGI event to the client.
+
+    Returns: None
+    """
+
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+    if_none_match = ', '.join(value.decode("latin-1") for name, value in scope["headers"] if name == b"if-none-match")
+    accept_encoding = ', '.join(value.decode("latin-1") for name, value in scope["headers"]
+                                if name == b"accept-encoding")
+
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(executor, read_user, args,
+                                                                             if_none_match or None, scope["method"],
+                                                                             accept_encoding or None)
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]})
+    await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+def read_user(args, if_none_match, method="GET", accept_encoding=None):
+    """
+    Read a page of users on an executor thread, borrowing a pooled connection only if the page is not cached.
+
+    Parameters:
+        args (MultiDict): the request's query parameters.
+        if_none_match (str): the value of the request's If-None-Match header, if any.
+        method (str): the HTTP method of the request.
+        accept_encoding (str): the value of the request's Accept-Encoding header, if any.
+
+    Returns:
+        tuple: the status code, a list of (name, value) response headers and the response body.
+    """
+
+    started = time.perf_counter()
+    db = []
+
+    def get_db():
+        if not db:
+            db.append(Db(pool=api.pool))
+        return db[0]
+
+    try:
+        status, payload, headers = api.read_user_page(args, if_none_match, get_db)
+        if payload is None:
+            response_headers, body = list(headers.items()), b""
+        else:
+            body, headers = api.encode_user_page(payload, headers, accept_encoding)
+            response_headers = [("Content-Type", "application/json"), ("Content-Length", str(len(body)))] + \
+                list(headers.items())
+    except Exception:
+        logging.exception("Unable to serve user data")
+        status, response_headers, body = 500, [("Content-Type", "text/plain")], b"Internal Server Error"
+    finally:
+        if db:
+            db[0].close()
+
+    api.metrics.observe_request("/user", method, status, time.perf_counter() - started)
+    return status, response_headers, body
+
+
+async def serve_wsgi(scope, receive, send):
+    """
+    Pass a request through to the Flask app on the WSGI executor, streaming the response back as it is produced.
+
+    Parameters:
+        scope (dict): the ASGI connection scope of the request.
+        receive (callable): awaits the next ASGI event from the client.
+        send (callable): sends an ASGI event to the client.
+
+    Returns: None
+    """
+
+    body = b""
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            break
+
+    # The Flask app runs entirely on one WSGI executor thread, handing chunks to the event loop through a bounded queue
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=8)
+    stopped = threading.Event()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except TimeoutError:
+                pass
+        future.cancel()
+        return False
+
+    def run():
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = headers
+
+        try:
+            result = api.app(make_environ(scope, body), start_response)
+            try:
+                if not put(("start", response["status"], response["headers"])):
+                    return
+                for chunk in result:
+                    if chunk and not put(("body", chunk)):
+                        return
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            put(("end",))
+        except Exception as e:
+            put(("error", e))
+
+    task = loop.run_in_executor(wsgi_executor, run)
+    try:
+        while True:
+            item = await chunks.get()
+            if item[0] == "error":
+                raise item[1]
+            if item[0] == "start":
+                await send({"type": "http.response.start", "status": item[1],
+                            "headers": [(n.lower().encode("latin-1"), v.encode("latin-1")) for n, v in item[2]]})
+            elif item[0] == "body":
+                await send({"type": "http.response.body", "body": item[1], "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": b""})
+                break
+    finally:
+        stopped.set()
+        await task
+
+
+def make_environ(scope, body):
+    """
+    Build the WSGI environment of an ASGI HTTP request.
+
+    Parameters:
+        scope (dict): the ASGI connection scope of the request.
+        body (bytes): the request body.
+
+    Returns:
+        dict: the WSGI environment.
+    """
+
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
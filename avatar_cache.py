@@ -0,0 +1,291 @@
+from collections import OrderedDict
+import hashlib
+import io
+import logging
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+import urllib3
+
+# Pillow is optional: without it thumbnails are the size the image host sends for the requested size
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class AvatarError(Exception):
+    """
+    This is raised when an avatar cannot be served, carrying the HTTP status code to answer with.
+    """
+
+    def __init__(self, message, status=502):
+        """
+        This AvatarError class constructor.
+
+        Parameters:
+            message (str): a description of the failure.
+            status (int): the HTTP status code to answer with.
+        """
+
+        super().__init__(message)
+        self.status = status
+
+
+class AvatarCache:
+    """
+    This is a thread-safe, size-bounded cache of avatar thumbnails on disk. Each avatar is fetched once from its image
+    host at the thumbnail size, downscaled with Pillow when it is installed and the host sent a larger image, and
+    stored in a file named by the hash of its source URL and size. The least recently served thumbnails are deleted
+    once the files exceed max_bytes; file modification times record use, so the order survives restarts.
+
+    Only avatars on allowed hosts are fetched, so the cache cannot be used to reach arbitrary servers.
+
+    Attributes:
+        AvatarCache.directory (str): the directory holding the thumbnails.
+        AvatarCache.max_bytes (int): the largest total size of the thumbnails in bytes.
+        AvatarCache.size (int): the width and height in pixels thumbnails are scaled to fit.
+        AvatarCache.allowed_hosts (set): the host names, with any port, avatars may be fetched from.
+        AvatarCache.max_image_bytes (int): the largest image to accept from a host.
+        AvatarCache.timeout (float): the number of seconds to wait for a host's response.
+    """
+
+    content_types = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+    def __init__(self, directory, max_bytes=pow(2, 26), size=100, allowed_hosts=("avatars.githubusercontent.com",),
+                 max_image_bytes=pow(2, 20), timeout=10.0, session=None):
+        """
+        This AvatarCache class constructor.
+
+        Parameters:
+            directory (str): the directory to hold the thumbnails, created with the first one if it does not exist.
+            max_bytes (int): the largest total size of the thumbnails in bytes.
+            size (int): the width and height in pixels thumbnails are scaled to fit.
+            allowed_hosts (iterable): the host names, with any port, avatars may be fetched from.
+            max_image_bytes (int): the largest image to accept from a host.
+            timeout (float): the number of seconds to wait for a host's response.
+            session (requests.Session): the session to fetch avatars with, defaulting to a new one.
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self.allowed_hosts = set(allowed_hosts)
+        self.max_image_bytes = max_image_bytes
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+        self._lock = threading.Lock()
+        self._fetching = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        # Pick up the thumbnails of earlier runs, least recently used first
+        files = []
+        for entry in os.scandir(directory) if os.path.isdir(directory) else []:
+            name, _, extension = entry.name.partition(".")
+            if entry.is_file() and extension in AvatarCache.content_types:
+                stat = entry.stat()
+                files.append((stat.st_mtime, name, extension, stat.st_size))
+        self._entries = OrderedDict((name, (extension, nbytes)) for _, name, extension, nbytes in sorted(files))
+        self._bytes = sum(nbytes for _, nbytes in self._entries.values())
+
+    def get(self, url):
+        """
+        Get the thumbnail of an avatar, fetching it if it is not cached. Concurrent requests for the same avatar share
+        one fetch.
+
+        Parameters:
+            url (str): the URL of the full-size avatar.
+
+        Returns:
+            tuple: the thumbnail's bytes, content type and quoted entity tag.
+        """
+
+        parts = urlsplit(url or "")
+        if parts.scheme not in ("http", "https") or parts.netloc not in self.allowed_hosts:
+            raise AvatarError(f"avatar host of {url} is not allowed", 403)
+
+        key = hashlib.sha256(f"{url} {self.size}".encode()).hexdigest()
+        etag = f'"{key[:20]}"'
+
+        # A thumbnail can be evicted, or become unreadable, between the lookup and the read, so look it up once more
+        for _ in range(2):
+            while True:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        self._hits += 1
+                        break
+                    fetching = self._fetching.get(key)
+                    if fetching is None:
+                        fetching = self._fetching[key] = threading.Event()
+                        self._misses += 1
+                        break
+                fetching.wait()
+
+            if entry is None:
+                try:
+                    extension, data = self._fetch(key, url)
+                finally:
+                    with self._lock:
+                        del self._fetching[key]
+                    fetching.set()
+                return data, AvatarCache.content_types[extension], etag
+
+            extension, _ = entry
+            filename = os.path.join(self.directory, f"{key}.{extension}")
+            try:
+                with open(filename, "rb") as file:
+                    data = file.read()
+                os.utime(filename)
+                return data, AvatarCache.content_types[extension], etag
+            except OSError as e:
+                logging.warning(f"Unable to read avatar thumbnail {filename}: {e}")
+                with self._lock:
+                    if self._entries.get(key) == entry:
+                        del self._entries[key]
+                        self._bytes -= entry[1]
+
+        # Still unreadable, so serve a fresh copy straight from the host
+        extension, data = self._download(url)
+        return data, AvatarCache.content_types[extension], etag
+
+    def stats(self):
+        """
+        Get usage metrics for the cache.
+
+        Parameters: None
+
+        Returns:
+            dict: the thumbnails and bytes held, the byte limit, and the hits, misses and evictions.
+        """
+
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+    def _fetch(self, key, url):
+        """
+        Fetch an avatar at the thumbnail size, store it and evict the least recently used thumbnails over the limit. A
+        thumbnail that cannot be written is returned without being stored.
+
+        Parameters:
+            key (str): the hash naming the thumbnail's file.
+            url (str): the URL of the full-size avatar.
+
+        Returns:
+            tuple: the extension and bytes of the thumbnail.
+        """
+
+        extension, data = self._download(url)
+
+        # Write to a temporary file first so a reader never sees a partial thumbnail
+        filename = os.path.join(self.directory, f"{key}.{extension}")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{filename}.tmp", "wb") as file:
+                file.write(data)
+            os.replace(f"{filename}.tmp", filename)
+        except OSError as e:
+            logging.warning(f"Unable to store avatar thumbnail {filename}, serving it uncached: {e}")
+            if os.path.exists(f"{filename}.tmp"):
+                os.remove(f"{filename}.tmp")
+            return extension, data
+
+        evicted = []
+        with self._lock:
+            replaced = self._entries.pop(key, None)
+            if replaced is not None:
+                self._bytes -= replaced[1]
+            self._entries[key] = (extension, len(data))
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                name, (old_extension, nbytes) = self._entries.popitem(last=False)
+                self._bytes -= nbytes
+                self._evictions += 1
+                evicted.append(f"{name}.{old_extension}")
+
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                logging.warning(f"Unable to evict avatar thumbnail {name}: {e}")
+
+        logging.info(f"Cached avatar {url} in {len(data)} bytes, evicting {len(evicted)}")
+        return extension, data
+
+    def _download(self, url):
+        """
+        Fetch an avatar at the thumbnail size from its host, downscaling it further when Pillow is installed.
+
+        Parameters:
+            url (str): the URL of the full-size avatar.
+
+        Returns:
+            tuple: the extension and bytes of the thumbnail.
+        """
+
+        # GitHub scales avatars to the s query parameter, so ask for the thumbnail size rather than the full image
+        parts = urlsplit(url)
+        query = urlencode([(name, value) for name, value in parse_qsl(parts.query) if name != "s"] +
+                          [("s", self.size)])
+
+        # Redirects are not followed, as they could lead off the allowed hosts
+        try:
+            with self.session.get(urlunsplit(parts._replace(query=query)), timeout=self.timeout, stream=True,
+                                  allow_redirects=False) as response:
+                data = response.raw.read(self.max_image_bytes + 1, decode_content=True)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            raise AvatarError(f"unable to fetch avatar {url}: {e}")
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        extensions = {value: name for name, value in AvatarCache.content_types.items()}
+        if response.status_code != 200:
+            raise AvatarError(f"avatar {url} returned status {response.status_code}",
+                              404 if response.status_code == 404 else 502)
+        if content_type not in extensions:
+            raise AvatarError(f"avatar {url} is not a supported image but {content_type}")
+        if len(data) > self.max_image_bytes:
+            raise AvatarError(f"avatar {url} is larger than {self.max_image_bytes} bytes")
+
+        extension = extensions[content_type]
+        if Image is not None:
+            data, extension = self._downscale(data, extension)
+
+        return extension, data
+
+    def _downscale(self, data, extension):
+        """
+        Scale an image down to fit the thumbnail size with Pillow, if it is larger.
+
+        Parameters:
+            data (bytes): the image.
+            extension (str): the AvatarCache.content_types key of the image's format.
+
+        Returns:
+            tuple: the possibly scaled image and its extension.
+        """
+
+        try:
+            image = Image.open(io.BytesIO(data))
+            if max(image.size) <= self.size or getattr(image, "is_animated", False):
+                return data, extension
+            image.thumbnail((self.size, self.size))
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG" if extension != "jpg" else "JPEG", optimize=True)
+        except Exception as e:
+            logging.warning(f"Unable to downscale avatar, keeping it as sent: {e}")
+            return data, extension
+
+        return buffer.getvalue(), extension if extension == "jpg" else "png"
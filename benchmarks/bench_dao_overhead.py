@@ -0,0 +1,70 @@
+import argparse
+import logging
+import random
+import time
+
+from benchmarks.common import make_user, make_user_db, remove_db
+from user_dao import UserDao
+
+
+def per_call_us(function, calls):
+    """
+    Time many calls of a function and return the mean time per call.
+
+    Parameters:
+        function (callable): the function to time, called with no arguments.
+        calls (int): the number of times to call the function.
+
+    Returns:
+        float: the mean call time in microseconds.
+    """
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) * 1000000 / calls
+
+
+def bench_dao_overhead(db, calls=20000):
+    """
+    Time the Python work GenericDao does around each query: building SQL, verifying sorts and projecting records.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        calls (int): the number of times to call each function.
+
+    Returns:
+        dict: the mean time per call in microseconds of each operation.
+    """
+
+    user_dao = UserDao()
+    multi_sort = [("type", "asc"), ("login", "desc")]
+    row = user_dao.read(db, 0, 1, "login")[0]
+    cursor = user_dao.decode_cursor(user_dao.encode_cursor(row, 0, "login"), 1, 25, "login")
+    multi_cursor = user_dao.decode_cursor(user_dao.encode_cursor(row, 0, multi_sort), 1, 25, multi_sort)
+    users = [make_user(user_id, random.Random(user_id)) for user_id in range(1, 1001)]
+
+    return {
+        "get_order_terms": per_call_us(lambda: user_dao.get_order_terms(multi_sort), calls),
+        "build_read_sql": per_call_us(lambda: user_dao.build_read_sql("login", True), calls),
+        "build_read_sql_seek": per_call_us(lambda: user_dao.build_read_sql(multi_sort, cursor=multi_cursor), calls),
+        "get_sort_expression": per_call_us(lambda: user_dao.get_sort_expression("login"), calls),
+        "read_25": per_call_us(lambda: user_dao.read(db, 0, 25, "login"), max(calls // 10, 1)),
+        "read_25_seek": per_call_us(lambda: user_dao.read(db, 1, 25, "login", cursor=cursor), max(calls // 10, 1)),
+        "create_many_1000": per_call_us(lambda: user_dao.create_many(db, users, on_conflict="ignore"),
+                                        max(calls // 1000, 1))
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the per-call Python overhead of GenericDao")
+    parser.add_argument("--calls", type=int, default=20000, help="number of calls to time for each operation")
+    parser.add_argument("--db", default="bench_dao_overhead", help="non-suffixed filename of the benchmark database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    db = make_user_db(args.db, 10000)
+    for name, microseconds in bench_dao_overhead(db, args.calls).items():
+        print(f"{name:>20} {microseconds:10.2f}us")
+    db.close()
+    remove_db(args.db)
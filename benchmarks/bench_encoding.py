@@ -0,0 +1,62 @@
+import argparse
+import json
+import logging
+
+from api import project_rows
+from benchmarks.common import make_user_db, time_call
+from response_encoder import json_encoders, ResponseEncoder
+from user_dao import UserDao
+
+# The row indexes sent for each projection: whole rows, what index.html reads, and only the visible columns
+projections = {"all": None, "index_html": (0, 1, 2, 5, 6), "visible": (0, 1, 2, 5)}
+
+
+def bench_encoding(db, page_sizes=(10, 25, 100), codings=("identity", "gzip", "br")):
+    """
+    Measure the bytes sent and the time to encode a /user page for each projection, JSON encoder and content coding.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        page_sizes (tuple): the numbers of records in each page.
+        codings (tuple): the content codings to try, skipping those not installed.
+
+    Returns:
+        list: a dict of the page size, projection, encoder, coding, bytes and encode time in milliseconds of each.
+    """
+
+    user_dao = UserDao()
+    results = []
+    for page_size in page_sizes:
+        rows = user_dao.read(db, 0, page_size, "id", False)
+        for projection, fields in projections.items():
+            payload = {"draw": 1, "recordsTotal": 1, "recordsFiltered": 1,
+                       "data": rows if fields is None else project_rows(rows, fields)}
+            for name in json_encoders:
+                for coding in codings:
+                    encoder = ResponseEncoder(name, min_size=None if coding == "identity" else 0)
+                    if coding != "identity" and encoder.choose_coding(coding, 0) != coding:
+                        continue
+                    body, _ = encoder.encode(payload, coding)
+                    results.append({"page_size": page_size, "projection": projection, "encoder": name,
+                                    "coding": coding, "bytes": len(body),
+                                    "encode_ms": time_call(lambda: encoder.encode(payload, coding))})
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare /user payload bytes and encode time per page")
+    parser.add_argument("--rows", type=int, default=10000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_encoding", help="non-suffixed filename of the benchmark database")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = bench_encoding(make_user_db(args.db, args.rows))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"page={result['page_size']:>5} {result['projection']:>10} {result['encoder']:>6} "
+                  f"{result['coding']:>8}  {result['bytes']:>8} bytes  {result['encode_ms']:8.3f}ms")
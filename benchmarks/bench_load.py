@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+from benchmarks.common import make_user_db
+
+# The commands serving the API on a port: the Flask development server as run by run_flask_app.bash, and the ASGI app
+servers = {
+    "flask": [sys.executable, "-m", "flask", "--app", "api", "run", "--host", "127.0.0.1", "--port", "{port}"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi_api:app", "--host", "127.0.0.1", "--port", "{port}",
+             "--log-level", "warning", "--no-access-log"]
+}
+
+
+def start_server(target, db_name, port):
+    """
+    Start serving the API from a database in a child process and wait until it accepts connections.
+
+    Parameters:
+        target (str): the servers entry to start.
+        db_name (str): non-suffixed filename of a database holding a git_user table.
+        port (int): the port to listen on.
+
+    Returns:
+        subprocess.Popen: the server process.
+    """
+
+    env = dict(os.environ, USER_API_DB=db_name, USER_API_SLOW_QUERY_MS="")
+    process = subprocess.Popen([arg.format(port=port) for arg in servers[target]], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f"{target} server did not start on port {port}")
+
+
+async def get(port, path):
+    """
+    Make one HTTP/1.1 GET request on a new connection.
+
+    Parameters:
+        port (int): the port the server listens on.
+        path (str): the path and query string to request.
+
+    Returns:
+        int: the response status code.
+    """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+
+    return int(response.split(b" ", 2)[1]) if response else 0
+
+
+async def run_clients(port, clients, duration, rows, seed=0):
+    """
+    Have concurrent clients page through the users table with random offsets and sorts for a while.
+
+    Parameters:
+        port (int): the port the server listens on.
+        clients (int): the number of concurrent clients.
+        duration (float): the number of seconds to run for.
+        rows (int): the number of users in the table.
+        seed (int): the seed of the random number generator choosing pages.
+
+    Returns:
+        dict: the request rate, latency percentiles in milliseconds and number of failed requests.
+    """
+
+    rng = random.Random(seed)
+    latencies = []
+    errors = [0]
+    deadline = time.monotonic() + duration
+
+    async def client():
+        while time.monotonic() < deadline:
+            query = {"draw": 1, "start": rng.randrange(0, max(rows - 25, 1)), "length": 25,
+                     "order[0][column]": rng.randrange(2), "order[0][dir]": rng.choice(["asc", "desc"]),
+                     "columns[0][name]": "id", "columns[1][name]": "login"}
+            started = time.perf_counter()
+            try:
+                status = await get(port, f"/user?{urlencode(query)}")
+            except OSError:
+                status = 0
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[0] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else None
+
+    return {"requests_per_second": len(latencies) / elapsed, "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95), "p99_ms": percentile(0.99), "requests": len(latencies), "errors": errors[0]}
+
+
+def bench_load(db_name, rows, targets=("flask", "asgi"), clients=(10, 100, 200), duration=10.0, port=5123):
+    """
+    Compare the request rate and latency of the API servers under increasing numbers of concurrent clients.
+
+    Parameters:
+        db_name (str): non-suffixed filename of a database holding a git_user table.
+        rows (int): the number of users in the table.
+        targets (tuple): the servers entries to compare.
+        clients (tuple): the numbers of concurrent clients to try.
+        duration (float): the number of seconds to run each load for.
+        port (int): the port to serve on.
+
+    Returns:
+        list: a dict of results for each server and number of clients.
+    """
+
+    results = []
+    for target in targets:
+        process = start_server(target, db_name, port)
+        try:
+            for count in clients:
+                result = asyncio.run(run_clients(port, count, duration, rows))
+                results.append(dict(result, server=target, clients=count))
+        finally:
+            process.terminate()
+            process.wait()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test /user on the Flask and ASGI servers")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic users in the table")
+    parser.add_argument("--clients", default="10,100,200", help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="number of seconds to run each load for")
+    parser.add_argument("--db", default="bench_load", help="non-suffixed filename of the benchmark database")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    make_user_db(args.db, args.rows).close()
+    results = bench_load(args.db, args.rows, clients=[int(count) for count in args.clients.split(",")],
+                         duration=args.duration)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['server']:>5} clients={result['clients']:>4}  {result['requests_per_second']:8.1f} req/s  "
+                  f"p50={result['p50_ms']:8.2f}ms  p95={result['p95_ms']:8.2f}ms  p99={result['p99_ms']:8.2f}ms  "
+                  f"errors={result['errors']}")
@@ -0,0 +1,91 @@
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+
+from benchmarks.common import make_user, make_user_db, remove_db
+from db import Db
+from user_dao import UserDao
+
+
+class RetypedUserDao(UserDao):
+    """
+    This is the git_user table with site_admin stored as an integer, a change that needs the table copied.
+    """
+
+    @property
+    def column_types(self):
+        return ["text", "integer", "text", "text", "text", "text", "integer"]
+
+    @property
+    def schema_version(self):
+        return 2
+
+
+def bench_migration(name, rows, batch_sizes=(1000, 10000, 100000, None), interval=0.002):
+    """
+    Time copying a git_user table to a new definition with Db.migrate_table while another connection keeps inserting
+    users, and measure how long that writer waits for each insert. The copy batches only hold the write lock briefly;
+    the longest wait is the final swap, which builds the new table's indexes.
+
+    Parameters:
+        name (str): non-suffixed filename of the benchmark database, which is deleted afterwards.
+        rows (int): the number of users in the table.
+        batch_sizes (tuple): the numbers of rows copied per transaction, where None copies in one transaction.
+        interval (float): the number of seconds the writer waits between inserts.
+
+    Returns:
+        list: a dict of the batch size, rows written during the copy, and migration, median and longest insert times
+            in milliseconds for each batch size.
+    """
+
+    results = []
+    for batch_size in batch_sizes:
+        remove_db(name)
+        make_user_db(name, rows).close()
+        db = Db(name, profile="performance")
+        user_dao = UserDao()
+        done = threading.Event()
+        waits = []
+
+        def write():
+            writer = Db(name, profile="performance")
+            rng = random.Random(1)
+            user_id = rows
+            while not done.is_set():
+                user_id += 1
+                started = time.perf_counter()
+                user_dao.create(writer, make_user(user_id, rng))
+                writer.commit()
+                waits.append(time.perf_counter() - started)
+                time.sleep(interval)
+            writer.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        started = time.perf_counter()
+        db.migrate_table(RetypedUserDao(), batch_size=batch_size or rows + 1, pause=0.001)
+        migrate_ms = (time.perf_counter() - started) * 1000
+        done.set()
+        thread.join()
+
+        results.append({"batch_size": batch_size, "writes": len(waits), "migrate_ms": migrate_ms,
+                        "median_insert_ms": statistics.median(waits) * 1000, "max_insert_ms": max(waits) * 1000})
+        db.destroy()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time an online table copy and the writer stalls it causes")
+    parser.add_argument("--rows", type=int, default=200000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_migration", help="non-suffixed filename of the database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for result in bench_migration(args.db, args.rows):
+        print(f"batch={str(result['batch_size'] or 'all'):>7}  migrate={result['migrate_ms']:9.1f}ms  "
+              f"writes={result['writes']:>6}  median insert={result['median_insert_ms']:7.2f}ms  "
+              f"longest insert={result['max_insert_ms']:8.1f}ms")
@@ -0,0 +1,53 @@
+import argparse
+import logging
+
+from benchmarks.common import make_user_db, time_call
+from user_dao import UserDao
+
+
+def bench_pagination(db, rows, page_size=25, sorts=(("id", False), ("login", False), ("login", True))):
+    """
+    Time reading a page at increasing depths in the table, by OFFSET and by cursor.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        rows (int): the number of users in the table.
+        page_size (int): the number of records in each page.
+        sorts (tuple): (column name, descending flag) orderings to time.
+
+    Returns:
+        list: a dict of timings in milliseconds for each ordering and depth.
+    """
+
+    user_dao = UserDao()
+    results = []
+    for sort_by, desc_flag in sorts:
+        for fraction in (0.0, 0.1, 0.5, 0.9, 0.99):
+            start = max(int(rows * fraction), 1)
+
+            # Find the record just before the page to build its cursor
+            row = user_dao.read(db, start - 1, 1, sort_by, desc_flag)[0]
+            token = user_dao.encode_cursor(row, start - 1, sort_by, desc_flag)
+            cursor = user_dao.decode_cursor(token, start, page_size, sort_by, desc_flag)
+
+            results.append({
+                "sort_by": sort_by,
+                "desc": desc_flag,
+                "start": start,
+                "offset_ms": time_call(lambda: user_dao.read(db, start, page_size, sort_by, desc_flag)),
+                "cursor_ms": time_call(lambda: user_dao.read(db, start, page_size, sort_by, desc_flag, cursor))
+            })
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare OFFSET and cursor pagination across page depth")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_pagination", help="non-suffixed filename of the benchmark database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for result in bench_pagination(make_user_db(args.db, args.rows), args.rows):
+        print(f"{result['sort_by']:>6} {'desc' if result['desc'] else 'asc ':4} start={result['start']:>9}  "
+              f"offset={result['offset_ms']:8.3f}ms  cursor={result['cursor_ms']:8.3f}ms")
@@ -0,0 +1,89 @@
+import argparse
+import logging
+
+from benchmarks.common import make_user_db, time_call
+from page_prefetcher import PagePrefetcher
+from user_dao import UserDao
+
+
+def browse(db, user_dao, start, pages, page_size, sort_by, desc_flag, search, prefetcher):
+    """
+    Page forward through the git_user table by cursor as the page does, starting from an offset.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        user_dao (UserDao): the user table.
+        start (int): the offset of the first page.
+        pages (int): the number of pages to read.
+        page_size (int): the number of records in each page.
+        sort_by (str): the column to sort on.
+        desc_flag (bool): sort in descending order?
+        search (str): the search term to filter by, if any.
+        prefetcher (PagePrefetcher): the prefetcher to read through, or None to read every page from the database.
+
+    Returns:
+        int: the number of records read.
+    """
+
+    rows = user_dao.read(db, start, page_size, sort_by, desc_flag, search=search, prefetcher=prefetcher)
+    count = len(rows)
+    for page in range(1, pages):
+        if not rows:
+            break
+        offset = start + page * page_size
+        token = user_dao.encode_cursor(rows[-1], offset - 1, sort_by, desc_flag, search=search)
+        cursor = user_dao.decode_cursor(token, offset, page_size, sort_by, desc_flag, search)
+        rows = user_dao.read(db, offset, page_size, sort_by, desc_flag, cursor, search, prefetcher=prefetcher)
+        count += len(rows)
+
+    return count
+
+
+def bench_prefetch(db, rows, pages=20, page_size=25, window_pages=(0, 1, 2, 4),
+                   browses=(("login", False, None), ("id", True, None), ("login", False, "Use"))):
+    """
+    Time paging forward through the git_user table by cursor with prefetchers reading different numbers of pages
+    around each page they miss.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        rows (int): the number of users in the table.
+        pages (int): the number of pages each browse reads.
+        page_size (int): the number of records in each page.
+        window_pages (tuple): the numbers of pages to prefetch in each direction, where 0 reads without a prefetcher.
+        browses (tuple): (column name, descending flag, search term) orderings to browse.
+
+    Returns:
+        list: a dict of the browse time in milliseconds and the hit rate for each ordering and number of pages.
+    """
+
+    user_dao = UserDao()
+    results = []
+    for sort_by, desc_flag, search in browses:
+        start = 0 if search else rows // 2
+        for window in window_pages:
+            prefetchers = []
+
+            def run():
+                prefetchers.append(PagePrefetcher(pages=window) if window else None)
+                browse(db, user_dao, start, pages, page_size, sort_by, desc_flag, search, prefetchers[-1])
+
+            browse_ms = time_call(run)
+            results.append({"sort_by": sort_by, "desc": desc_flag, "search": search, "pages": window,
+                            "browse_ms": browse_ms,
+                            "hit_rate": prefetchers[-1].stats()["hit_rate"] if window else None})
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time paging through the table with and without prefetching")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_prefetch", help="non-suffixed filename of the benchmark database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for result in bench_prefetch(make_user_db(args.db, args.rows), args.rows):
+        hit_rate = "-" if result["hit_rate"] is None else f"{result['hit_rate']:.2f}"
+        print(f"{result['sort_by']:>6} {'desc' if result['desc'] else 'asc ':4} search={result['search']!r:>6}  "
+              f"prefetch={result['pages']}  browse={result['browse_ms']:8.3f}ms  hit rate={hit_rate}")
@@ -0,0 +1,50 @@
+import argparse
+import logging
+
+from benchmarks.common import make_user_db, time_call
+from user_dao import UserDao
+
+
+def bench_search(db, terms=("a", "ab", "abc", "zq7", "Organization", "MDQ6VXNlcj0000")):
+    """
+    Time searching the git_user table for prefix and substring terms, reading the first page and counting matches
+    exactly and with the estimated count strategy.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        terms (tuple): the search terms to time; terms shorter than three characters match prefixes.
+
+    Returns:
+        list: a dict of match counts and timings in milliseconds for each term.
+    """
+
+    user_dao = UserDao()
+    results = []
+    for term in terms:
+        estimate, estimated = user_dao.count_records(db, term, "estimated")
+        results.append({
+            "search": term,
+            "kind": "prefix" if len(term) < 3 else "substring",
+            "matches": user_dao.get_count(db, term),
+            "page_ms": time_call(lambda: user_dao.read(db, 0, 25, "login", False, search=term)),
+            "count_ms": time_call(lambda: user_dao.get_count(db, term)),
+            "estimate": estimate,
+            "estimated": estimated,
+            "estimate_ms": time_call(lambda: user_dao.count_records(db, term, "estimated"))
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time searches of the git_user table")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_search", help="non-suffixed filename of the benchmark database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for result in bench_search(make_user_db(args.db, args.rows)):
+        print(f"{result['kind']:>9} {result['search']!r:>16} matches={result['matches']:>8}  "
+              f"page={result['page_ms']:8.3f}ms  count={result['count_ms']:8.3f}ms  "
+              f"{'estimate' if result['estimated'] else 'exact'}={result['estimate']:>8} "
+              f"in {result['estimate_ms']:8.3f}ms")
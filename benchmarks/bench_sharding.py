@@ -0,0 +1,75 @@
+import argparse
+import logging
+import random
+
+from benchmarks.common import make_user, remove_db, time_call
+from db import Db, ShardedDb
+from user_dao import UserDao
+
+
+def bench_sharding(name, rows, shard_counts=(1, 2, 4, 8), page_size=25):
+    """
+    Compare loading, counting and reading a git_user table in one file with the same table hashed across shards.
+
+    Parameters:
+        name (str): non-suffixed filename prefix of the benchmark databases, which are deleted afterwards.
+        rows (int): the number of users in the table.
+        shard_counts (tuple): the numbers of shards to try, where 1 is a plain Db.
+        page_size (int): the number of records in each page.
+
+    Returns:
+        list: a dict of timings in milliseconds for each number of shards.
+    """
+
+    user_dao = UserDao()
+    rng = random.Random(0)
+    users = [make_user(user_id, rng) for user_id in range(1, rows + 1)]
+
+    results = []
+    for shard_count in shard_counts:
+        db = Db(f"{name}_single") if shard_count == 1 else ShardedDb(f"{name}_{shard_count}", shard_count)
+        db.create_table(user_dao)
+
+        def load():
+            user_dao.create_many(db, users)
+            db.commit()
+
+        load_ms = time_call(load, repeat=1)
+        middle = rows // 2
+        page = user_dao.read(db, middle, page_size, "login")
+        token = user_dao.encode_cursor(page[-1], middle + page_size - 1, "login")
+        cursor = user_dao.decode_cursor(token, middle + page_size, page_size, "login")
+
+        results.append({
+            "shards": shard_count,
+            "load_ms": load_ms,
+            "count_ms": time_call(lambda: user_dao.get_count(db)),
+            "count_search_ms": time_call(lambda: user_dao.get_count(db, "ab")),
+            "read_first_ms": time_call(lambda: user_dao.read(db, 0, page_size, "login")),
+            "read_middle_ms": time_call(lambda: user_dao.read(db, middle, page_size, "login")),
+            "read_cursor_ms": time_call(lambda: user_dao.read(db, middle + page_size, page_size, "login",
+                                                              cursor=cursor))
+        })
+        db.close()
+
+        if shard_count == 1:
+            remove_db(f"{name}_single")
+        else:
+            for i in range(shard_count):
+                remove_db(f"{name}_{shard_count}_{i}")
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare one database file with the same table across shards")
+    parser.add_argument("--rows", type=int, default=200000, help="number of synthetic users in the table")
+    parser.add_argument("--shards", default="1,2,4,8", help="comma-separated numbers of shards to try")
+    parser.add_argument("--db", default="bench_sharding", help="non-suffixed filename prefix of the databases")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for result in bench_sharding(args.db, args.rows, [int(count) for count in args.shards.split(",")]):
+        print(f"shards={result['shards']:>2}  load={result['load_ms']:9.1f}ms  count={result['count_ms']:7.3f}ms  "
+              f"search count={result['count_search_ms']:8.3f}ms  first={result['read_first_ms']:7.3f}ms  "
+              f"middle={result['read_middle_ms']:8.3f}ms  cursor={result['read_cursor_ms']:7.3f}ms")
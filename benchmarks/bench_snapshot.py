@@ -0,0 +1,56 @@
+import argparse
+import logging
+
+from benchmarks.common import make_user_db, time_call
+from snapshot import TableSnapshot
+from user_dao import UserDao
+
+
+def bench_snapshot(db, rows, page_size=25, sorts=(("id", False), ("login", False), ("login", True))):
+    """
+    Time building a snapshot of the git_user table, then reading pages at increasing depths from the database and
+    from the snapshot.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        rows (int): the number of users in the table.
+        page_size (int): the number of records in each page.
+        sorts (tuple): (column name, descending flag) orderings to time.
+
+    Returns:
+        tuple: the snapshot's stats, and a dict of timings in milliseconds for each ordering and depth.
+    """
+
+    user_dao = UserDao()
+    snapshot = TableSnapshot(user_dao)
+    snapshot.refresh(db)
+
+    results = []
+    for sort_by, desc_flag in sorts:
+        for fraction in (0.0, 0.5, 0.99):
+            start = int(rows * fraction)
+            results.append({
+                "sort_by": sort_by,
+                "desc": desc_flag,
+                "start": start,
+                "db_ms": time_call(lambda: user_dao.read(db, start, page_size, sort_by, desc_flag)),
+                "snapshot_ms": time_call(lambda: user_dao.read(db, start, page_size, sort_by, desc_flag,
+                                                               snapshot=snapshot))
+            })
+
+    return snapshot.stats(), results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare reading pages from the database and from a snapshot")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of synthetic users in the table")
+    parser.add_argument("--db", default="bench_snapshot", help="non-suffixed filename of the benchmark database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    stats, results = bench_snapshot(make_user_db(args.db, args.rows), args.rows)
+    print(f"snapshot of {stats['records']} records in {stats['bytes'] / pow(2, 20):.1f}MiB "
+          f"built in {stats['build_seconds']:.2f}s")
+    for result in results:
+        print(f"{result['sort_by']:>6} {'desc' if result['desc'] else 'asc ':4} start={result['start']:>9}  "
+              f"db={result['db_ms']:8.3f}ms  snapshot={result['snapshot_ms']:8.3f}ms")
@@ -0,0 +1,88 @@
+import argparse
+import json
+import logging
+import os
+
+from flask import Flask, send_file, send_from_directory
+
+from benchmarks.common import time_call
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_legacy_app():
+    """
+    Build an app serving the page and images the way the API did before static assets were held in memory, reading
+    each file from disk on every request.
+
+    Parameters: None
+
+    Returns:
+        Flask: the app.
+    """
+
+    app = Flask("legacy_static", root_path=root)
+
+    @app.route('/')
+    def get_index():
+        return send_file(os.path.join(root, 'index.html'))
+
+    @app.route("/images/<filename>")
+    def get_image(filename):
+        return send_from_directory(os.path.join(root, "images"), filename)
+
+    return app
+
+
+def bench_static(requests_per_path=200):
+    """
+    Time serving the page and an image through the legacy routes and the in-memory static assets, and compare the
+    bytes sent with and without gzip.
+
+    Parameters:
+        requests_per_path (int): the number of requests made per timing.
+
+    Returns:
+        list: a dict of the path, server, coding, bytes and milliseconds per request of each.
+    """
+
+    os.environ.setdefault("USER_API_DB", "bench_static")
+    import api
+
+    image = api.static_assets.get("images/star.png")
+    paths = {"/": "/", "/images/star.png": f"/images/star.png?v={image.fingerprint}"}
+    clients = {"legacy": make_legacy_app().test_client(), "static_assets": api.app.test_client()}
+
+    results = []
+    for name, client in clients.items():
+        for path, fingerprinted in paths.items():
+            for coding in ("identity", "gzip"):
+                url = path if name == "legacy" else fingerprinted
+                headers = {"Accept-Encoding": coding}
+
+                def get():
+                    for _ in range(requests_per_path):
+                        client.get(url, headers=headers).close()
+
+                response = client.get(url, headers=headers)
+                results.append({"server": name, "path": path, "coding": coding, "bytes": len(response.get_data()),
+                                "ms_per_request": time_call(get) / requests_per_path})
+                response.close()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the legacy file routes with in-memory static assets")
+    parser.add_argument("--requests", type=int, default=200, help="number of requests per timing")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = bench_static(args.requests)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['server']:>13} {result['path']:>16} {result['coding']:>8}  {result['bytes']:>6} bytes  "
+                  f"{result['ms_per_request']:7.3f}ms")
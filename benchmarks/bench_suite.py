@@ -0,0 +1,219 @@
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+
+from benchmarks.common import make_user, make_user_db, time_call
+from user_dao import UserDao
+
+
+def bench_create(db, rows, batch_size=1000):
+    """
+    Time writing users past the end of a git_user table, one at a time and in a batch, then remove them again so the
+    table can be reused.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        rows (int): the number of users in the table.
+        batch_size (int): the number of users written by each batch.
+
+    Returns:
+        dict: the timings in milliseconds of each write.
+    """
+
+    user_dao = UserDao()
+    rng = random.Random(rows)
+    next_id = [rows + 1]
+
+    def make_users(count):
+        users = [make_user(user_id, rng) for user_id in range(next_id[0], next_id[0] + count)]
+        next_id[0] += count
+        return users
+
+    def create_one():
+        user_dao.create(db, make_users(1)[0])
+
+    def create_many():
+        user_dao.create_many(db, make_users(batch_size))
+        db.commit()
+
+    results = {
+        "create_ms": time_call(create_one),
+        f"create_many_{batch_size}_ms": time_call(create_many)
+    }
+
+    db.cursor.execute(f"DELETE FROM {user_dao.table_name} WHERE {user_dao.schema.primary_key} > ?", [rows])
+    db.commit()
+    return results
+
+
+def bench_read(db, rows, page_size=25, sorts=("id", "login", "node_id", "type")):
+    """
+    Time reading a page at increasing offsets for each sort column, ascending and descending.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        rows (int): the number of users in the table.
+        page_size (int): the number of records in each page.
+        sorts (tuple): the names of the columns to sort on.
+
+    Returns:
+        dict: the timings in milliseconds of each read, keyed by sort, direction and offset.
+    """
+
+    user_dao = UserDao()
+    results = {}
+    for sort_by in sorts:
+        for desc_flag in (False, True):
+            for offset in sorted({0, rows // 100, rows // 2, max(rows - page_size, 0)}):
+                key = f"read_{sort_by}_{'desc' if desc_flag else 'asc'}_{offset}_ms"
+                results[key] = time_call(lambda: user_dao.read(db, offset, page_size, sort_by, desc_flag))
+
+    return results
+
+
+def bench_count(db, terms=("ab", "Organization")):
+    """
+    Time counting every user and the users matching prefix and substring searches.
+
+    Parameters:
+        db (Db): a database holding a git_user table.
+        terms (tuple): the search terms to count.
+
+    Returns:
+        dict: the timings in milliseconds of each count.
+    """
+
+    user_dao = UserDao()
+    results = {"get_count_ms": time_call(lambda: user_dao.get_count(db))}
+    for term in terms:
+        results[f"get_count_search_{term}_ms"] = time_call(lambda: user_dao.get_count(db, term))
+
+    return results
+
+
+def bench_api(name, rows, page_size=25):
+    """
+    Time the /user route through the Flask test client, with every cache in front of the database emptied or set
+    aside before each request, and with the page already cached.
+
+    Parameters:
+        name (str): non-suffixed filename of a database holding a git_user table.
+        rows (int): the number of users in the table.
+        page_size (int): the number of records in each page.
+
+    Returns:
+        dict: the timings in milliseconds of each request.
+    """
+
+    # The API opens its connection pool on import, so point it at the benchmark database first
+    os.environ["USER_API_DB"] = name
+    api = importlib.reload(sys.modules["api"]) if "api" in sys.modules else importlib.import_module("api")
+    client = api.app.test_client()
+
+    def get(start, column=0, direction="asc", search=""):
+        response = client.get("/user", query_string={
+            "draw": 1, "start": start, "length": page_size, "order[0][column]": column, "order[0][dir]": direction,
+            "columns[0][name]": "id", "columns[1][name]": "login", "search[value]": search
+        })
+        assert response.status_code == 200, f"/user returned status {response.status_code}"
+
+    # A cold request must read the database, so empty the response cache and page windows and bypass any snapshot
+    def cold(*args):
+        api.response_cache.clear()
+        if api.page_prefetcher is not None:
+            api.page_prefetcher.clear()
+        snapshot, api.snapshot = api.snapshot, None
+        try:
+            get(*args)
+        finally:
+            api.snapshot = snapshot
+
+    results = {}
+    for offset in sorted({0, rows // 2}):
+        results[f"api_user_id_{offset}_ms"] = time_call(lambda: cold(offset))
+        results[f"api_user_login_desc_{offset}_ms"] = time_call(lambda: cold(offset, 1, "desc"))
+    results["api_user_search_ms"] = time_call(lambda: cold(0, 1, "asc", "abc"))
+    results["api_user_cached_ms"] = time_call(lambda: get(0))
+
+    api.pool.close()
+    return results
+
+
+def get_environment():
+    """
+    Describe the code and platform being benchmarked, so results from different commits can be told apart.
+
+    Parameters: None
+
+    Returns:
+        dict: the git commit, versions and time of the run.
+    """
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    }
+
+
+def compare(results, baseline):
+    """
+    Print the ratio of each timing to the same timing in a baseline run.
+
+    Parameters:
+        results (dict): the results of this run.
+        baseline (dict): the results of an earlier run.
+
+    Returns: None
+    """
+
+    for rows, timings in results["results"].items():
+        for key, value in timings.items():
+            before = baseline["results"].get(rows, {}).get(key)
+            if before:
+                print(f"{rows:>9} {key:>40} {before:10.3f}ms -> {value:10.3f}ms  x{value / before:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the DAO and API hot paths on synthetic git_user tables")
+    parser.add_argument("--sizes", default="10000,1000000,10000000",
+                        help="comma-separated numbers of synthetic users in each table")
+    parser.add_argument("--db", default="bench_suite", help="non-suffixed filename prefix of the benchmark databases")
+    parser.add_argument("--output", help="file to write the JSON results to, rather than standard output")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    output = {"environment": get_environment(), "results": {}}
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        name = f"{args.db}_{rows}"
+        db = make_user_db(name, rows)
+        output["results"][str(rows)] = {**bench_create(db, rows), **bench_read(db, rows), **bench_count(db),
+                                        **bench_api(name, rows)}
+        db.close()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(output, json.load(file))
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import random
+import time
+
+from benchmarks.common import make_user, remove_db
+from db import Db, WriteQueue
+from user_dao import UserDao
+
+
+def bench_write_queue(name, rows, page_size=100, max_batch=1000):
+    """
+    Compare the time a producer spends writing pages of users inline, committing each page, with queuing them on a
+    WriteQueue, and the time until the queued pages are all committed.
+
+    Parameters:
+        name (str): non-suffixed filename prefix of the benchmark databases, which are deleted afterwards.
+        rows (int): the number of users to write.
+        page_size (int): the number of users in each page.
+        max_batch (int): the number of records after which the queue commits a group.
+
+    Returns:
+        dict: the timings in milliseconds and the queue's stats.
+    """
+
+    user_dao = UserDao()
+    rng = random.Random(0)
+    pages = [[make_user(user_id, rng) for user_id in range(first_id, min(first_id + page_size, rows + 1))]
+             for first_id in range(1, rows + 1, page_size)]
+    results = {}
+
+    db = Db(f"{name}_inline", profile="performance")
+    db.create_table(user_dao)
+    started = time.perf_counter()
+    for page in pages:
+        user_dao.create_many(db, page)
+        db.commit()
+    results["inline_ms"] = (time.perf_counter() - started) * 1000
+    db.destroy()
+
+    db = Db(f"{name}_queued", profile="performance")
+    db.create_table(user_dao)
+    write_queue = WriteQueue(f"{name}_queued", profile="performance", max_batch=max_batch)
+    started = time.perf_counter()
+    for page in pages:
+        write_queue.create_many(user_dao, page)
+    results["queued_producer_ms"] = (time.perf_counter() - started) * 1000
+    write_queue.flush()
+    results["queued_committed_ms"] = (time.perf_counter() - started) * 1000
+    results["queue"] = write_queue.stats()
+    write_queue.close()
+    db.destroy()
+
+    for suffix in ("inline", "queued"):
+        remove_db(f"{name}_{suffix}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare inline page commits with a group-committing write queue")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic users to write")
+    parser.add_argument("--db", default="bench_write_queue", help="non-suffixed filename prefix of the databases")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = bench_write_queue(args.db, args.rows)
+    print(f"inline={results['inline_ms']:9.1f}ms  queued producer={results['queued_producer_ms']:9.1f}ms  "
+          f"queued committed={results['queued_committed_ms']:9.1f}ms  commits={results['queue']['commits']}")
@@ -0,0 +1,95 @@
+import os
+import random
+import string
+import time
+
+from db import Db
+from user_dao import UserDao
+
+
+def make_user(user_id, rng):
+    """
+    Create a synthetic GitHub user record shaped like the ones returned by the GitHub users API.
+
+    Parameters:
+        user_id (int): the id of the new user.
+        rng (random.Random): the random number generator to draw values from.
+
+    Returns:
+        dict: the user record.
+    """
+
+    login = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(rng.randint(4, 15)))
+    return {
+        "login": login,
+        "id": user_id,
+        "node_id": f"MDQ6VXNlcj{user_id:08d}",
+        "avatar_url": f"https://avatars.githubusercontent.com/u/{user_id}?v=4",
+        "html_url": f"https://github.com/{login}",
+        "type": "Organization" if rng.random() < 0.1 else "User",
+        "site_admin": rng.random() < 0.01
+    }
+
+
+def make_user_db(name, rows, seed=0):
+    """
+    Create a database holding a git_user table of synthetic users, reusing an existing file of the right size.
+
+    Parameters:
+        name (str): name and non-suffixed filename of the database.
+        rows (int): the number of users in the table.
+        seed (int): the seed of the random number generator used to create users.
+
+    Returns:
+        Db: the populated database.
+    """
+
+    db = Db(name)
+    user_dao = UserDao()
+    if db.does_table_exist(user_dao) and user_dao.get_count(db) == rows:
+        return db
+
+    user_dao.create_or_clear_table(db)
+    rng = random.Random(seed)
+    for first_id in range(1, rows + 1, 100000):
+        last_id = min(first_id + 100000, rows + 1)
+        user_dao.create_many(db, (make_user(user_id, rng) for user_id in range(first_id, last_id)))
+        db.commit()
+
+    return db
+
+
+def remove_db(name):
+    """
+    Delete a benchmark database file if it exists.
+
+    Parameters:
+        name (str): name and non-suffixed filename of the database.
+
+    Returns: None
+    """
+
+    if os.path.exists(f'{name}.db'):
+        os.remove(f'{name}.db')
+
+
+def time_call(function, repeat=5):
+    """
+    Time a function call, returning the best of several runs to reduce scheduling noise.
+
+    Parameters:
+        function (callable): the function to time, called with no arguments.
+        repeat (int): the number of times to call the function.
+
+    Returns:
+        float: the fastest call time in milliseconds.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
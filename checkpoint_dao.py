@@ -0,0 +1,29 @@
+from generic_dao import GenericDao
+
+
+class CheckpointDao(GenericDao):
+    """
+    This defines the name and structure of the seed_checkpoint table, which records how far each seeding job has got.
+
+     Attributes:
+            CheckpointDao.table_name (str): the name of this table in the database.
+            CheckpointDao.columns (list): the names of the columns in this table.
+            CheckpointDao.column_types (list): the data types of the columns in this table.
+            CheckpointDao.primary_key_index (int): the index of the table primary key.
+    """
+
+    @property
+    def table_name(self):
+        return "seed_checkpoint"
+
+    @property
+    def columns(self):
+        return ["name", "last_id", "count"]
+
+    @property
+    def column_types(self):
+        return ["text", "integer", "integer"]
+
+    @property
+    def primary_key_index(self):
+        return 0
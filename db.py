@@ -1,6 +1,34 @@
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
+from urllib.parse import quote
+import zlib
+
+
+def supports_trigram_search():
+    """
+    Check whether the sqlite3 module's SQLite library has FTS5 with the trigram tokenizer, added in SQLite 3.34.
+
+    Parameters: None
+
+    Returns:
+        bool: Can search indexes be created?
+    """
+
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(text, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
 
 
 class Db:
@@ -10,23 +38,72 @@ class Db:
     Attributes:
         Db.max_records (int): the largest number of records that can possibly be handled by the database.
         Db.max_limit (int): the largest number of records to be returned in any query.
+        Db.profiles (dict): named sets of pragmas to apply to new connections.
+        Db.trigram_search (bool): can search indexes be created? Without them searches scan the table.
     """
 
     max_records = pow(2, 64)
     max_limit = 100
+    trigram_search = supports_trigram_search()
+
+    # The performance profile lets readers proceed during writes (WAL) and trades durability of the last transactions
+    # on power loss (synchronous=NORMAL) for fewer fsyncs
+    profiles = {
+        "default": {},
+        "performance": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": pow(2, 28),
+            "cache_size": -65536,
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000
+        }
+    }
 
-    def __init__(self, name='github'):
+    def __init__(self, name='github', pool=None, profile=None, read_only=False, metrics=None, check_same_thread=True):
         """
         This Db class constructor.
 
         Parameters:
             name (string): name and non-suffixed filename of the database.
+            pool (ConnectionPool): a pool to borrow the connection from rather than opening a new one.
+            profile (str): the name of the Db.profiles entry to apply to a new connection.
+            read_only (bool): open a new connection that cannot write to the database?
+            metrics (Metrics): the registry to record statement timings in, defaulting to the pool's, if any.
+            check_same_thread (bool): only allow a new connection to be used by the thread that opened it?
         """
 
-        self.db_name = name
-        self.filename = f'{self.db_name}.db'
-        self.connection = sqlite3.connect(self.filename)
-        self.cursor = self.connection.cursor()
+        self.pool = pool
+        self._transaction_depth = 0
+        if pool is None:
+            self.db_name = name
+            self.filename = f'{self.db_name}.db'
+            self.connection = Db.connect(self.filename, profile, read_only, check_same_thread)
+        else:
+            self.db_name = pool.db_name
+            self.filename = pool.filename
+            self.connection = pool.checkout()
+            metrics = pool.metrics if metrics is None else metrics
+
+        if metrics is None:
+            self.cursor = self.connection.cursor()
+        else:
+            self.cursor = self.connection.cursor(InstrumentedCursor)
+            self.cursor.metrics = metrics
+
+    def close(self):
+        """
+        Close the database connection, or return it to its pool when it was borrowed from one.
+
+        Parameters: None
+        Returns: None
+        """
+
+        self.cursor.close()
+        if self.pool is None:
+            self.connection.close()
+        else:
+            self.pool.checkin(self.connection)
 
     def destroy(self):
         """
@@ -36,19 +113,83 @@ class Db:
         Returns: None
         """
 
-        self.cursor.close()
-        self.connection.close()
+        self.close()
         os.remove(self.filename)
+        for suffix in ["-wal", "-shm"]:
+            if os.path.exists(f"{self.filename}{suffix}"):
+                os.remove(f"{self.filename}{suffix}")
+
+    @staticmethod
+    def connect(filename, profile=None, read_only=False, check_same_thread=True):
+        """
+        Open a connection to a database file and apply a performance profile to it.
+
+        Parameters:
+            filename (str): the filename of the database.
+            profile (str): the name of the Db.profiles entry to apply.
+            read_only (bool): open the database with mode=ro so the connection cannot write to it?
+            check_same_thread (bool): only allow the connection to be used by the thread that opened it?
+
+        Returns:
+            sqlite3.Connection: the new connection.
+        """
+
+        if profile and profile not in Db.profiles:
+            raise ValueError(f"unknown database profile {profile}")
+
+        if read_only:
+            connection = sqlite3.connect(f"file:{quote(os.path.abspath(filename))}?mode=ro", uri=True,
+                                         check_same_thread=check_same_thread)
+        else:
+            connection = sqlite3.connect(filename, check_same_thread=check_same_thread)
+
+        # The journal mode is stored in the database file, so only a connection that can write may change it
+        for pragma, value in Db.profiles[profile or "default"].items():
+            if pragma == "journal_mode" and read_only:
+                continue
+            connection.execute(f"PRAGMA {pragma} = {value}").fetchall()
+
+        return connection
 
     def commit(self):
         """
-        Write any pending operations to the database.
+        Write any pending operations to the database, unless they are part of an explicit transaction which will
+        write them when it ends.
 
         Parameters: None
         Returns: None
         """
 
-        self.connection.commit()
+        if self._transaction_depth == 0:
+            self.connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group every operation in the with block, including schema changes, into one transaction which is committed
+        when the block ends and rolled back if it raises. Other connections see all of the changes or none of them.
+        Nested blocks join the outermost transaction.
+
+        Parameters: None
+        Returns: None
+        """
+
+        if self._transaction_depth == 0:
+            self.connection.commit()
+            self.cursor.execute("BEGIN IMMEDIATE")
+        self._transaction_depth += 1
+
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.connection.rollback()
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.connection.commit()
 
     def does_table_exist(self, dao):
         """
@@ -64,12 +205,14 @@ class Db:
         sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{dao.table_name}'"
         return bool(self.cursor.execute(sql).fetchone())
 
-    def create_table(self, dao):
+    def create_table(self, dao, indexed=True):
         """
         Creates a table in the database defined by the passed dao object.
 
         Parameters:
             dao (GenericDao): The table name to create.
+            indexed (bool): Also create the table's indexes, statistics and search index? A table being bulk loaded
+                is quicker to fill without them.
 
         Returns: None
         """
@@ -78,8 +221,309 @@ class Db:
         col_list = [f"{c} {t}" for c, t in zip(dao.columns, dao.column_types)]
         col_list[dao.primary_key_index] = f"{col_list[dao.primary_key_index]} primary key"
         self.cursor.execute(f"CREATE TABLE {dao.table_name} ({', '.join(col_list)})")
+        self.set_schema_version(dao)
+        if indexed:
+            self.create_indexes(dao)
+            self.create_table_stats(dao)
+            self.create_search_index(dao)
+        self.commit()
+
+    def replace_table(self, dao, shadow_dao):
+        """
+        Replaces a table with a shadow copy created without indexes, such as one from GenericDao.get_shadow, in one
+        transaction. The shadow is renamed over the table and given its indexes, statistics and search index before
+        the transaction commits, so readers see the old table until the new one is complete.
+
+        Parameters:
+            dao (GenericDao): The table to replace.
+            shadow_dao (GenericDao): The fully written shadow copy of the table.
+
+        Returns: None
+        """
+
+        logging.info(f"Replacing {dao.table_name} table with {shadow_dao.table_name}")
+        with self.transaction():
+            self.cursor.execute(f"DROP TABLE IF EXISTS {dao.table_name}")
+            self.cursor.execute(f"DROP TABLE IF EXISTS {dao.table_name}_search")
+            self.cursor.execute(f"ALTER TABLE {shadow_dao.table_name} RENAME TO {dao.table_name}")
+            self.create_indexes(dao)
+            self.create_table_stats(dao)
+            self.create_search_index(dao)
+            self.cursor.execute("DELETE FROM schema_version WHERE table_name = ?", (shadow_dao.table_name,))
+            self.set_schema_version(dao)
+
+    def get_schema_version(self, dao):
+        """
+        Reads the schema version stored for the passed dao object's table when it was created or last migrated.
+
+        Parameters:
+            dao (GenericDao): The table to check.
+
+        Returns:
+            int: the schema version of the table, or None if none is stored, as for tables created before versions were
+                kept.
+        """
+
+        try:
+            row = self.cursor.execute("SELECT version FROM schema_version WHERE table_name = ?",
+                                      (dao.table_name,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+        return row[0] if row else None
+
+    def set_schema_version(self, dao):
+        """
+        Stores the passed dao object's schema version as the version of its table.
+
+        Parameters:
+            dao (GenericDao): The table whose definition the stored table now matches.
+
+        Returns: None
+        """
+
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (table_name text primary key, version integer)")
+        self.cursor.execute("INSERT INTO schema_version VALUES (?, ?) "
+                            "ON CONFLICT (table_name) DO UPDATE SET version = excluded.version",
+                            (dao.table_name, dao.schema_version))
+        self.commit()
+
+    def migrate_table(self, dao, batch_size=10000, pause=0.0, progress=None):
+        """
+        Brings a table whose stored schema version differs from the passed dao object's up to its definition without
+        emptying it. Columns appended to the end of the definition are added in place with ALTER TABLE, and indexes and
+        the search index are created or dropped to match, all in one transaction. Any other change, such as a dropped,
+        reordered or retyped column or a new primary key, copies the table into a shadow with the new definition in
+        batches of batch_size rows, each its own short transaction, while triggers mirror writes made to the table
+        during the copy. The shadow then replaces the table with Db.replace_table. Copied values keep their column by
+        name and new columns start out null.
+
+        Parameters:
+            dao (GenericDao): The new definition of the table.
+            batch_size (int): the number of rows to copy in each transaction.
+            pause (float): the number of seconds to wait between batches, letting other writers in.
+            progress (callable): called with the number of rows copied so far after each batch, if any.
+
+        Returns:
+            str: "current" if the table was already at the dao's version, "altered" if it was changed in place or
+                "copied" if it was copied into a new table.
+        """
+
+        version = self.get_schema_version(dao)
+        if version == dao.schema_version:
+            return "current"
+        if version is not None and version > dao.schema_version:
+            raise ValueError(f"Table {dao.table_name} is at schema version {version}, newer than {dao.schema_version}")
+
+        # Compare the stored columns, in their stored order, with the definition
+        stored = [(name, column_type.lower(), bool(pk))
+                  for _, name, column_type, _, _, pk in self.cursor.execute(f"PRAGMA table_info({dao.table_name})")]
+        if not stored:
+            raise ValueError(f"Table {dao.table_name} does not exist")
+        defined = [(c, t.lower(), i == dao.primary_key_index)
+                   for i, (c, t) in enumerate(zip(dao.columns, dao.column_types))]
+
+        # Inserts list values in definition order, so columns can only be added in place after the stored ones
+        if defined[:len(stored)] == stored and not any(pk for _, _, pk in defined[len(stored):]):
+            logging.info(f"Migrating {dao.table_name} table from version {version} to {dao.schema_version} in place")
+            with self.transaction():
+                for column, column_type, _ in defined[len(stored):]:
+                    self.cursor.execute(f"ALTER TABLE {dao.table_name} ADD COLUMN {column} {column_type}")
+                self.create_indexes(dao)
+                if self.get_row_count(dao) is None:
+                    self.create_table_stats(dao)
+                self.create_search_index(dao)
+                self.set_schema_version(dao)
+            return "altered"
+
+        primary_key = dao.columns[dao.primary_key_index]
+        columns = [c for c, _, _ in defined if c in {name for name, _, _ in stored}]
+        if primary_key not in columns:
+            raise ValueError(f"Table {dao.table_name} cannot be copied to a new primary key {primary_key} it lacks")
+
+        logging.info(f"Migrating {dao.table_name} table from version {version} to {dao.schema_version} by copying")
+        self._copy_table(dao, columns, batch_size, pause, progress)
+        return "copied"
+
+    def create_table_stats(self, dao):
+        """
+        Keeps a row count and a data version for the passed dao object's table in the table_stats table. Triggers keep
+        both up to date in the same transaction as every write, so they are exact for all connections and processes:
+        the count changes with each insert and delete and the version with every insert, update and delete.
+
+        Parameters:
+            dao (GenericDao): The table to keep statistics for.
+
+        Returns: None
+        """
+
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS table_stats "
+                            "(table_name text primary key, row_count integer, version integer default 0)")
+        if "version" not in [row[1] for row in self.cursor.execute("PRAGMA table_info(table_stats)")]:
+            self.cursor.execute("ALTER TABLE table_stats ADD COLUMN version integer default 0")
+
+        for trigger, change in [("insert", "+ 1"), ("update", "+ 0"), ("delete", "- 1")]:
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {dao.table_name}_count_{trigger}")
+            self.cursor.execute(f"CREATE TRIGGER {dao.table_name}_count_{trigger} "
+                                f"AFTER {trigger.upper()} ON {dao.table_name} BEGIN "
+                                f"UPDATE table_stats SET row_count = row_count {change}, version = version + 1 "
+                                f"WHERE table_name = '{dao.table_name}'; END")
+
+        # Start from the real count so tables created before their statistics existed are counted correctly, and from
+        # a clock-based version so a recreated table never repeats the versions of the one it replaced
+        self.cursor.execute(f"INSERT INTO table_stats VALUES (?, (SELECT COUNT(*) FROM {dao.table_name}), ?) "
+                            f"ON CONFLICT (table_name) DO UPDATE SET row_count = excluded.row_count, "
+                            f"version = MAX(version + 1, excluded.version)", (dao.table_name, time.time_ns()))
+        self.commit()
+
+    def create_search_index(self, dao):
+        """
+        Creates a trigram FTS5 index over the searchable columns of the passed dao object's table, kept in sync with
+        the table by triggers. The index stores no copy of the text; it reads it from the table by primary key. SQLite
+        older than 3.34 has no trigram tokenizer, so no index is created and searches scan the table.
+
+        Parameters:
+            dao (GenericDao): The table to index.
+
+        Returns: None
+        """
+
+        if not dao.searchable_columns:
+            return
+        if not Db.trigram_search:
+            logging.warning(f"Not indexing {dao.table_name} for search as SQLite {sqlite3.sqlite_version} has no "
+                            f"trigram tokenizer")
+            return
+
+        primary_key = dao.columns[dao.primary_key_index]
+        if dao.column_types[dao.primary_key_index] != "integer":
+            logging.warning(f"Not indexing {dao.table_name} for search as its primary key is not an integer")
+            return
+
+        name = f"{dao.table_name}_search"
+        columns = ', '.join(dao.searchable_columns)
+        new_columns = ', '.join(f"new.{c}" for c in dao.searchable_columns)
+        old_columns = ', '.join(f"old.{c}" for c in dao.searchable_columns)
+
+        # Rebuild the index whenever it is created or its columns have changed
+        sql = "SELECT sql FROM sqlite_master WHERE type='table' AND name=?"
+        index_sql = f"CREATE VIRTUAL TABLE {name} USING fts5({columns}, content='{dao.table_name}', " \
+                    f"content_rowid='{primary_key}', tokenize='trigram')"
+        row = self.cursor.execute(sql, (name,)).fetchone()
+        if row and row[0] == index_sql:
+            return
+
+        logging.info(f"Creating search index {name}")
+        if row:
+            self.cursor.execute(f"DROP TABLE {name}")
+        self.cursor.execute(index_sql)
+        self.cursor.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+
+        for trigger in ["insert", "update", "delete"]:
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {name}_{trigger}")
+        self.cursor.execute(f"CREATE TRIGGER {name}_insert AFTER INSERT ON {dao.table_name} BEGIN "
+                            f"INSERT INTO {name} (rowid, {columns}) VALUES (new.{primary_key}, {new_columns}); END")
+        self.cursor.execute(f"CREATE TRIGGER {name}_delete AFTER DELETE ON {dao.table_name} BEGIN "
+                            f"INSERT INTO {name} ({name}, rowid, {columns}) "
+                            f"VALUES ('delete', old.{primary_key}, {old_columns}); END")
+        self.cursor.execute(f"CREATE TRIGGER {name}_update AFTER UPDATE ON {dao.table_name} BEGIN "
+                            f"INSERT INTO {name} ({name}, rowid, {columns}) "
+                            f"VALUES ('delete', old.{primary_key}, {old_columns}); "
+                            f"INSERT INTO {name} (rowid, {columns}) VALUES (new.{primary_key}, {new_columns}); END")
         self.commit()
 
+    def get_row_count(self, dao):
+        """
+        Reads the row count kept for the passed dao object's table by create_table_stats.
+
+        Parameters:
+            dao (GenericDao): The table to count.
+
+        Returns:
+            int: the number of rows in the table, or None if the table has no statistics.
+        """
+
+        try:
+            row = self.cursor.execute("SELECT row_count FROM table_stats WHERE table_name = ?",
+                                      (dao.table_name,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+        return row[0] if row else None
+
+    def get_row_estimate(self, dao):
+        """
+        Estimates the number of rows in the passed dao object's table without counting them, for tables that have no
+        row count. The estimate is the count recorded by the last ANALYZE if there is one, otherwise the span of the
+        table's rowids, which is exact unless rows have been deleted from the middle of the table.
+
+        Parameters:
+            dao (GenericDao): The table to estimate.
+
+        Returns:
+            int: the estimated number of rows in the table.
+        """
+
+        try:
+            row = self.cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1",
+                                      (dao.table_name,)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row:
+            return int(row[0].split()[0])
+
+        first, last = self.cursor.execute(f"SELECT (SELECT MIN(rowid) FROM {dao.table_name}), "
+                                          f"(SELECT MAX(rowid) FROM {dao.table_name})").fetchone()
+        return 0 if first is None else last - first + 1
+
+    def create_indexes(self, dao):
+        """
+        Creates the sort indexes declared by the passed dao object and drops any it no longer declares.
+
+        Parameters:
+            dao (GenericDao): The table whose indexes to maintain.
+
+        Returns: None
+        """
+
+        indexes = {name: f"CREATE INDEX {name} ON {dao.table_name} ({expressions})"
+                   for name, expressions in dao.get_sort_indexes().items()}
+
+        # Drop sort indexes that are no longer declared or whose definition has changed
+        sql = "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=?"
+        existing = {name: index_sql for name, index_sql in self.cursor.execute(sql, (dao.table_name,)).fetchall()
+                    if name.startswith(f"{dao.table_name}_") and name.endswith("_sort")}
+        for name, index_sql in existing.items():
+            if indexes.get(name) != index_sql:
+                logging.info(f"Dropping index {name}")
+                self.cursor.execute(f"DROP INDEX {name}")
+
+        for name, index_sql in indexes.items():
+            if existing.get(name) != index_sql:
+                logging.info(f"Creating index {name}")
+                self.cursor.execute(index_sql)
+        self.commit()
+
+    def get_data_version(self, dao):
+        """
+        Reads the data version kept for the passed dao object's table by create_table_stats. The version changes
+        whenever the table is written, so anything derived from the table is stale once its version differs.
+
+        Parameters:
+            dao (GenericDao): The table to check.
+
+        Returns:
+            int: the data version of the table, or None if the table has no statistics.
+        """
+
+        try:
+            row = self.cursor.execute("SELECT version FROM table_stats WHERE table_name = ?",
+                                      (dao.table_name,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+        return row[0] if row else None
+
     def delete_table(self, dao):
         """
         Deletes a table in the database with the same name as the passed dao object.
@@ -92,4 +536,876 @@ class Db:
 
         logging.info(f"Deleting {dao.table_name} table")
         self.cursor.execute(f"DROP TABLE {dao.table_name}")
+        self.cursor.execute(f"DROP TABLE IF EXISTS {dao.table_name}_search")
+        if self.get_row_count(dao) is not None:
+            self.cursor.execute("DELETE FROM table_stats WHERE table_name = ?", (dao.table_name,))
+        if self.get_schema_version(dao) is not None:
+            self.cursor.execute("DELETE FROM schema_version WHERE table_name = ?", (dao.table_name,))
         self.commit()
+
+    def _copy_table(self, dao, columns, batch_size, pause, progress):
+        """
+        Copies a table into a shadow with the passed dao object's definition in batches, then replaces the table with
+        it. Triggers on the table repeat every insert, update and delete in the shadow while the copy runs, so writes
+        made between batches are kept, and they are dropped along with the old table.
+
+        Parameters:
+            dao (GenericDao): The new definition of the table.
+            columns (list): the columns the table and its new definition have in common.
+            batch_size (int): the number of rows to copy in each transaction.
+            pause (float): the number of seconds to wait between batches.
+            progress (callable): called with the number of rows copied so far after each batch, if any.
+
+        Returns: None
+        """
+
+        table = dao.table_name
+        shadow_dao = dao.get_shadow()
+        primary_key = dao.columns[dao.primary_key_index]
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{c}" for c in columns)
+
+        # Start from an empty shadow and fresh triggers, discarding any left by an interrupted migration
+        with self.transaction():
+            for trigger in ["insert", "update", "delete"]:
+                self.cursor.execute(f"DROP TRIGGER IF EXISTS {table}_migrate_{trigger}")
+            if self.does_table_exist(shadow_dao):
+                self.delete_table(shadow_dao)
+            self.create_table(shadow_dao, indexed=False)
+            self.cursor.execute(f"CREATE TRIGGER {table}_migrate_insert AFTER INSERT ON {table} BEGIN "
+                                f"INSERT OR REPLACE INTO {shadow_dao.table_name} ({column_list}) "
+                                f"VALUES ({new_values}); END")
+            self.cursor.execute(f"CREATE TRIGGER {table}_migrate_update AFTER UPDATE ON {table} BEGIN "
+                                f"DELETE FROM {shadow_dao.table_name} WHERE {primary_key} = old.{primary_key}; "
+                                f"INSERT OR REPLACE INTO {shadow_dao.table_name} ({column_list}) "
+                                f"VALUES ({new_values}); END")
+            self.cursor.execute(f"CREATE TRIGGER {table}_migrate_delete AFTER DELETE ON {table} BEGIN "
+                                f"DELETE FROM {shadow_dao.table_name} WHERE {primary_key} = old.{primary_key}; END")
+
+        # Copy in rowid order; rows the triggers have already written are overwritten with the same values
+        last_rowid = -pow(2, 63)
+        copied = 0
+        while True:
+            with self.transaction():
+                through = self.cursor.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? "
+                                              f"ORDER BY rowid LIMIT ?)", (last_rowid, batch_size)).fetchone()[0]
+                if through is None:
+                    break
+                self.cursor.execute(f"INSERT OR REPLACE INTO {shadow_dao.table_name} ({column_list}) "
+                                    f"SELECT {column_list} FROM {table} WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                                    (last_rowid, through))
+                copied += self.cursor.rowcount
+            last_rowid = through
+            logging.debug(f"Copied {copied} rows of {table}")
+            if progress is not None:
+                progress(copied)
+            if pause:
+                time.sleep(pause)
+
+        self.replace_table(dao, shadow_dao)
+
+
+class ShardedDb:
+    """
+    This is a table store split across several SQLite files, each a Db of its own, so the records and the writers of
+    one logical table are spread over several databases. Records are placed by primary key, either by hash or by id
+    range, and GenericDao fans its reads, counts and creates out to every shard, running the shard queries in
+    parallel on a thread pool. Like Db, a ShardedDb is used by one thread at a time.
+
+    The placement of records depends on the number of shards and the range boundaries, so a sharded table must always
+    be opened with the ones it was written with. Each shard commits separately: transactions are not atomic across
+    shards.
+
+    Attributes:
+        ShardedDb.db_name (str): the name shared by the shards, which are stored in {db_name}_{i}.db files.
+        ShardedDb.shards (list): the Db of each shard.
+        ShardedDb.boundaries (list): the first primary key of every shard after the first when records are placed by
+            range, or None when they are placed by hash.
+        ShardedDb.max_limit (int): the largest number of records to be returned in any query.
+    """
+
+    max_limit = Db.max_limit
+
+    def __init__(self, name='github', shard_count=4, boundaries=None, profile=None, read_only=False, metrics=None,
+                 workers=None):
+        """
+        This ShardedDb class constructor.
+
+        Parameters:
+            name (string): the name shared by the shards, which are stored in {name}_{i}.db files.
+            shard_count (int): the number of shards to hash records across, ignored when boundaries are passed.
+            boundaries (list): the first primary key of every shard after the first, in increasing order, to place
+                records by range rather than by hash.
+            profile (str): the name of the Db.profiles entry to apply to each shard's connection.
+            read_only (bool): open connections that cannot write to the shards?
+            metrics (Metrics): the registry to record statement timings in, if any.
+            workers (int): the number of threads querying shards in parallel, defaulting to one per shard.
+        """
+
+        if boundaries is not None:
+            if list(boundaries) != sorted(boundaries):
+                raise ValueError(f"shard boundaries {boundaries} are not in increasing order")
+            shard_count = len(boundaries) + 1
+        if shard_count < 1:
+            raise ValueError(f"a sharded database needs at least 1 shard, not {shard_count}")
+
+        self.db_name = name
+        self.boundaries = list(boundaries) if boundaries is not None else None
+
+        # The shards' connections are used by the executor's threads, one query at a time each
+        self.shards = [Db(f"{name}_{i}", profile=profile, read_only=read_only, metrics=metrics,
+                          check_same_thread=False) for i in range(shard_count)]
+        self._executor = ThreadPoolExecutor(max_workers=workers or shard_count, thread_name_prefix=f"{name}_shard")
+
+    def get_shard(self, key):
+        """
+        Get the shard holding the record with the passed primary key.
+
+        Parameters:
+            key: the primary key value of the record.
+
+        Returns:
+            Db: the record's shard.
+        """
+
+        if self.boundaries is not None:
+            return self.shards[bisect_right(self.boundaries, key)]
+
+        # Python's hash of a string changes between processes, so hash text with a stable checksum
+        if isinstance(key, int):
+            return self.shards[key % len(self.shards)]
+        return self.shards[zlib.crc32(str(key).encode()) % len(self.shards)]
+
+    def map(self, function, shards=None):
+        """
+        Call a function on each shard in parallel.
+
+        Parameters:
+            function (callable): takes a shard's Db and returns a result.
+            shards (list): the shards to call the function on, defaulting to all of them.
+
+        Returns:
+            list: the result of each call, in the order of the shards.
+        """
+
+        shards = self.shards if shards is None else shards
+        if len(shards) == 1:
+            return [function(shards[0])]
+        return list(self._executor.map(function, shards))
+
+    def close(self):
+        """
+        Close every shard's connection and stop the shard query threads.
+
+        Parameters: None
+        Returns: None
+        """
+
+        for shard in self.shards:
+            shard.close()
+        self._executor.shutdown(wait=True)
+
+    def destroy(self):
+        """
+        Close every shard's connection and delete the shard files.
+
+        Parameters: None
+        Returns: None
+        """
+
+        self._executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.destroy()
+
+    def commit(self):
+        """
+        Write any pending operations to every shard, outside of explicit transactions.
+
+        Parameters: None
+        Returns: None
+        """
+
+        self.map(Db.commit)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group the operations on each shard in the with block into a transaction per shard. The shards commit one after
+        another when the block ends, so a failure part way through can leave some shards committed.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.transaction())
+            yield self
+
+    def does_table_exist(self, dao):
+        """
+        Checks to see if a the table name in a dao exists in every shard.
+
+        Parameters:
+            dao (GenericDao): The table name to look for.
+
+        Returns:
+            bool: Does the table name exist in every shard?
+        """
+
+        return all(self.map(lambda shard: shard.does_table_exist(dao)))
+
+    def create_table(self, dao, indexed=True):
+        """
+        Creates a table defined by the passed dao object in every shard.
+
+        Parameters:
+            dao (GenericDao): The table name to create.
+            indexed (bool): Also create the table's indexes, statistics and search index?
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.create_table(dao, indexed))
+
+    def replace_table(self, dao, shadow_dao):
+        """
+        Replaces a table with a shadow copy in every shard, one shard at a time.
+
+        Parameters:
+            dao (GenericDao): The table to replace.
+            shadow_dao (GenericDao): The fully written shadow copy of the table.
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.replace_table(dao, shadow_dao))
+
+    def get_schema_version(self, dao):
+        """
+        Reads the schema version stored for the passed dao object's table in every shard.
+
+        Parameters:
+            dao (GenericDao): The table to check.
+
+        Returns:
+            int: the lowest schema version of the shards' tables, or None if any shard has none stored.
+        """
+
+        versions = self.map(lambda shard: shard.get_schema_version(dao))
+        return None if None in versions else min(versions)
+
+    def migrate_table(self, dao, batch_size=10000, pause=0.0, progress=None):
+        """
+        Brings the passed dao object's table up to its definition in every shard, in parallel.
+
+        Parameters:
+            dao (GenericDao): The new definition of the table.
+            batch_size (int): the number of rows to copy in each transaction.
+            pause (float): the number of seconds to wait between batches.
+            progress (callable): called with the number of rows each shard has copied so far after each batch, if any.
+
+        Returns:
+            list: how each shard's table was migrated, as returned by Db.migrate_table.
+        """
+
+        return self.map(lambda shard: shard.migrate_table(dao, batch_size, pause, progress))
+
+    def create_table_stats(self, dao):
+        """
+        Keeps a row count and a data version for the passed dao object's table in every shard.
+
+        Parameters:
+            dao (GenericDao): The table to keep statistics for.
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.create_table_stats(dao))
+
+    def create_search_index(self, dao):
+        """
+        Creates the search index of the passed dao object's table in every shard.
+
+        Parameters:
+            dao (GenericDao): The table to index.
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.create_search_index(dao))
+
+    def create_indexes(self, dao):
+        """
+        Creates the sort indexes declared by the passed dao object in every shard.
+
+        Parameters:
+            dao (GenericDao): The table whose indexes to maintain.
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.create_indexes(dao))
+
+    def get_row_count(self, dao):
+        """
+        Adds up the row counts kept for the passed dao object's table in every shard.
+
+        Parameters:
+            dao (GenericDao): The table to count.
+
+        Returns:
+            int: the number of rows in the table, or None if any shard's table has no statistics.
+        """
+
+        counts = self.map(lambda shard: shard.get_row_count(dao))
+        return None if None in counts else sum(counts)
+
+    def get_data_version(self, dao):
+        """
+        Combines the data versions kept for the passed dao object's table in every shard. Each shard's version only
+        ever grows, so their sum changes whenever any shard is written.
+
+        Parameters:
+            dao (GenericDao): The table to check.
+
+        Returns:
+            int: the data version of the table, or None if any shard's table has no statistics.
+        """
+
+        versions = self.map(lambda shard: shard.get_data_version(dao))
+        return None if None in versions else sum(versions)
+
+    def delete_table(self, dao):
+        """
+        Deletes the table with the same name as the passed dao object from every shard.
+
+        Parameters:
+            dao (GenericDao): The table name to delete.
+
+        Returns: None
+        """
+
+        self.map(lambda shard: shard.delete_table(dao))
+
+
+class WriteQueue:
+    """
+    This is a single writer for one database on a background thread. Producers queue writes and carry on; the writer
+    applies them in the order queued and commits them in groups, closing a group once it holds max_batch records or
+    max_delay seconds after its first write, so many small writes share one commit. Each write runs in a savepoint so
+    a failed write is rolled back alone. Producers block only when max_pending writes are waiting.
+
+    Every write returns a Future resolved once the write is committed, or failed, and flush waits for everything queued
+    before it.
+
+    Attributes:
+        WriteQueue.db_name (str): name and non-suffixed filename of the database.
+        WriteQueue.max_batch (int): the number of records after which a group is committed.
+        WriteQueue.max_delay (float): the longest time in seconds a write waits for others to share its commit.
+        WriteQueue.max_pending (int): the number of writes that may wait before producers block.
+    """
+
+    def __init__(self, name='github', profile=None, max_batch=1000, max_delay=0.05, max_pending=1000, metrics=None):
+        """
+        This WriteQueue class constructor.
+
+        Parameters:
+            name (string): name and non-suffixed filename of the database.
+            profile (str): the name of the Db.profiles entry to apply to the writer's connection.
+            max_batch (int): the number of records after which a group is committed.
+            max_delay (float): the longest time in seconds a write waits for others to share its commit.
+            max_pending (int): the number of writes that may wait before producers block.
+            metrics (Metrics): the registry to record statement timings in, if any.
+        """
+
+        self.db_name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        # Open the connection here so a database that cannot be opened fails the caller, then hand it to the writer
+        self._db = Db(name, profile=profile, metrics=metrics, check_same_thread=False)
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._writes = 0
+        self._records = 0
+        self._failures = 0
+        self._commits = 0
+        self._largest_commit = 0
+        self._blocked_seconds = 0.0
+
+        self._writer = threading.Thread(target=self._run, name=f"{name}_writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, function, *args, size=1):
+        """
+        Queue a write, blocking only while the queue is full.
+
+        Parameters:
+            function (callable): called on the writer thread with the writer's Db and args to make the write. It may
+                use Db.transaction and Db.commit, which join the group's transaction.
+            args: the arguments to pass to the function after the Db.
+            size (int): the number of records the write holds, counted towards max_batch.
+
+        Returns:
+            concurrent.futures.Future: resolved with the function's result once the write is committed.
+        """
+
+        future = Future()
+        self._put((future, function, args, size))
+        return future
+
+    def create(self, dao, value_dict):
+        """
+        Queue the creation of a record, as GenericDao.create.
+
+        Parameters:
+            dao (GenericDao): the table to write to.
+            value_dict (dict): the values of the new record by column name.
+
+        Returns:
+            concurrent.futures.Future: resolved once the record is committed.
+        """
+
+        return self.submit(dao.create, value_dict)
+
+    def create_many(self, dao, value_dicts, on_conflict=None):
+        """
+        Queue the creation of many records, as GenericDao.create_many.
+
+        Parameters:
+            dao (GenericDao): the table to write to.
+            value_dicts (list): dicts holding the values of the new records by column name.
+            on_conflict (str): what to do when a record's primary key already exists, as for GenericDao.create_many.
+
+        Returns:
+            concurrent.futures.Future: resolved with the number of records written once they are committed.
+        """
+
+        value_dicts = list(value_dicts)
+        return self.submit(dao.create_many, value_dicts, on_conflict, size=max(len(value_dicts), 1))
+
+    def flush(self, timeout=None):
+        """
+        Wait until every write queued so far is committed or has failed.
+
+        Parameters:
+            timeout (float): the longest time in seconds to wait, or None to wait as long as it takes.
+
+        Returns: None
+        """
+
+        future = Future()
+        self._put((future, None, (), 0))
+        future.result(timeout)
+
+    def close(self):
+        """
+        Commit every queued write, then stop the writer and close its connection.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def stats(self):
+        """
+        Get usage metrics for the queue.
+
+        Parameters: None
+
+        Returns:
+            dict: the writes waiting, writes, records and failed writes applied, commits, the most records in one
+                commit and the time producers spent blocked on a full queue in seconds.
+        """
+
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "writes": self._writes,
+                "records": self._records,
+                "failures": self._failures,
+                "commits": self._commits,
+                "largest_commit": self._largest_commit,
+                "blocked_seconds": self._blocked_seconds
+            }
+
+    def _put(self, item):
+        """
+        Put an item on the queue, waiting for room and timing the wait.
+
+        Parameters:
+            item (tuple): a (future, function, args, size) write, with no function for a flush.
+
+        Returns: None
+        """
+
+        if self._closed:
+            raise RuntimeError(f"write queue for {self.db_name} is closed")
+
+        started = time.perf_counter()
+        self._queue.put(item)
+        blocked = time.perf_counter() - started
+        if blocked > 0.001:
+            with self._lock:
+                self._blocked_seconds += blocked
+
+    def _run(self):
+        """
+        Apply queued writes in groups until the queue is closed.
+
+        Parameters: None
+        Returns: None
+        """
+
+        try:
+            closing = False
+            while not closing:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                # Gather writes until the group is full, its time is up, a flush is asked for or the queue closes
+                batch = [item]
+                size = item[3]
+                deadline = time.monotonic() + self.max_delay
+                while size < self.max_batch and batch[-1][1] is not None:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        closing = True
+                        break
+                    batch.append(item)
+                    size += item[3]
+
+                self._apply(batch)
+        finally:
+            self._db.close()
+
+    def _apply(self, batch):
+        """
+        Make a group of writes in one transaction and resolve their futures once it is committed.
+
+        Parameters:
+            batch (list): the (future, function, args, size) items to apply, with no function for a flush.
+
+        Returns: None
+        """
+
+        # A group of flushes has nothing to commit
+        if all(function is None for _, function, _, _ in batch):
+            for future, *_ in batch:
+                future.set_result(None)
+            return
+
+        db = self._db
+        results = []
+        try:
+            with db.transaction():
+                for future, function, args, size in batch:
+                    if function is None:
+                        results.append((future, None, None))
+                        continue
+
+                    db.cursor.execute("SAVEPOINT write_queue")
+                    try:
+                        result = function(db, *args)
+                    except Exception as e:
+                        db.cursor.execute("ROLLBACK TO write_queue")
+                        db.cursor.execute("RELEASE write_queue")
+                        results.append((future, None, e))
+                    else:
+                        db.cursor.execute("RELEASE write_queue")
+                        results.append((future, result, None))
+        except Exception as e:
+            logging.exception(f"Unable to commit {len(batch)} queued writes to {self.db_name}")
+            results = [(future, None, e) for future, *_ in batch]
+
+        applied = [item for item, (_, _, error) in zip(batch, results) if item[1] is not None and error is None]
+        with self._lock:
+            self._writes += len(applied)
+            self._records += sum(item[3] for item in applied)
+            self._failures += sum(1 for item, (_, _, error) in zip(batch, results)
+                                  if item[1] is not None and error is not None)
+            self._commits += 1
+            self._largest_commit = max(self._largest_commit, sum(item[3] for item in applied))
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    This is a cursor that times every statement it runs and records it in a Metrics registry. The rows of a query are
+    fetched as soon as it runs, so the timing covers the whole query and the number of rows is known; the cursor then
+    hands out the fetched rows. Db only uses it for bounded queries; large reads such as GenericDao.iterate open their
+    own cursors.
+
+    Attributes:
+        InstrumentedCursor.metrics (Metrics): the registry to record statements in.
+    """
+
+    metrics = None
+    _rows = None
+    _position = 0
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._rows = super().fetchall() if self.description is not None else None
+        self._position = 0
+
+        rows = len(self._rows) if self._rows is not None else max(self.rowcount, 0)
+        self.metrics.observe_query(self.connection, sql, parameters, time.perf_counter() - started, rows)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._rows = None
+
+        self.metrics.observe_query(self.connection, sql, (), time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        if self._rows is None or self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size=None):
+        if self._rows is None:
+            return []
+        end = self._position + (self.arraysize if size is None else size)
+        rows = self._rows[self._position:end]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) - self._position) if self._rows is not None else []
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ConnectionPool:
+    """
+    This is a bounded, thread-safe pool of sqlite3 connections to one database, shared by the Db objects of a process.
+    A thread that already holds a connection gets the same one back, so nested Db objects never deadlock the pool.
+
+    Attributes:
+        ConnectionPool.db_name (str): name and non-suffixed filename of the database.
+        ConnectionPool.filename (str): the filename of the database.
+        ConnectionPool.size (int): the largest number of connections the pool will open.
+        ConnectionPool.timeout (float): the number of seconds to wait for a free connection before giving up.
+        ConnectionPool.profile (str): the name of the Db.profiles entry applied to each connection.
+        ConnectionPool.read_only (bool): are the connections unable to write to the database?
+        ConnectionPool.metrics (Metrics): the registry Db objects using the pool record statement timings in, if any.
+    """
+
+    def __init__(self, name='github', size=4, timeout=10.0, profile=None, read_only=False, metrics=None):
+        """
+        This ConnectionPool class constructor.
+
+        Parameters:
+            name (string): name and non-suffixed filename of the database.
+            size (int): the largest number of connections the pool will open.
+            timeout (float): the number of seconds to wait for a free connection before giving up.
+            profile (str): the name of the Db.profiles entry to apply to each connection.
+            read_only (bool): open connections that cannot write to the database?
+            metrics (Metrics): the registry Db objects using the pool record statement timings in, if any.
+        """
+
+        if size < 1:
+            raise ValueError(f"connection pool size must be at least 1, not {size}")
+
+        self.db_name = name
+        self.filename = f'{self.db_name}.db'
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile
+        self.read_only = read_only
+        self.metrics = metrics
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._local = threading.local()
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def checkout(self):
+        """
+        Borrow a connection from the pool, opening one if the pool is not yet full and waiting if it is.
+
+        Parameters: None
+
+        Returns:
+            sqlite3.Connection: a healthy connection to the database.
+        """
+
+        # Hand a thread the connection it already holds
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        started = time.perf_counter()
+        connection = None
+        with self._condition:
+            while connection is None:
+                if self._closed:
+                    raise RuntimeError(f"connection pool for {self.filename} is closed")
+
+                if self._idle:
+                    connection = self._idle.pop()
+                elif self._open < self.size:
+                    self._open += 1
+                    break
+                else:
+                    remaining = self.timeout - (time.perf_counter() - started)
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        self._timeouts += 1
+                        raise TimeoutError(f"no connection to {self.filename} free after {self.timeout} seconds")
+
+            waited = time.perf_counter() - started
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        # Replace connections that fail their health check, and open new ones outside the lock
+        if connection is not None and not self._is_healthy(connection):
+            logging.warning(f"Replacing unhealthy connection to {self.filename}")
+            connection.close()
+            connection = None
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except sqlite3.Error:
+                with self._condition:
+                    self._open -= 1
+                    self._condition.notify()
+                raise
+
+        self._local.held = connection
+        self._local.depth = 1
+        return connection
+
+    def checkin(self, connection):
+        """
+        Return a borrowed connection to the pool, rolling back anything left uncommitted.
+
+        Parameters:
+            connection (sqlite3.Connection): a connection returned by checkout.
+
+        Returns: None
+        """
+
+        if getattr(self._local, "held", None) is not connection:
+            raise ValueError(f"connection was not checked out of the pool for {self.filename} by this thread")
+
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.held = None
+
+        if connection.in_transaction:
+            logging.warning(f"Rolling back uncommitted work on a connection to {self.filename}")
+            connection.rollback()
+
+        with self._condition:
+            if self._closed:
+                self._open -= 1
+                connection.close()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Close every idle connection and refuse further checkouts; borrowed connections close when returned.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with self._condition:
+            self._closed = True
+            for connection in self._idle:
+                connection.close()
+            self._open -= len(self._idle)
+            self._idle = []
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Get usage metrics for the pool.
+
+        Parameters: None
+
+        Returns:
+            dict: the pool size, open and idle connections, checkouts, timeouts and checkout wait times in seconds.
+        """
+
+        with self._condition:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max
+            }
+
+    def _connect(self):
+        """
+        Open a new connection to the database which may be used from any thread that checks it out.
+
+        Parameters: None
+
+        Returns:
+            sqlite3.Connection: the new connection.
+        """
+
+        return Db.connect(self.filename, self.profile, self.read_only, check_same_thread=False)
+
+    @staticmethod
+    def _is_healthy(connection):
+        """
+        Check that a pooled connection can still run a query.
+
+        Parameters:
+            connection (sqlite3.Connection): the connection to check.
+
+        Returns:
+            bool: Is the connection usable?
+        """
+
+        try:
+            connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
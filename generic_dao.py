@@ -1,4 +1,104 @@
+import base64
+from collections import OrderedDict
+import functools
+import heapq
+from itertools import islice
+import json
 import logging
+import threading
+from types import MappingProxyType
+
+from db import Db, ShardedDb
+from snapshot import sort_key
+
+
+class TableSchema:
+    """
+    This is the immutable metadata of a table, built once per GenericDao subclass so that the hot paths look up
+    columns in constant time and reuse SQL rather than rebuilding it on every call.
+
+     Attributes:
+            TableSchema.table_name (str): the name of this table in the database.
+            TableSchema.columns (tuple): the names of the columns in this table.
+            TableSchema.column_types (tuple): the data types of the columns in this table.
+            TableSchema.primary_key_index (int): the index of the table primary key.
+            TableSchema.primary_key (str): the name of the table primary key.
+            TableSchema.column_index (mapping): the index of each column, keyed by name.
+            TableSchema.sort_expressions (mapping): the SQL expression each column sorts by, keyed by name.
+            TableSchema.sortable_columns (tuple): the names of the columns offered for sorting.
+            TableSchema.searchable_columns (tuple): the names of the text columns covered by the search index.
+            TableSchema.compound_sorts (tuple): tuples of sortable column names commonly sorted on together.
+            TableSchema.select_sql (str): the SELECT clause reading every column of the table.
+            TableSchema.insert_sql (mapping): the INSERT statement for each create_many on_conflict value.
+    """
+
+    __slots__ = ("table_name", "columns", "column_types", "primary_key_index", "primary_key", "column_index",
+                 "sort_expressions", "sortable_columns", "searchable_columns", "compound_sorts", "select_sql",
+                 "insert_sql", "sql_cache")
+
+    # The most SQL strings and ordering normalizations to remember per table
+    max_cached = 1024
+
+    def __init__(self, dao):
+        """
+        This TableSchema class constructor.
+
+        Parameters:
+            dao (GenericDao): the table whose metadata to freeze.
+        """
+
+        columns = tuple(dao.columns)
+        column_types = tuple(dao.column_types)
+        primary_key = columns[dao.primary_key_index]
+        placeholders = ', '.join('?' * len(columns))
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != primary_key)
+
+        values = {
+            "table_name": dao.table_name,
+            "columns": columns,
+            "column_types": column_types,
+            "primary_key_index": dao.primary_key_index,
+            "primary_key": primary_key,
+            "column_index": MappingProxyType({c: i for i, c in enumerate(columns)}),
+            "sort_expressions": MappingProxyType({c: f"LOWER({c})" if t == "text" else c
+                                                  for c, t in zip(columns, column_types)}),
+            "sortable_columns": tuple(dao.sortable_columns),
+            "searchable_columns": tuple(dao.searchable_columns),
+            "compound_sorts": tuple(tuple(columns) for columns in dao.compound_sorts),
+            "select_sql": f"SELECT {', '.join(columns)} FROM {dao.table_name}",
+            "insert_sql": MappingProxyType({
+                None: f"INSERT INTO {dao.table_name} VALUES ({placeholders})",
+                "ignore": f"INSERT OR IGNORE INTO {dao.table_name} VALUES ({placeholders})",
+                "update": f"INSERT INTO {dao.table_name} VALUES ({placeholders}) "
+                          f"ON CONFLICT ({primary_key}) DO UPDATE SET {updates}"
+            }),
+            "sql_cache": {}
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TableSchema of {self.table_name} is immutable")
+
+    def cached(self, key, build):
+        """
+        Get a value derived from this schema, building and remembering it on first use.
+
+        Parameters:
+            key (tuple): a hashable description of the value.
+            build (callable): the function that builds the value, called with no arguments.
+
+        Returns:
+            object: the value.
+        """
+
+        value = self.sql_cache.get(key)
+        if value is None:
+            value = build()
+            if len(self.sql_cache) < TableSchema.max_cached:
+                self.sql_cache[key] = value
+
+        return value
 
 
 class GenericDao:
@@ -10,8 +110,30 @@ class GenericDao:
             GenericDao.columns (list): the names of the columns in this table.
             GenericDao.column_types (list): the data types of the columns in this table.
             GenericDao.primary_key_index (int): the index of the table primary key.
+            GenericDao.sortable_columns (list): the names of the columns offered for sorting, each backed by an index.
+            GenericDao.searchable_columns (list): the names of the text columns covered by the search index.
+            GenericDao.compound_sorts (list): tuples of sortable column names commonly sorted on together, each backed
+                by an index.
+            GenericDao.count_strategy (str): how get_count counts records by default, one of
+                GenericDao.count_strategies.
+            GenericDao.schema_version (int): the version of this table's definition, to be increased whenever the
+                columns, indexes or search columns change so that Db.migrate_table brings stored tables up to date.
+            GenericDao.schema (TableSchema): the frozen metadata of this table, built once per class.
     """
 
+    _schemas = {}
+    _shadows = {}
+
+    # Records are counted exactly on every call, exactly once per version of the table, or estimated from the table's
+    # statistics and the first search matches
+    count_strategies = ("exact", "cached", "estimated")
+
+    # The number of search matches an estimated count samples, and the most counts the cached strategy remembers
+    estimate_sample = 1000
+    max_cached_counts = 1024
+    _counts = OrderedDict()
+    _counts_lock = threading.Lock()
+
     @property
     def table_name(self):
         raise NotImplementedError
@@ -28,6 +150,52 @@ class GenericDao:
     def primary_key_index(self):
         raise NotImplementedError
 
+    @property
+    def sortable_columns(self):
+        return []
+
+    @property
+    def searchable_columns(self):
+        return []
+
+    @property
+    def compound_sorts(self):
+        return []
+
+    @property
+    def count_strategy(self):
+        return "exact"
+
+    @property
+    def schema_version(self):
+        return 1
+
+    @property
+    def schema(self):
+        schema = GenericDao._schemas.get(type(self))
+        if schema is None:
+            schema = GenericDao._schemas[type(self)] = TableSchema(self)
+        return schema
+
+    def get_shadow(self):
+        """
+        Get a DAO for a shadow copy of this table, named after it with a _shadow suffix. A table can be rebuilt in
+        its shadow while readers use it, then replaced by the shadow with Db.replace_table.
+
+        Parameters: None
+
+        Returns:
+            GenericDao: an instance of a subclass of this DAO's class differing only in its table name.
+        """
+
+        shadow_class = GenericDao._shadows.get(type(self))
+        if shadow_class is None:
+            table_name = f"{self.table_name}_shadow"
+            shadow_class = GenericDao._shadows[type(self)] = type(f"{type(self).__name__}Shadow", (type(self),), {
+                "table_name": property(lambda shadow: table_name)
+            })
+        return shadow_class()
+
     def clear_table(self, db):
         """
         Delete all records from the table.
@@ -38,6 +206,10 @@ class GenericDao:
         Returns: None
         """
 
+        if isinstance(db, ShardedDb):
+            db.map(self.clear_table)
+            return
+
         logging.info(f"Clearning {self.table_name} table")
         db.cursor.execute(f"DELETE FROM {self.table_name}")
         db.commit()
@@ -54,21 +226,156 @@ class GenericDao:
 
         if db.does_table_exist(self):
             self.clear_table(db)
+            db.create_indexes(self)
+            db.create_table_stats(self)
+            db.create_search_index(self)
         else:
             db.create_table(self)
 
-    def get_count(self, db):
+    def get_count(self, db, search=None, strategy=None):
         """
-        Get the number of records for this table in the passed database.
+        Get the number of records for this table in the passed database, which may be an estimate under the
+        estimated count strategy.
 
         Parameters:
             db (Db): the database on which to operate.
+            search (str): only count records matching this search term, as read does.
+            strategy (str): the count strategy to use, one of GenericDao.count_strategies, defaulting to the DAO's.
 
         Returns:
             int: the number of records in the table.
        """
 
-        return db.cursor.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+        return self.count_records(db, search, strategy)[0]
+
+    def count_records(self, db, search=None, strategy=None):
+        """
+        Count the records for this table in the passed database with a count strategy. The exact strategy counts on
+        every call: tables with statistics are counted in constant time, others and searches by reading every
+        matching record. The cached strategy counts exactly once per data version of the table. The estimated strategy
+        uses the row count when the table has one and otherwise estimates it with Db.get_row_estimate, and counts the
+        first estimate_sample matches of a trigram search, extrapolating over the rest of the table from the primary
+        key of the last one when there are more.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            search (str): only count records matching this search term, as read does.
+            strategy (str): the count strategy to use, one of GenericDao.count_strategies, defaulting to the DAO's.
+
+        Returns:
+            tuple: the number of records and whether it is an estimate.
+       """
+
+        strategy = strategy or self.count_strategy
+        if strategy not in GenericDao.count_strategies:
+            raise ValueError(f"Unknown count strategy {strategy}, expected one of {', '.join(self.count_strategies)}")
+
+        if isinstance(db, ShardedDb):
+            counts = db.map(lambda shard: self.count_records(shard, search, strategy))
+            return sum(count for count, _ in counts), any(estimated for _, estimated in counts)
+
+        if strategy == "cached":
+            return self._count_cached(db, search), False
+        if strategy == "estimated":
+            return self._count_estimated(db, search)
+        return self._count_exact(db, search), False
+
+    def _count_exact(self, db, search=None):
+        """
+        Count the records for this table in the passed database exactly.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            search (str): only count records matching this search term.
+
+        Returns:
+            int: the number of records in the table.
+        """
+
+        schema = self.schema
+        if search:
+            where_string, params = self._build_search(search)
+            sql_string = f"SELECT COUNT(*) FROM {schema.table_name} WHERE {where_string}"
+            logging.debug(f"Executing get_count: {sql_string}")
+            return db.cursor.execute(sql_string, params).fetchone()[0]
+
+        count = db.get_row_count(self)
+        if count is None:
+            count = db.cursor.execute(f"SELECT COUNT(*) FROM {schema.table_name}").fetchone()[0]
+
+        return count
+
+    def _count_cached(self, db, search=None):
+        """
+        Count the records for this table in the passed database exactly, reusing the count of an earlier call while
+        the table's data version is unchanged. Tables without statistics are counted on every call.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            search (str): only count records matching this search term.
+
+        Returns:
+            int: the number of records in the table.
+        """
+
+        version = db.get_data_version(self)
+        if version is None:
+            return self._count_exact(db, search)
+
+        key = (db.filename, self.table_name, search or None)
+        with GenericDao._counts_lock:
+            entry = GenericDao._counts.get(key)
+            if entry is not None and entry[0] == version:
+                GenericDao._counts.move_to_end(key)
+                return entry[1]
+
+        count = self._count_exact(db, search)
+        with GenericDao._counts_lock:
+            GenericDao._counts[key] = (version, count)
+            GenericDao._counts.move_to_end(key)
+            while len(GenericDao._counts) > GenericDao.max_cached_counts:
+                GenericDao._counts.popitem(last=False)
+
+        return count
+
+    def _count_estimated(self, db, search=None):
+        """
+        Estimate the number of records for this table in the passed database without reading them all.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            search (str): only count records matching this search term.
+
+        Returns:
+            tuple: the number of records and whether it is an estimate.
+        """
+
+        schema = self.schema
+        count = db.get_row_count(self)
+        estimated = count is None
+        if estimated:
+            count = db.get_row_estimate(self)
+        if not search:
+            return count, estimated
+
+        # Short terms are counted on the sort indexes, which is no slower than sampling them, and without a search
+        # index there is nothing to sample
+        if len(search) < 3 or not schema.searchable_columns or not Db.trigram_search:
+            return self._count_exact(db, search), False
+
+        # The search index returns matches in primary key order, so the key of the last sampled match tells how much
+        # of the table the sample covers. This assumes matches are spread evenly over the keys; a term matching only
+        # the lowest keys is overestimated
+        search_table = f"{schema.table_name}_search"
+        sample, last = db.cursor.execute(f"SELECT COUNT(*), MAX(rowid) FROM (SELECT rowid FROM {search_table} "
+                                         f"WHERE {search_table} MATCH ? LIMIT ?)",
+                                         (self._build_phrase(search), GenericDao.estimate_sample)).fetchone()
+        if sample < GenericDao.estimate_sample:
+            return sample, False
+
+        first, final = db.cursor.execute(f"SELECT (SELECT MIN(rowid) FROM {schema.table_name}), "
+                                         f"(SELECT MAX(rowid) FROM {schema.table_name})").fetchone()
+        return min(max(round(sample * (final - first + 1) / (last - first + 1)), sample), max(count, sample)), True
 
     def create(self, db, value_dict):
         """
@@ -86,9 +393,14 @@ class GenericDao:
             logging.error(f"create passed an object of type {type(value_dict)}")
             return
 
+        if isinstance(db, ShardedDb):
+            self.create(db.get_shard(value_dict.get(self.schema.primary_key)), value_dict)
+            return
+
         # Create a list of new values in order of the table columns
+        schema = self.schema
         value_list = []
-        for column_name in self.columns:
+        for column_name in schema.columns:
             if column_name in value_dict:
                 value_list.append(value_dict[column_name])
             else:
@@ -96,20 +408,180 @@ class GenericDao:
                 value_list.append(None)
 
         # Write a row to the database
-        sql_string = f"INSERT INTO {self.table_name} VALUES ({', '.join('?' * len(self.columns))})"
+        sql_string = schema.insert_sql[None]
         logging.debug(f"Executing create: {sql_string}")
         db.cursor.execute(sql_string, value_list)
 
-    def read(self, db, offset, limit, sort_by, desc_flag=False):
+    def create_many(self, db, value_dicts, on_conflict=None):
+        """
+        Create many new records in this table on the passed database with one statement, streaming the records
+        through executemany. Like create, this does not commit.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            value_dicts (iterable): dicts holding the values of the new records by column name
+            on_conflict (str): what to do when a record's primary key already exists: None to raise an
+                sqlite3.IntegrityError, "ignore" to keep the existing record or "update" to overwrite it
+
+        Returns:
+            int: the number of records inserted or updated.
+        """
+
+        if isinstance(db, ShardedDb):
+            return self._create_many_sharded(db, value_dicts, on_conflict)
+
+        schema = self.schema
+        columns = schema.columns
+        column_set = schema.column_index.keys()
+        missing = {}
+
+        # Get the SQL for the requested conflict handling
+        if on_conflict not in schema.insert_sql:
+            raise ValueError(f"invalid on_conflict value {on_conflict} for table {schema.table_name}")
+        sql_string = schema.insert_sql[on_conflict]
+
+        # Project each dict onto the table columns, only looking for missing fields when a value comes back empty
+        def project():
+            for value_dict in value_dicts:
+                if not isinstance(value_dict, dict):
+                    logging.error(f"create_many passed an object of type {type(value_dict)}")
+                    continue
+
+                row = tuple(map(value_dict.get, columns))
+                if None in row:
+                    for column_name in column_set - value_dict.keys():
+                        missing[column_name] = missing.get(column_name, 0) + 1
+                yield row
+
+        logging.debug(f"Executing create_many: {sql_string}")
+        count = db.cursor.executemany(sql_string, project()).rowcount
+
+        for column_name, missing_count in missing.items():
+            logging.warning(f"{missing_count} value_dicts do not contain a value for field {column_name}")
+
+        return count
+
+    def _create_many_sharded(self, db, value_dicts, on_conflict=None):
+        """
+        Split records between the shards of a sharded database by primary key and create each shard's share in
+        parallel.
+
+        Parameters:
+            db (ShardedDb): the database on which to operate.
+            value_dicts (iterable): dicts holding the values of the new records by column name
+            on_conflict (str): what to do when a record's primary key already exists, as for create_many
+
+        Returns:
+            int: the number of records inserted or updated.
+        """
+
+        primary_key = self.schema.primary_key
+        shares = {id(shard): [] for shard in db.shards}
+        for value_dict in value_dicts:
+            if not isinstance(value_dict, dict):
+                logging.error(f"create_many passed an object of type {type(value_dict)}")
+                continue
+            shares[id(db.get_shard(value_dict.get(primary_key)))].append(value_dict)
+
+        shards = [shard for shard in db.shards if shares[id(shard)]]
+        return sum(db.map(lambda shard: self.create_many(shard, shares[id(shard)], on_conflict), shards))
+
+    def read_by_key(self, db, key):
+        """
+        Read the record with the passed primary key from this table on the passed database.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            key: the primary key value of the record.
+
+        Returns:
+            tuple: the record, or None if no record has the key.
+        """
+
+        if isinstance(db, ShardedDb):
+            return self.read_by_key(db.get_shard(key), key)
+
+        schema = self.schema
+        sql_string = f"{schema.select_sql} WHERE {schema.primary_key} = ?"
+
+        logging.debug(f"Executing read_by_key: {sql_string}")
+        return db.cursor.execute(sql_string, (key,)).fetchone()
+
+    def get_last_key(self, db):
+        """
+        Get the largest primary key in this table on the passed database.
+
+        Parameters:
+            db (Db): the database on which to operate.
+
+        Returns:
+            The largest primary key value, or None if the table is empty.
+        """
+
+        schema = self.schema
+        return db.cursor.execute(f"SELECT MAX({schema.primary_key}) FROM {schema.table_name}").fetchone()[0]
+
+    def read_keys(self, db, after, through):
+        """
+        Read the primary keys in a range from this table on the passed database.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            after: the primary key value before the range.
+            through: the last primary key value in the range.
+
+        Returns:
+            list: the primary key values in the range, in order.
+        """
+
+        schema = self.schema
+        sql_string = f"SELECT {schema.primary_key} FROM {schema.table_name} " \
+                     f"WHERE {schema.primary_key} > ? AND {schema.primary_key} <= ? ORDER BY {schema.primary_key}"
+
+        logging.debug(f"Executing read_keys: {sql_string}")
+        return [row[0] for row in db.cursor.execute(sql_string, (after, through)).fetchall()]
+
+    def delete_many(self, db, keys):
+        """
+        Delete the records with the passed primary keys from this table on the passed database. Like create_many, this
+        does not commit.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            keys (iterable): the primary key values of the records to delete.
+
+        Returns:
+            int: the number of records deleted.
+        """
+
+        schema = self.schema
+        sql_string = f"DELETE FROM {schema.table_name} WHERE {schema.primary_key} = ?"
+
+        logging.debug(f"Executing delete_many: {sql_string}")
+        return db.cursor.executemany(sql_string, ((key,) for key in keys)).rowcount
+
+    def read(self, db, offset, limit, sort_by, desc_flag=False, cursor=None, search=None, snapshot=None,
+             prefetcher=None):
         """
         Read records in this table from the passed database and return them in a list.
 
+        When a cursor from encode_cursor is passed, the page is found by seeking past the cursor's sort key rather than
+        by skipping offset records, so the cost of a page does not grow with its depth in the table.
+
+        On a sharded database every shard reads its own first offset + limit records in the requested order and the
+        results are merged, so deep offsets cost more than on one file; a cursor keeps each shard's read to one page.
+
         Parameters:
             db (Db): the database on which to operate.
-            offset (int): The number of records to skip before returning results
+            offset (int): The number of records to skip before returning results, ignored when a cursor is passed
             limit (int): The maximum number of records to return, capped by Db.max_limit
-            sort_by (string): The name of the column on which to sort
+            sort_by (string or list): The name of the column on which to sort, or (column name, direction) pairs
             desc_flag (bool): Sort in descending order rather than ascending?
+            cursor (dict): A decoded cursor, as returned by decode_cursor, to seek from
+            search (str): Only return records with a searchable column containing this term
+            snapshot (TableSnapshot): An in-memory copy of this table to read the page from when it is current
+            prefetcher (PagePrefetcher): A cache of page windows to serve the page from, reading the pages around it
+                when it is not cached, for tables with statistics
 
         Returns:
             list: A list of all the records found with the passed paramerers.
@@ -127,27 +599,487 @@ class GenericDao:
             logging.warning(f"limit of {limit} exceeds maximum, setting to {db.max_limit} records")
             limit = db.max_limit
 
-        # Set a default order_string
-        if not sort_by:
-            order_string = f"{self.columns[0]} ASC"
+        if isinstance(db, ShardedDb):
+            return self._read_sharded(db, offset, limit, sort_by, desc_flag, cursor, search)
+
+        # Serve the page from memory when the snapshot is current and holds the ordering
+        if snapshot is not None and not search:
+            result = snapshot.read(db, offset, limit, self.get_order_terms(sort_by, desc_flag), cursor)
+            if result is not None:
+                return result
+
+        # Serve the page from a window of neighbouring pages, which is only valid while the table is unchanged
+        version = db.get_data_version(self) if prefetcher is not None else None
+        if version is not None:
+            key = (db.filename, self.table_name, tuple(self.get_order_terms(sort_by, desc_flag)), search or None)
+
+            def read_window(window_offset, window_limit, window_cursor):
+                return self._read_page(db, window_offset, window_limit, sort_by, desc_flag, window_cursor, search)
+
+            return prefetcher.read(key, version, offset, limit, cursor, read_window)
+
+        return self._read_page(db, offset, limit, sort_by, desc_flag, cursor, search)
+
+    def _read_page(self, db, offset, limit, sort_by, desc_flag=False, cursor=None, search=None):
+        """
+        Read a page of records from one database file, without checking the offset and limit.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            offset (int): The number of records to skip before returning results, ignored when a cursor is passed
+            limit (int): The maximum number of records to return
+            sort_by (string or list): The name of the column on which to sort, or (column name, direction) pairs
+            desc_flag (bool): Sort in descending order rather than ascending?
+            cursor (dict): A decoded cursor, as returned by decode_cursor, to seek from
+            search (str): Only return records with a searchable column containing this term
+
+        Returns:
+            list: the records in the page, in the requested order.
+        """
+
+        # Build the SQL
+        sql_string, params = self.build_read_sql(sort_by, desc_flag, cursor, search)
+        params.extend([limit, 0 if cursor else offset])
+
+        logging.debug(f"Executing read: {sql_string}")
+        result = db.cursor.execute(sql_string, params).fetchall()
+
+        # A seek down a nullable leading column stops short of the NULLs that end the ordering, so read those once the
+        # page reaches them
+        if cursor is not None and cursor["key"][0] is not None and len(result) < limit:
+            column, desc = self.get_order_terms(sort_by, desc_flag)[0]
+            if desc != cursor["backward"] and column != self.schema.primary_key:
+                sql_string, params = self.build_read_sql(sort_by, desc_flag, dict(cursor, key=None), search)
+                result += db.cursor.execute(sql_string, params + [limit - len(result), 0]).fetchall()
+
+        # A backward seek walks the table in reverse, so put the page back in the requested order
+        if cursor is not None and cursor["backward"]:
+            result.reverse()
+
+        return result
+
+    def _read_sharded(self, db, offset, limit, sort_by, desc_flag=False, cursor=None, search=None):
+        """
+        Read a page of records from every shard of a sharded database in parallel and merge them into one page.
+
+        Parameters:
+            db (ShardedDb): the database on which to operate.
+            offset (int): The number of records to skip before returning results, ignored when a cursor is passed
+            limit (int): The maximum number of records to return
+            sort_by (string or list): The name of the column on which to sort, or (column name, direction) pairs
+            desc_flag (bool): Sort in descending order rather than ascending?
+            cursor (dict): A decoded cursor, as returned by decode_cursor, to seek from
+            search (str): Only return records with a searchable column containing this term
+
+        Returns:
+            list: the records in the page, in the requested order.
+        """
+
+        # Any record of the page may be on any shard, so each shard reads every record up to the end of the page
+        start = 0 if cursor else offset
+        pages = db.map(lambda shard: self._read_page(shard, 0, start + limit, sort_by, desc_flag, cursor, search))
+
+        # Each shard's records are already in the requested order, so merge them lazily in the database's order
+        schema = self.schema
+        terms = [(schema.column_index[column], schema.sort_expressions[column] != column, desc)
+                 for column, desc in self.get_order_terms(sort_by, desc_flag)]
+
+        def row_key(row):
+            return tuple(sort_key(row[index], fold) for index, fold, _ in terms)
+
+        if len(set(desc for _, _, desc in terms)) == 1:
+            merged = heapq.merge(*pages, key=row_key, reverse=terms[0][2])
+        else:
+            def compare(row, other):
+                for (_, _, desc), a, b in zip(terms, row_key(row), row_key(other)):
+                    if a != b:
+                        return (1 if a > b else -1) * (-1 if desc else 1)
+                return 0
+
+            merged = heapq.merge(*pages, key=functools.cmp_to_key(compare))
+
+        # A backward seek's page is the records closest to the cursor, which end the merged records
+        if cursor is not None and cursor["backward"]:
+            result = list(merged)
+            return result[-limit:] if limit else []
+        return list(islice(merged, start, start + limit))
+
+    def iterate(self, db, columns=None, batch_size=1000):
+        """
+        Iterate over every record in this table in primary key order, fetching them in batches so memory use stays
+        constant however large the table is.
+
+        Parameters:
+            db (Db): the database on which to operate.
+            columns (list): the names of the columns to return, or None for all of them
+            batch_size (int): the number of records to fetch at a time
+
+        Returns:
+            generator: tuples holding the requested columns of each record.
+        """
+
+        schema = self.schema
+        columns = columns or schema.columns
+        for column in columns:
+            if column not in schema.column_index:
+                raise ValueError(f"invalid column {column} for table {schema.table_name}")
+
+        sql_string = f"SELECT {', '.join(columns)} FROM {schema.table_name} ORDER BY {schema.primary_key}"
+        logging.debug(f"Executing iterate: {sql_string}")
+
+        # Use a cursor of our own so other queries on the database do not reset this one
+        def fetch():
+            cursor = db.connection.cursor()
+            try:
+                cursor.execute(sql_string)
+                batch = cursor.fetchmany(batch_size)
+                while batch:
+                    yield from batch
+                    batch = cursor.fetchmany(batch_size)
+            finally:
+                cursor.close()
+
+        return fetch()
+
+    def build_read_sql(self, sort_by, desc_flag=False, cursor=None, search=None):
+        """
+        Build the SQL used by read to select one page of records, ending in LIMIT and OFFSET parameters.
+
+        Parameters:
+            sort_by (string or list): The name of the column on which to sort, or (column name, direction) pairs
+            desc_flag (bool): Sort in descending order rather than ascending?
+            cursor (dict): A decoded cursor, as returned by decode_cursor, to seek from
+            search (str): Only select records with a searchable column containing this term
+
+        Returns:
+            tuple: the SQL string and a list of its parameters other than the limit and offset.
+        """
 
         # Parse, verify, and convert the passed sort parameters
-        elif sort_by.lower() in self.columns:
-            if self.column_types[self.columns.index(sort_by.lower())] == "text":
-                order_string = f"LOWER({sort_by.lower()})"
-            else:
-                order_string = f"{sort_by.lower()}"
+        order_terms = self.get_order_terms(sort_by, desc_flag)
+        params = []
 
-            if desc_flag:
-                order_string = f"{order_string} DESC"
+        # Without a cursor the caller skips offset records, otherwise seek past the cursor's key
+        seek = None
+        if cursor is not None:
+            seek = "backward" if cursor["backward"] else "forward"
+            if cursor["backward"]:
+                order_terms = [(column, not desc) for column, desc in order_terms]
+            if cursor["key"] is None:
+                # The records whose leading sort column is NULL, which end a descending ordering
+                seek = (seek, None)
+                seek_string = f"{self.get_sort_expression(order_terms[0][0])} IS NULL"
             else:
-                order_string = f"{order_string} ASC"
-        else:
-            logging.warning(f"invalid sort_by column {sort_by} for table {self.table_name}")
-            order_string = f"{self.columns[0]} ASC"
+                nulls = tuple(value is None for value in cursor["key"])
+                seek = (seek, nulls)
+                seek_string, key_indexes = self._build_seek(tuple(order_terms), nulls)
+                params.extend(cursor["key"][i] for i in key_indexes)
 
-        # Build the SQL -- two layers so it can be filtered by result numbers
-        sql_string = f"SELECT {', '.join(self.columns)} FROM {self.table_name} ORDER BY {order_string} LIMIT ? OFFSET ?"
+        search_kind = None
+        if search:
+            search_kind = ("match" if Db.trigram_search else "like") if len(search) >= 3 else "prefix"
+            search_string, search_params = self._build_search(search)
+            params.extend(search_params)
 
-        logging.debug(f"Executing read: {sql_string}")
-        return db.cursor.execute(sql_string, (limit, offset)).fetchall()
+        # Reuse the SQL built the last time this ordering, seek and search were combined
+        def build():
+            conditions = ([seek_string] if seek else []) + ([search_string] if search_kind else [])
+            where_string = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            order_string = ', '.join(f"{self.get_sort_expression(c)} {'DESC' if d else 'ASC'}"
+                                     for c, d in order_terms)
+            return f"{self.schema.select_sql}{where_string} ORDER BY {order_string} LIMIT ? OFFSET ?"
+
+        sql_string = self.schema.cached(("read", tuple(order_terms), seek, search_kind), build)
+        return sql_string, params
+
+    def get_sort_expression(self, column):
+        """
+        Get the SQL expression used to sort on a column; text columns sort case-insensitively.
+
+        Parameters:
+            column (str): the name of a column in this table.
+
+        Returns:
+            str: the SQL expression to use in an ORDER BY clause.
+        """
+
+        return self.schema.sort_expressions[column]
+
+    def get_sort_indexes(self):
+        """
+        Get the indexes that serve the orderings of the sortable columns and of the compound sorts, named after the
+        table and columns. Each index ends with the primary key, matching the tiebreaker added by get_order_terms.
+
+        Parameters: None
+
+        Returns:
+            dict: the SQL expression list of each index, keyed by index name.
+        """
+
+        primary_key = self.columns[self.primary_key_index]
+        sorts = [[column] for column in self.sortable_columns if column != primary_key] + \
+                [list(columns) for columns in self.compound_sorts]
+
+        return {
+            f"{self.table_name}_{'_'.join(columns)}_sort":
+                ', '.join([self.get_sort_expression(column) for column in columns] + [primary_key])
+            for columns in sorts
+        }
+
+    def get_order_terms(self, sort_by, desc_flag=False):
+        """
+        Verify the passed sort parameters and convert them into a list of ordering terms. The primary key is appended
+        as a tiebreaker so that every ordering is total and pages never overlap or skip records.
+
+        Parameters:
+            sort_by (string or list): The name of the column on which to sort, or (column name, direction) pairs in
+                order of precedence where the direction is a descending flag or "asc" or "desc"
+            desc_flag (bool): Sort in descending order rather than ascending? Ignored when sort_by is a list.
+
+        Returns:
+            list: (column name, descending flag) tuples in order of precedence.
+        """
+
+        if not sort_by or isinstance(sort_by, str):
+            sort_by = [(sort_by, desc_flag)] if sort_by else []
+
+        try:
+            key = ("order", tuple((column, direction) for column, direction in sort_by))
+            hash(key)
+        except TypeError:
+            key = None
+
+        return list(self.schema.cached(key, lambda: self._build_order_terms(sort_by)) if key
+                    else self._build_order_terms(sort_by))
+
+    def _build_order_terms(self, sort_by):
+        """
+        Verify a list of sort columns and directions and convert it into ordering terms for get_order_terms.
+
+        Parameters:
+            sort_by (list): (column name, direction) pairs in order of precedence.
+
+        Returns:
+            tuple: (column name, descending flag) tuples in order of precedence.
+        """
+
+        schema = self.schema
+
+        # Verify each sort column, dropping unknown and repeated ones
+        order_terms = []
+        for column, direction in sort_by:
+            desc = direction.lower() == "desc" if isinstance(direction, str) else bool(direction)
+            if not column or column.lower() not in schema.column_index:
+                logging.warning(f"invalid sort_by column {column} for table {schema.table_name}")
+            elif column.lower() not in [c for c, _ in order_terms]:
+                order_terms.append((column.lower(), desc))
+
+        # Set a default sort column
+        if not order_terms:
+            order_terms = [(schema.columns[0], False)]
+
+        if schema.primary_key not in [c for c, _ in order_terms]:
+            order_terms.append((schema.primary_key, order_terms[-1][1]))
+
+        return tuple(order_terms)
+
+    def encode_cursor(self, row, position, sort_by, desc_flag=False, backward=False, search=None):
+        """
+        Create an opaque continuation token for a record so the page after (or before) it can be read by seeking.
+
+        Parameters:
+            row (tuple): a record returned by read; the last of a page to go forward or the first to go backward.
+            position (int): the offset of the record within the sorted table.
+            sort_by (string or list): The name of the column on which the page was sorted, or (column name,
+                direction) pairs
+            desc_flag (bool): Was the page sorted in descending order?
+            backward (bool): Does this cursor read the page before the record rather than after it?
+            search (str): The search term the page was filtered by
+
+        Returns:
+            str: the encoded cursor.
+        """
+
+        order_terms = self.get_order_terms(sort_by, desc_flag)
+        cursor = {
+            "order": order_terms,
+            "key": [row[self.schema.column_index[column]] for column, _ in order_terms],
+            "position": position,
+            "backward": backward,
+            "search": search or None
+        }
+
+        return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+
+    def decode_cursor(self, token, offset, limit, sort_by, desc_flag=False, search=None):
+        """
+        Decode a continuation token created by encode_cursor and check that it can serve the requested page.
+
+        Parameters:
+            token (str): the encoded cursor.
+            offset (int): The offset of the requested page
+            limit (int): The number of records in the requested page
+            sort_by (string or list): The name of the column on which the page is sorted, or (column name,
+                direction) pairs
+            desc_flag (bool): Is the page sorted in descending order?
+            search (str): The search term the page is filtered by
+
+        Returns:
+            dict: the decoded cursor, or None if the token is invalid or was made for a different page, ordering or
+                search.
+        """
+
+        if not token:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            order_terms = [(column, desc) for column, desc in cursor["order"]]
+            key = cursor["key"]
+            position = int(cursor["position"])
+            backward = bool(cursor["backward"])
+            if not isinstance(key, list) or \
+                    not all(value is None or isinstance(value, (int, float, str)) for value in key):
+                raise ValueError("cursor key values must be NULL, numbers or text")
+        except (ValueError, TypeError, KeyError):
+            logging.warning(f"invalid cursor {token} for table {self.table_name}")
+            return None
+
+        if order_terms != self.get_order_terms(sort_by, desc_flag) or len(key) != len(order_terms) \
+                or cursor.get("search") != (search or None):
+            return None
+
+        # A cursor only serves the page that starts right after its record or ends right before it
+        if (backward and position - limit != offset) or (not backward and position + 1 != offset):
+            return None
+
+        return {"key": key, "backward": backward}
+
+    def _build_seek(self, order_terms, nulls):
+        """
+        Build a WHERE clause selecting the records that come after a key in the passed ordering. The clause only
+        depends on the ordering and on which values of the key are NULL, so it is built once and its parameters are
+        picked from each key by index.
+
+        Parameters:
+            order_terms (tuple): (column name, descending flag) tuples in order of precedence.
+            nulls (tuple): a flag for each term, set when the key's value for it is NULL.
+
+        Returns:
+            tuple: the SQL condition string and the index in the key of each of its parameters.
+        """
+
+        return self.schema.cached(("seek", order_terms, nulls), lambda: self._build_seek_sql(order_terms, nulls))
+
+    def _build_seek_sql(self, order_terms, nulls):
+        """
+        Build the WHERE clause and parameter key indexes for _build_seek. SQLite sorts NULLs before every other value,
+        so they lead an ascending ordering and end a descending one. A NULL leading value that ends the ordering is
+        left out, as it would stop SQLite seeking in an index; _read_page reads those records separately.
+
+        Parameters:
+            order_terms (tuple): (column name, descending flag) tuples in order of precedence.
+            nulls (tuple): a flag for each term, set when the key's value for it is NULL.
+
+        Returns:
+            tuple: the SQL condition string and the index in the key of each of its parameters.
+        """
+
+        primary_key = self.schema.primary_key
+        expressions = [self.get_sort_expression(column) for column, _ in order_terms]
+        values = ["LOWER(?)" if e != c else "?" for e, (c, _) in zip(expressions, order_terms)]
+        key_indexes = list(range(len(order_terms)))
+
+        # A single term without a NULL is a plain range
+        if len(order_terms) == 1 and not nulls[0]:
+            return f"{expressions[0]} {'<' if order_terms[0][1] else '>'} {values[0]}", key_indexes
+
+        # Bound the leading term so SQLite can seek in an index, which it will not do for expressions in row values
+        leading, params = None, []
+        if not nulls[0]:
+            leading, params = f"{expressions[0]} {'<=' if order_terms[0][1] else '>='} {values[0]}", [0]
+        elif order_terms[0][1]:
+            leading = f"{expressions[0]} IS NULL"
+
+        # When every term runs the same direction a row value comparison finishes the job, unless a NULL could sort
+        # between the key and its successors: after it in a descending term between the leading one and the primary key
+        if len(set(desc for _, desc in order_terms)) == 1 and not any(nulls) and \
+                (not order_terms[0][1] or len(order_terms) == 2):
+            operator = "<" if order_terms[0][1] else ">"
+            return f"{leading} AND ({', '.join(expressions)}) {operator} ({', '.join(values)})", params + key_indexes
+
+        # Otherwise expand the comparison term by term, treating NULL as the lowest value
+        def follows(i):
+            column, desc = order_terms[i]
+            if nulls[i]:
+                return None if desc else (f"{expressions[i]} IS NOT NULL", [])
+            if desc and i > 0 and column != primary_key:
+                return f"({expressions[i]} < {values[i]} OR {expressions[i]} IS NULL)", [i]
+            return f"{expressions[i]} {'<' if desc else '>'} {values[i]}", [i]
+
+        def equals(i):
+            return (f"{expressions[i]} IS NULL", []) if nulls[i] else (f"{expressions[i]} = {values[i]}", [i])
+
+        alternatives = []
+        for i in range(len(order_terms)):
+            terms = [equals(j) for j in range(i)] + [follows(i)]
+            if terms[-1] is not None:
+                alternatives.append(' AND '.join(condition for condition, _ in terms))
+                params.extend(index for _, indexes in terms for index in indexes)
+
+        expanded = f"({' OR '.join(f'({a})' for a in alternatives)})" if alternatives else "1 = 0"
+        return f"{leading} AND {expanded}" if leading else expanded, params
+
+    def _build_search(self, search):
+        """
+        Build a WHERE clause selecting the records with a searchable column containing the passed term. Terms of three
+        or more characters are looked up in the trigram search index, or matched with LIKE by scanning the table when
+        SQLite cannot build one; shorter ones match the start of a column.
+
+        Parameters:
+            search (str): the term to search for.
+
+        Returns:
+            tuple: the SQL condition string and a list of its parameters.
+        """
+
+        schema = self.schema
+        if not schema.searchable_columns:
+            logging.warning(f"table {schema.table_name} has no searchable columns, ignoring search {search}")
+            return "1 = 1", []
+
+        # Without a search index, scan the table; LIKE ignores the case of ASCII letters, as LOWER does
+        if len(search) >= 3 and not Db.trigram_search:
+            def build_like():
+                conditions = [f"{column} LIKE ? ESCAPE '\\'" for column in schema.searchable_columns]
+                return f"({' OR '.join(conditions)})"
+
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            return schema.cached(("like",), build_like), [pattern] * len(schema.searchable_columns)
+
+        if len(search) >= 3:
+            return schema.cached(("match",), lambda: f"{schema.primary_key} IN (SELECT rowid FROM "
+                                                     f"{schema.table_name}_search WHERE {schema.table_name}_search "
+                                                     f"MATCH ?)"), [self._build_phrase(search)]
+
+        # Too short for trigrams, so compare prefixes as ranges the sort indexes can serve
+        def build():
+            conditions = [f"({e} >= LOWER(?) AND {e} < LOWER(?))"
+                          for e in map(self.get_sort_expression, schema.searchable_columns)]
+            return f"({' OR '.join(conditions)})"
+
+        return schema.cached(("prefix",), build), [search, search + "\U0010ffff"] * len(schema.searchable_columns)
+
+    @staticmethod
+    def _build_phrase(search):
+        """
+        Quote a search term as an FTS5 phrase, so it matches as a substring whatever characters it holds.
+
+        Parameters:
+            search (str): the term to search for.
+
+        Returns:
+            str: the phrase.
+        """
+
+        return '"' + search.replace('"', '""') + '"'
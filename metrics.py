@@ -0,0 +1,248 @@
+from collections import deque
+import logging
+import re
+import threading
+import time
+
+
+def format_metric(name, metric_type, help_text, samples):
+    """
+    Format one metric family in the Prometheus text exposition format.
+
+    Parameters:
+        name (str): the name of the metric.
+        metric_type (str): the Prometheus type of the metric, e.g. "counter" or "gauge".
+        help_text (str): a description of the metric.
+        samples (list): (sample name suffix, labels dict, value) tuples.
+
+    Returns:
+        str: the HELP, TYPE and sample lines of the metric.
+    """
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for suffix, labels, value in samples:
+        label_string = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{suffix}{{{label_string}}} {value}" if label_string else f"{name}{suffix} {value}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """
+    This is a cumulative histogram of durations with fixed bucket boundaries, as Prometheus expects. It is not
+    thread-safe on its own; Metrics guards every histogram with its lock.
+
+    Attributes:
+        Histogram.buckets (tuple): the upper bounds of the buckets in seconds, in increasing order.
+    """
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        """
+        This Histogram class constructor.
+        """
+
+        self.counts = [0] * (len(Histogram.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Record one duration.
+
+        Parameters:
+            seconds (float): the duration to record.
+
+        Returns: None
+        """
+
+        i = 0
+        while i < len(Histogram.buckets) and seconds > Histogram.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def samples(self, labels):
+        """
+        Get the Prometheus samples of this histogram.
+
+        Parameters:
+            labels (dict): the labels identifying this histogram.
+
+        Returns:
+            list: (sample name suffix, labels dict, value) tuples for format_metric.
+        """
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(Histogram.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            samples.append(("_bucket", dict(labels, le=bound), cumulative))
+
+        return samples + [("_sum", labels, self.sum), ("_count", labels, self.count)]
+
+
+class Metrics:
+    """
+    This is a thread-safe registry of database statement and API request timings. Statements are grouped by operation
+    and table, and statements slower than a threshold are logged with their query plan and kept for inspection.
+
+    Attributes:
+        Metrics.namespace (str): the prefix of every metric name.
+        Metrics.slow_seconds (float): the duration from which a statement counts as slow, or None to never log.
+        Metrics.max_slow_queries (int): the number of most recent slow statements to keep.
+    """
+
+    statement_pattern = re.compile(r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+))?", re.IGNORECASE | re.DOTALL)
+
+    def __init__(self, namespace="user_api", slow_seconds=None, max_slow_queries=100):
+        """
+        This Metrics class constructor.
+
+        Parameters:
+            namespace (str): the prefix of every metric name.
+            slow_seconds (float): the duration from which a statement counts as slow, or None to never log.
+            max_slow_queries (int): the number of most recent slow statements to keep.
+        """
+
+        self.namespace = namespace
+        self.slow_seconds = slow_seconds
+        self.max_slow_queries = max_slow_queries
+
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._query_rows = {}
+        self._requests = {}
+        self._responses = {}
+        self._slow_queries = deque(maxlen=max_slow_queries)
+        self._slow_count = 0
+
+    def observe_query(self, connection, sql, parameters, seconds, rows):
+        """
+        Record the execution of a statement, logging it with its query plan when it is slow.
+
+        Parameters:
+            connection (sqlite3.Connection): the connection that ran the statement, to explain it on.
+            sql (str): the statement.
+            parameters (sequence): the statement's parameters.
+            seconds (float): the time taken to run the statement and fetch its rows.
+            rows (int): the number of rows returned, or changed by a statement that returns none.
+
+        Returns: None
+        """
+
+        match = Metrics.statement_pattern.match(sql)
+        key = (match.group(1).upper(), match.group(2) or "") if match else ("", "")
+
+        with self._lock:
+            self._queries.setdefault(key, Histogram()).observe(seconds)
+            self._query_rows[key] = self._query_rows.get(key, 0) + rows
+
+        if self.slow_seconds is None or seconds < self.slow_seconds:
+            return
+
+        # Explain slow reads on the connection that ran them so the plan matches what was executed
+        plan = None
+        if key[0] in ("SELECT", "WITH"):
+            try:
+                plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()]
+            except Exception as e:
+                logging.debug(f"Unable to explain slow statement: {e}")
+
+        logging.warning(f"Slow statement took {seconds * 1000:.1f}ms returning {rows} rows: {sql} {list(parameters)} "
+                        f"plan={plan}")
+        with self._lock:
+            self._slow_count += 1
+            self._slow_queries.append({"sql": sql, "parameters": list(parameters), "ms": seconds * 1000,
+                                       "rows": rows, "plan": plan, "time": time.time()})
+
+    def observe_request(self, endpoint, method, status, seconds):
+        """
+        Record an API request.
+
+        Parameters:
+            endpoint (str): the route that served the request.
+            method (str): the HTTP method of the request.
+            status (int): the response status code.
+            seconds (float): the time taken to build the response.
+
+        Returns: None
+        """
+
+        with self._lock:
+            self._requests.setdefault((endpoint, method), Histogram()).observe(seconds)
+            key = (endpoint, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def slow_queries(self):
+        """
+        Get the most recent slow statements.
+
+        Parameters: None
+
+        Returns:
+            list: a dict of the statement, parameters, duration, rows, query plan and time of each, oldest first.
+        """
+
+        with self._lock:
+            return list(self._slow_queries)
+
+    def stats(self):
+        """
+        Get summary metrics for each statement group.
+
+        Parameters: None
+
+        Returns:
+            dict: the count, total and maximum milliseconds and rows of each statement group, keyed by
+                "operation table", and the number of slow statements.
+        """
+
+        with self._lock:
+            return {
+                "statements": {f"{operation} {table}".strip(): {"count": h.count, "ms_total": h.sum * 1000,
+                                                                "ms_max": h.max * 1000,
+                                                                "rows": self._query_rows[(operation, table)]}
+                               for (operation, table), h in self._queries.items()},
+                "slow_statements": self._slow_count
+            }
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Parameters: None
+
+        Returns:
+            str: the metrics.
+        """
+
+        name = self.namespace
+        with self._lock:
+            query_samples = [s for (operation, table), h in sorted(self._queries.items())
+                             for s in h.samples({"operation": operation, "table": table})]
+            row_samples = [("", {"operation": operation, "table": table}, rows)
+                           for (operation, table), rows in sorted(self._query_rows.items())]
+            request_samples = [s for (endpoint, method), h in sorted(self._requests.items())
+                               for s in h.samples({"endpoint": endpoint, "method": method})]
+            response_samples = [("", {"endpoint": endpoint, "method": method, "status": status}, count)
+                                for (endpoint, method, status), count in sorted(self._responses.items())]
+            slow_count = self._slow_count
+
+        return format_metric(f"{name}_db_statement_seconds", "histogram",
+                             "Time to run a database statement and fetch its rows.", query_samples) + \
+            format_metric(f"{name}_db_statement_rows_total", "counter",
+                          "Rows returned, or changed by statements returning none.", row_samples) + \
+            format_metric(f"{name}_db_slow_statements_total", "counter",
+                          "Statements slower than the slow statement threshold.", [("", {}, slow_count)]) + \
+            format_metric(f"{name}_request_seconds", "histogram",
+                          "Time to build an API response.", request_samples) + \
+            format_metric(f"{name}_requests_total", "counter",
+                          "API responses by status code.", response_samples)
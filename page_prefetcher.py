@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class PagePrefetcher:
+    """
+    This is a thread-safe, short-lived cache of page windows for paging through a table in one ordering. A page that
+    is not cached is read in one query together with the pages around it: the pages either side of it when it is read
+    by offset, and the pages beyond it in the direction of travel when it is read from a cursor. The next or previous
+    page a client asks for is then served from memory. Each window holds one ordering and search of a table, is
+    tagged with the data version it was read at, and expires after a time to live.
+
+    A cursor made at an older data version can place its page at a different offset than reading by offset would, so
+    a window read from a cursor only serves requests that also carry one.
+
+    Attributes:
+        PagePrefetcher.pages (int): the number of pages to read beyond the requested one in each direction.
+        PagePrefetcher.ttl (float): the number of seconds a window may be served for.
+        PagePrefetcher.max_entries (int): the largest number of windows to hold.
+    """
+
+    def __init__(self, pages=2, ttl=30.0, max_entries=64, clock=time.monotonic):
+        """
+        This PagePrefetcher class constructor.
+
+        Parameters:
+            pages (int): the number of pages to read beyond the requested one in each direction.
+            ttl (float): the number of seconds a window may be served for.
+            max_entries (int): the largest number of windows to hold.
+            clock (callable): the function returning the current time in seconds, replaceable in tests.
+        """
+
+        self.pages = pages
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._windows = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rows_read = 0
+        self._rows_requested = 0
+
+    def read(self, key, version, offset, limit, cursor, read_window):
+        """
+        Get a page from the window holding it, or read a new window around it.
+
+        Parameters:
+            key (tuple): the table, ordering and search of the page.
+            version (int): the current data version of the table.
+            offset (int): the offset of the page.
+            limit (int): the number of records in the page.
+            cursor (dict): the decoded cursor the page may be read from, if any.
+            read_window (callable): reads records like GenericDao.read, called with an offset, a limit and a cursor.
+
+        Returns:
+            list: the records in the page.
+        """
+
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                window_version, expires, start, rows, complete, by_offset = window
+                if window_version == version and now < expires and (by_offset or cursor is not None) and \
+                        start <= offset and (offset + limit <= start + len(rows) or complete):
+                    self._windows.move_to_end(key)
+                    self._hits += 1
+                    self._rows_requested += limit
+                    return rows[offset - start:offset - start + limit]
+            self._misses += 1
+
+        # Read the pages around the requested one: both ways by offset, or onwards in the direction of a cursor
+        count = (self.pages + 1) * limit
+        if cursor is None:
+            start = max(offset - self.pages * limit, 0)
+            count += offset - start
+            rows = read_window(start, count, None)
+            complete = len(rows) < count
+        elif not cursor["backward"]:
+            start = offset
+            rows = read_window(offset, count, cursor)
+            complete = len(rows) < count
+        else:
+            rows = read_window(offset, count, cursor)
+            start = offset + limit - len(rows)
+            complete = False
+
+        with self._lock:
+            self._windows[key] = (version, now + self.ttl, start, rows, complete, cursor is None)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_entries:
+                self._windows.popitem(last=False)
+                self._evictions += 1
+            self._rows_read += len(rows)
+            self._rows_requested += limit
+
+        return rows[max(offset - start, 0):offset - start + limit]
+
+    def clear(self):
+        """
+        Remove every cached window.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with self._lock:
+            self._windows.clear()
+
+    def stats(self):
+        """
+        Get usage metrics for the prefetcher.
+
+        Parameters: None
+
+        Returns:
+            dict: the number of windows, hits, misses, evictions and hit rate, and the records read and requested.
+        """
+
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "entries": len(self._windows),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / requests if requests else None,
+                "rows_read": self._rows_read,
+                "rows_requested": self._rows_requested
+            }
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    This is a thread-safe LRU cache of rendered API payloads. Entries are tagged with the data version they were built
+    from and expire after a time to live, and the current data version is itself cached briefly so that fresh entries
+    and conditional requests can be answered without touching the database.
+
+    Attributes:
+        ResponseCache.max_entries (int): the largest number of payloads to hold.
+        ResponseCache.ttl (float): the number of seconds a payload may be served for.
+        ResponseCache.version_ttl (float): the number of seconds to trust a data version before reading it again.
+    """
+
+    def __init__(self, max_entries=256, ttl=60.0, version_ttl=1.0, clock=time.monotonic):
+        """
+        This ResponseCache class constructor.
+
+        Parameters:
+            max_entries (int): the largest number of payloads to hold.
+            ttl (float): the number of seconds a payload may be served for.
+            version_ttl (float): the number of seconds to trust a data version before reading it again.
+            clock (callable): the function returning the current time in seconds, replaceable in tests.
+        """
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_expires = 0.0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._not_modified = 0
+
+    def get_version(self, read_version):
+        """
+        Get the current data version, reading it again only when the cached one is older than version_ttl.
+
+        Parameters:
+            read_version (callable): the function that reads the data version from the database.
+
+        Returns:
+            int: the current data version.
+        """
+
+        now = self.clock()
+        with self._lock:
+            if self._version is not None and now < self._version_expires:
+                return self._version
+
+        version = read_version()
+        with self._lock:
+            self._version = version
+            self._version_expires = now + self.version_ttl
+
+        return version
+
+    @staticmethod
+    def make_etag(key, version, coding=None):
+        """
+        Make the entity tag of the payload for a key at a data version. Each content coding has its own tag as the
+        bodies differ.
+
+        Parameters:
+            key (tuple): the normalized request parameters.
+            version (int): the data version.
+            coding (str): the content coding of the body, or None for an uncompressed body.
+
+        Returns:
+            str: the quoted entity tag.
+        """
+
+        tag = hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+        return f'"{tag}"' if coding in (None, "identity") else f'"{tag}-{coding}"'
+
+    def is_not_modified(self, key, version, if_none_match):
+        """
+        Check a conditional request's If-None-Match header against the payload for a key at a data version, in any
+        content coding.
+
+        Parameters:
+            key (tuple): the normalized request parameters.
+            version (int): the current data version.
+            if_none_match (str): the value of the request's If-None-Match header, if any.
+
+        Returns:
+            str: the entity tag of the client's copy of the current payload, or None if it holds none.
+        """
+
+        if not if_none_match:
+            return None
+
+        if if_none_match.strip() == "*":
+            etag = ResponseCache.make_etag(key, version)
+        else:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            variants = {ResponseCache.make_etag(key, version, coding) for coding in (None, "gzip", "br")}
+            etag = next((tag for tag in tags if (tag[2:] if tag.startswith("W/") else tag) in variants), None)
+            if etag is None:
+                return None
+
+        with self._lock:
+            self._not_modified += 1
+        return etag
+
+    def get(self, key, version):
+        """
+        Get the cached payload for a key if it was built from the passed data version and has not expired.
+
+        Parameters:
+            key (tuple): the normalized request parameters.
+            version (int): the current data version.
+
+        Returns:
+            object: the cached payload, or None on a miss.
+        """
+
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def put(self, key, version, payload):
+        """
+        Cache the payload for a key built from the passed data version, evicting the least recently used payloads.
+
+        Parameters:
+            key (tuple): the normalized request parameters.
+            version (int): the data version the payload was built from.
+            payload (object): the payload to cache.
+
+        Returns: None
+        """
+
+        with self._lock:
+            self._entries[key] = (version, self.clock() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """
+        Remove every cached payload and forget the cached data version.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self):
+        """
+        Get usage metrics for the cache.
+
+        Parameters: None
+
+        Returns:
+            dict: the number of entries, hits, misses, evictions and not modified responses.
+        """
+
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "not_modified": self._not_modified
+            }
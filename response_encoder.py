@@ -0,0 +1,216 @@
+import gzip
+import io
+import json
+import threading
+import time
+
+# orjson and brotli are optional: without them payloads are encoded by the json module and only gzipped
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def gzip_compress(data, level):
+    """
+    Gzip data with a zero modification time, so the same data always compresses to the same bytes. gzip.compress only
+    takes the time from Python 3.8.
+
+    Parameters:
+        data (bytes): the data to compress.
+        level (int): the compression level, from 1 to 9.
+
+    Returns:
+        bytes: the gzip stream.
+    """
+
+    stream = io.BytesIO()
+    with gzip.GzipFile(fileobj=stream, mode="wb", compresslevel=level, mtime=0) as file:
+        file.write(data)
+    return stream.getvalue()
+
+
+def encode_json(payload):
+    """
+    Encode a payload as compact UTF-8 JSON with the standard library.
+
+    Parameters:
+        payload (object): the value to encode.
+
+    Returns:
+        bytes: the JSON document.
+    """
+
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def encode_orjson(payload):
+    """
+    Encode a payload as compact UTF-8 JSON with orjson.
+
+    Parameters:
+        payload (object): the value to encode.
+
+    Returns:
+        bytes: the JSON document.
+    """
+
+    return orjson.dumps(payload)
+
+
+# The JSON encoders available, by name
+json_encoders = {"json": encode_json}
+if orjson is not None:
+    json_encoders["orjson"] = encode_orjson
+
+
+def parse_accept_encoding(header):
+    """
+    Read the content codings a client accepts from its Accept-Encoding header.
+
+    Parameters:
+        header (str): the value of the Accept-Encoding header, if any.
+
+    Returns:
+        dict: the quality value of each coding named in the header, lower case.
+    """
+
+    codings = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+
+    return codings
+
+
+class ResponseEncoder:
+    """
+    This encodes API payloads as JSON with a pluggable encoder and compresses bodies large enough to benefit, with
+    brotli when it is installed and accepted, otherwise gzip. It is safe to share between threads.
+
+    Attributes:
+        ResponseEncoder.encoder_name (str): the name of the JSON encoder in json_encoders.
+        ResponseEncoder.min_size (int): the smallest body in bytes to compress, or None to never compress.
+        ResponseEncoder.gzip_level (int): the gzip compression level, from 1 to 9.
+        ResponseEncoder.brotli_quality (int): the brotli compression quality, from 0 to 11.
+    """
+
+    def __init__(self, encoder_name=None, min_size=1024, gzip_level=6, brotli_quality=4):
+        """
+        This ResponseEncoder class constructor.
+
+        Parameters:
+            encoder_name (str): the name of the JSON encoder in json_encoders, or None for the fastest available.
+            min_size (int): the smallest body in bytes to compress, or None to never compress.
+            gzip_level (int): the gzip compression level, from 1 to 9.
+            brotli_quality (int): the brotli compression quality, from 0 to 11.
+        """
+
+        encoder_name = encoder_name or ("orjson" if "orjson" in json_encoders else "json")
+        if encoder_name not in json_encoders:
+            raise ValueError(f"Unknown JSON encoder {encoder_name}, expected one of {', '.join(json_encoders)}")
+
+        self.encoder_name = encoder_name
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self._encode = json_encoders[encoder_name]
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._seconds = 0.0
+
+    def choose_coding(self, accept_encoding, size):
+        """
+        Choose the content coding of a body from the codings the client accepts.
+
+        Parameters:
+            accept_encoding (str): the value of the request's Accept-Encoding header, if any.
+            size (int): the length of the uncompressed body in bytes.
+
+        Returns:
+            str: "br", "gzip" or None to send the body uncompressed.
+        """
+
+        if self.min_size is None or size < self.min_size:
+            return None
+
+        codings = parse_accept_encoding(accept_encoding)
+        for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+            if codings.get(coding, codings.get("*", 0.0)) > 0:
+                return coding
+
+        return None
+
+    def encode(self, payload, accept_encoding=None):
+        """
+        Encode a payload as JSON, compressed when it is large enough and the client accepts a supported coding.
+
+        Parameters:
+            payload (object): the value to encode.
+            accept_encoding (str): the value of the request's Accept-Encoding header, if any.
+
+        Returns:
+            tuple: the response body and a dict of the Content-Encoding and Vary headers to send with it.
+        """
+
+        started = time.perf_counter()
+        body = self._encode(payload)
+        size = len(body)
+
+        coding = self.choose_coding(accept_encoding, size)
+        if coding == "br":
+            body = brotli.compress(body, quality=self.brotli_quality)
+        elif coding == "gzip":
+            body = gzip_compress(body, self.gzip_level)
+
+        headers = {} if self.min_size is None else {"Vary": "Accept-Encoding"}
+        if coding:
+            headers["Content-Encoding"] = coding
+
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self._responses[coding or "identity"] = self._responses.get(coding or "identity", 0) + 1
+            self._bytes_in += size
+            self._bytes_out += len(body)
+            self._seconds += seconds
+
+        return body, headers
+
+    def stats(self):
+        """
+        Get usage metrics for the encoder.
+
+        Parameters: None
+
+        Returns:
+            dict: the encoder name, responses by content coding, JSON and sent bytes and time spent encoding.
+        """
+
+        with self._lock:
+            return {
+                "encoder": self.encoder_name,
+                "responses": dict(self._responses),
+                "json_bytes": self._bytes_in,
+                "sent_bytes": self._bytes_out,
+                "encode_seconds": self._seconds
+            }
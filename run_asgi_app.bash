@@ -0,0 +1,4 @@
+#!/bin/bash
+
+export USER_API_WORKERS=4
+uvicorn asgi_api:app --host 127.0.0.1 --port 5000
@@ -1,43 +1,32 @@
+import argparse
 import logging
-import requests
+import os
 
-from db import Db
-from user_dao import UserDao
-
-total = 150
-git_username = "bkelly1984"
-# git_password = ""
-url = 'https://api.github.com/users?accept=application/vnd.github.v3+json&per_page=100'
+from db import Db, WriteQueue
+from seeder import GithubSeeder
 
 # logging.basicConfig(level=logging.INFO)
 
-# Instantiate the database objects
-db = Db()
-user_dao = UserDao()
-
-# Create or clean the database
-user_dao.create_or_clear_table(db)
-
-# Prepare to make many requests to the database
-count = 0
-last_id = 0
-while count < total:
-
-    # Get 100 user records
-    try:
-        response = requests.get(url + f'&since={last_id}', f'auth=({git_username}, {git_password})')
-    except NameError:
-        response = requests.get(url + f'&since={last_id}')
-
-    # Add each user to the database
-    for user in response.json():
-        user_dao.create(db, user)
-        last_id = user['id']
-        count += 1
-
-        if count >= total:
-            break
-
-    # Commit this round of users and provide an update
-    db.commit()
-    logging.info(f"Seed is {(100 * count) // total}% complete")
+parser = argparse.ArgumentParser(description="Seed the database with users from the GitHub API")
+parser.add_argument("--total", type=int, default=150, help="number of users to seed")
+parser.add_argument("--resume", action="store_true", help="only add users after the highest stored id")
+parser.add_argument("--rebuild", action="store_true",
+                    help="reload every user into a shadow table and swap it in, rather than syncing changes")
+parser.add_argument("--db", default="github", help="non-suffixed filename of the database")
+args = parser.parse_args()
+
+# Instantiate the database objects; set GITHUB_TOKEN for the authenticated rate limit. Users are written and committed
+# in groups on the write queue's thread, so fetching never waits on the disk
+db = Db(args.db, profile="performance")
+write_queue = WriteQueue(args.db, profile="performance")
+seeder = GithubSeeder(db, token=os.environ.get("GITHUB_TOKEN"), write_queue=write_queue)
+
+# Seed the database, keeping the table readable throughout
+if args.rebuild or not db.does_table_exist(seeder.user_dao):
+    count = seeder.rebuild(args.total)
+    logging.info(f"Rebuild finished with {count} users")
+else:
+    stats = seeder.sync(args.total, refresh=not args.resume)
+    logging.info(f"Sync finished: {stats}")
+write_queue.close()
+db.close()
@@ -0,0 +1,561 @@
+from email.utils import parsedate_to_datetime
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+from checkpoint_dao import CheckpointDao
+from sync_page_dao import SyncPageDao
+from user_dao import UserDao
+
+
+class GithubSeeder:
+    """
+    This copies users from the GitHub users API into the git_user table. Pages are fetched on a background thread
+    while the calling thread writes the previous page, and the id of the last user written is checkpointed in the same
+    transaction as the users so an interrupted run can resume where it stopped. With a WriteQueue, new pages are written
+    and committed in groups on the queue's writer thread instead.
+
+    The ETag of each page is kept so that sync can refresh the table with conditional requests, which GitHub answers
+    with 304 Not Modified for unchanged pages, and rebuild reloads the table into a shadow copy swapped in atomically.
+
+    Attributes:
+        GithubSeeder.url (str): the GitHub users API endpoint.
+        GithubSeeder.name (str): the name of this job's checkpoint.
+        GithubSeeder.per_page (int): the number of users to request in each page.
+        GithubSeeder.max_retries (int): the number of times to retry a failed request before giving up.
+        GithubSeeder.backoff (float): the number of seconds to wait before the first retry, doubled for each retry.
+    """
+
+    url = "https://api.github.com/users"
+
+    def __init__(self, db, url=None, token=None, name="github_users", per_page=100, max_retries=5, backoff=1.0,
+                 queue_size=4, timeout=30, sleep=time.sleep, write_queue=None):
+        """
+        This GithubSeeder class constructor.
+
+        Parameters:
+            db (Db): the database to write users to.
+            url (str): the users API endpoint, to point the seeder at a stand-in server.
+            token (str): a GitHub access token to raise the rate limit, if any.
+            name (str): the name of this job's checkpoint.
+            per_page (int): the number of users to request in each page.
+            max_retries (int): the number of times to retry a failed request before giving up.
+            backoff (float): the number of seconds to wait before the first retry, doubled for each retry.
+            queue_size (int): the number of fetched pages to hold while the database catches up.
+            timeout (float): the number of seconds to wait for each response.
+            sleep (callable): the function used to wait, replaceable in tests.
+            write_queue (WriteQueue): a writer for the same database to hand new users to, or None to write them on
+                the calling thread.
+        """
+
+        self.db = db
+        self.url = url or GithubSeeder.url
+        self.name = name
+        self.per_page = per_page
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.sleep = sleep
+        self.write_queue = write_queue
+
+        self.user_dao = UserDao()
+        self.checkpoint_dao = CheckpointDao()
+        self.sync_page_dao = SyncPageDao()
+
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/vnd.github.v3+json"
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+
+        self._rate_limit_reset = None
+
+    def get_checkpoint(self):
+        """
+        Read this job's checkpoint.
+
+        Parameters: None
+
+        Returns:
+            tuple: the id of the last user written and the number of users written, or (0, 0) with no checkpoint.
+        """
+
+        if not self.db.does_table_exist(self.checkpoint_dao):
+            return 0, 0
+
+        row = self.checkpoint_dao.read_by_key(self.db, self.name)
+        return (row[1], row[2]) if row else (0, 0)
+
+    def run(self, total, resume=False):
+        """
+        Seed the database with users until it holds the passed number or GitHub runs out of users.
+
+        Parameters:
+            total (int): the number of users to seed.
+            resume (bool): continue from this job's checkpoint rather than starting over with an empty table?
+
+        Returns:
+            int: the number of users in the table at the end of the run.
+        """
+
+        # Start over or pick up from the checkpoint
+        for dao in [self.checkpoint_dao, self.sync_page_dao]:
+            if not self.db.does_table_exist(dao):
+                self.db.create_table(dao)
+
+        if resume and self.db.does_table_exist(self.user_dao):
+            last_id, count = self.get_checkpoint()
+            logging.info(f"Resuming seed after user {last_id} with {count} users written")
+        else:
+            self.user_dao.create_or_clear_table(self.db)
+            self.sync_page_dao.clear_table(self.db)
+            last_id, count = 0, 0
+            self.checkpoint_dao.create_many(self.db, [{"name": self.name, "last_id": last_id, "count": count}],
+                                            on_conflict="update")
+            self.db.commit()
+
+        return count + self._append(last_id, count, total)
+
+    def sync(self, total, refresh=True):
+        """
+        Bring the users table up to date without emptying it, each page in its own transaction. Pages already written
+        are requested again with their ETags so only changed pages are sent and rewritten, users GitHub no longer lists
+        are deleted, and then users after the highest stored id are added until the table holds the passed number.
+
+        Parameters:
+            total (int): the number of users the table should hold.
+            refresh (bool): check the pages already written for changes, rather than only adding new users?
+
+        Returns:
+            dict: the number of pages not modified and refreshed, and of users updated, deleted and added.
+        """
+
+        # Bring tables written by an older version of their definition up to date first
+        for dao in [self.user_dao, self.checkpoint_dao, self.sync_page_dao]:
+            if not self.db.does_table_exist(dao):
+                self.db.create_table(dao)
+            elif self.db.migrate_table(dao) != "current":
+                logging.info(f"Migrated {dao.table_name} to schema version {dao.schema_version}")
+
+        stats = {"not_modified": 0, "refreshed": 0, "updated": 0, "deleted": 0, "added": 0}
+        last_id = self.user_dao.get_last_key(self.db) or 0
+
+        # Walk the stored pages in order, following GitHub's pages wherever they have changed
+        since = 0
+        if refresh:
+            pages = {row[0]: row for row in self.sync_page_dao.iterate(self.db)}
+            while since < last_id:
+                page = pages.get(since)
+                users, etag = self.fetch_page_if_changed(since, page[2] if page else None)
+                if users is None and page[1] > since:
+                    stats["not_modified"] += 1
+                    since = page[1]
+                    continue
+                if users is None:
+                    users, etag = self.fetch_page_if_changed(since)
+
+                # Keep to the stored range if the users after it would take the table past the total
+                new_users = sum(1 for user in users or [] if user["id"] > last_id)
+                if new_users and self.user_dao.get_count(self.db) + new_users > total:
+                    users, etag, new_users = [user for user in users if user["id"] <= last_id], None, 0
+
+                written, deleted = self._write_page(since, users or [], etag, last_id)
+                stats["refreshed"] += 1
+                stats["updated"] += written - new_users
+                stats["added"] += new_users
+                stats["deleted"] += deleted
+                if not users:
+                    break
+                since = users[-1]["id"]
+            logging.info(f"Refreshed {stats['refreshed']} pages, {stats['not_modified']} unchanged")
+
+        # Add the users created since the last sync
+        last_id = self.user_dao.get_last_key(self.db) or 0
+        stats["added"] += self._append(last_id, self.user_dao.get_count(self.db), total)
+
+        return stats
+
+    def rebuild(self, total):
+        """
+        Reload the users table from scratch into a shadow copy and replace the table with it in one transaction, so
+        readers keep using the old table until the new one is complete. Each page is checkpointed in the same
+        transaction as its users, so a rebuild that is interrupted carries on loading its shadow the next time it runs.
+
+        Parameters:
+            total (int): the number of users to load.
+
+        Returns:
+            int: the number of users in the new table.
+        """
+
+        for dao in [self.checkpoint_dao, self.sync_page_dao]:
+            if not self.db.does_table_exist(dao):
+                self.db.create_table(dao)
+
+        # Resume into the shadows of an interrupted rebuild if its checkpoint survived, or start from empty ones
+        shadow_dao = self.user_dao.get_shadow()
+        page_shadow_dao = self.sync_page_dao.get_shadow()
+        name = f"{self.name}_rebuild"
+        checkpoint = self.checkpoint_dao.read_by_key(self.db, name)
+        if checkpoint and self.db.does_table_exist(shadow_dao) and self.db.does_table_exist(page_shadow_dao):
+            last_id, count = checkpoint[1], checkpoint[2]
+            logging.info(f"Resuming rebuild after user {last_id} with {count} users loaded")
+        else:
+            for dao in [shadow_dao, page_shadow_dao]:
+                if self.db.does_table_exist(dao):
+                    self.db.delete_table(dao)
+                self.db.create_table(dao, indexed=False)
+            last_id, count = 0, 0
+            self.checkpoint_dao.create_many(self.db, [{"name": name, "last_id": last_id, "count": count}],
+                                            on_conflict="update")
+            self.db.commit()
+
+        state = {"error": None}
+
+        def write(db, since, users, etag, loaded):
+            if state["error"] is not None:
+                raise RuntimeError(f"not loading users since {since} after an earlier page failed")
+            try:
+                with db.transaction():
+                    shadow_dao.create_many(db, users)
+                    page_shadow_dao.create_many(db, [{"since": since, "last_id": users[-1]["id"], "etag": etag}])
+                    self.checkpoint_dao.create_many(db, [{"name": name, "last_id": users[-1]["id"], "count": loaded}],
+                                                    on_conflict="update")
+            except Exception as e:
+                state["error"] = e
+                raise
+
+        for since, users, etag in self._pages(last_id, total - count):
+            users, etag = self._truncate(users, etag, total - count)
+            if self.write_queue is None:
+                write(self.db, since, users, etag, count + len(users))
+            elif state["error"] is None:
+                self.write_queue.submit(write, since, users, etag, count + len(users), size=len(users))
+            else:
+                break
+            count += len(users)
+            logging.info(f"Rebuild is {(100 * count) // total}% {'loaded' if self.write_queue is None else 'queued'}")
+
+        # Make sure every queued page is in the shadow before it replaces the table
+        if self.write_queue is not None:
+            self.write_queue.flush()
+            if state["error"] is not None:
+                raise state["error"]
+
+        _, last_id, count = self.checkpoint_dao.read_by_key(self.db, name)
+        pages = [dict(zip(self.sync_page_dao.columns, row)) for row in page_shadow_dao.iterate(self.db)]
+        with self.db.transaction():
+            self.db.replace_table(self.user_dao, shadow_dao)
+            self.sync_page_dao.clear_table(self.db)
+            self.sync_page_dao.create_many(self.db, pages)
+            self.db.delete_table(page_shadow_dao)
+            self.checkpoint_dao.delete_many(self.db, [name])
+            self.checkpoint_dao.create_many(self.db, [{"name": self.name, "last_id": last_id, "count": count}],
+                                            on_conflict="update")
+
+        return count
+
+    def fetch_page(self, since):
+        """
+        Fetch one page of users, waiting out rate limits and retrying transient failures.
+
+        Parameters:
+            since (int): the id of the user before the page.
+
+        Returns:
+            list: the users in the page as dicts, empty when there are no more users.
+        """
+
+        return self.fetch_page_if_changed(since)[0]
+
+    def fetch_page_if_changed(self, since, etag=None):
+        """
+        Fetch one page of users unless it still has the passed ETag, waiting out rate limits and retrying transient
+        failures. GitHub does not count requests answered with 304 Not Modified against the rate limit.
+
+        Parameters:
+            since (int): the id of the user before the page.
+            etag (str): the ETag of the page when it was last fetched, if any.
+
+        Returns:
+            tuple: the users in the page as dicts, empty when there are no more users or None when the page is
+                unchanged, and the page's ETag.
+        """
+
+        headers = {"If-None-Match": etag} if etag else {}
+        attempt = 0
+        while True:
+
+            # Wait for the rate limit window to reset once it has been used up
+            if self._rate_limit_reset is not None:
+                self._wait_until(self._rate_limit_reset)
+                self._rate_limit_reset = None
+
+            try:
+                response = self.session.get(self.url, params={"per_page": self.per_page, "since": since},
+                                            headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                attempt = self._retry(attempt, f"request for users since {since} failed with {e}")
+                continue
+
+            if response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+                self._rate_limit_reset = float(response.headers["X-RateLimit-Reset"])
+
+            if response.status_code == 200:
+                return response.json(), response.headers.get("ETag")
+            if response.status_code == 304 and etag:
+                return None, etag
+
+            # Rate limited responses say when to come back and do not count as failures
+            if response.status_code in (403, 429) and "Retry-After" in response.headers:
+                delay = self._retry_after(response.headers["Retry-After"])
+                logging.warning(f"Rate limited, retrying after {delay} seconds")
+                self.sleep(delay)
+                continue
+            if response.status_code in (403, 429) and self._rate_limit_reset is not None:
+                logging.warning(f"Rate limit exhausted, waiting until {self._rate_limit_reset}")
+                continue
+
+            if response.status_code >= 500 or response.status_code == 429:
+                attempt = self._retry(attempt, f"request for users since {since} returned {response.status_code}")
+                continue
+
+            response.raise_for_status()
+            raise requests.HTTPError(f"unexpected status {response.status_code} fetching users", response=response)
+
+    def _pages(self, since, remaining):
+        """
+        Fetch pages of users in order on a background thread, so requests overlap with writing the pages.
+
+        Parameters:
+            since (int): the id of the user before the first page.
+            remaining (int): the number of users to fetch.
+
+        Returns:
+            generator: a (since, users, ETag) tuple for each page.
+        """
+
+        if remaining <= 0:
+            return
+
+        pages = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        fetcher = threading.Thread(target=self._fetch_pages, args=(since, remaining, pages, stop), daemon=True)
+        fetcher.start()
+
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+            fetcher.join()
+
+    @staticmethod
+    def _truncate(users, etag, remaining):
+        """
+        Cut a page down to the number of users still wanted, dropping its ETag if it no longer matches what is written.
+
+        Parameters:
+            users (list): the users in the page as dicts.
+            etag (str): the ETag of the page.
+            remaining (int): the number of users still wanted.
+
+        Returns:
+            tuple: the users to write and the ETag to record for them, None when the page was cut.
+        """
+
+        return (users, etag) if len(users) <= remaining else (users[:remaining], None)
+
+    def _append(self, last_id, count, total):
+        """
+        Write pages of the users after the passed id until the table holds the passed number, checkpointing each page
+        in the same transaction as its users. With a write queue, pages are written on its thread while the next ones
+        are fetched, and the first failure stops the pages after it so the checkpoint never skips one.
+
+        Parameters:
+            last_id (int): the id of the last user in the table.
+            count (int): the number of users in the table.
+            total (int): the number of users the table should hold.
+
+        Returns:
+            int: the number of users added.
+        """
+
+        state = {"count": count, "error": None}
+
+        def write(db, since, users, etag):
+            if state["error"] is not None:
+                raise RuntimeError(f"not writing users since {since} after an earlier page failed")
+            try:
+                with db.transaction():
+                    added = self._write_page(since, users, etag, db=db)[0]
+                    self.checkpoint_dao.create_many(db, [{"name": self.name, "last_id": users[-1]["id"],
+                                                          "count": state["count"] + added}], on_conflict="update")
+            except Exception as e:
+                state["error"] = e
+                raise
+            state["count"] += added
+
+        queued = count
+        for since, users, etag in self._pages(last_id, total - count):
+            users, etag = self._truncate(users, etag, total - queued)
+            if self.write_queue is None:
+                write(self.db, since, users, etag)
+            elif state["error"] is None:
+                self.write_queue.submit(write, since, users, etag, size=len(users))
+            else:
+                break
+            queued += len(users)
+            logging.info(f"Seed is {(100 * queued) // total}% {'complete' if self.write_queue is None else 'queued'}")
+
+        if self.write_queue is not None:
+            self.write_queue.flush()
+            if state["error"] is not None:
+                raise state["error"]
+
+        return state["count"] - count
+
+    def _write_page(self, since, users, etag, through=None, db=None):
+        """
+        Write a page of users in one transaction, deleting the stored users in the page's range that it no longer
+        lists and recording the page's ETag.
+
+        Parameters:
+            since (int): the id of the user before the page.
+            users (list): the users in the page as dicts.
+            etag (str): the ETag of the page, or None if the page was not written whole.
+            through (int): the last id of the range to delete missing users from when the page is empty.
+            db (Db): the database to write to, defaulting to the seeder's.
+
+        Returns:
+            tuple: the number of users written and the number deleted.
+        """
+
+        db = db or self.db
+        through = users[-1]["id"] if users else through
+        with db.transaction():
+            written = self.user_dao.create_many(db, users, on_conflict="update")
+            listed = {user["id"] for user in users}
+            stale = [key for key in self.user_dao.read_keys(db, since, through) if key not in listed]
+            deleted = self.user_dao.delete_many(db, stale)
+
+            # Pages starting inside this one are gone, as earlier users were deleted or later ones inserted
+            self.sync_page_dao.delete_many(db, self.sync_page_dao.read_keys(db, since, through - 1))
+            if users:
+                self.sync_page_dao.create_many(db, [{"since": since, "last_id": through, "etag": etag}],
+                                               on_conflict="update")
+            else:
+                self.sync_page_dao.delete_many(db, [since])
+
+        return written, deleted
+
+    def _fetch_pages(self, since, remaining, pages, stop):
+        """
+        Fetch (since, users, ETag) pages in order onto a queue until enough are fetched, ending with None or an
+        exception.
+
+        Parameters:
+            since (int): the id of the user before the first page.
+            remaining (int): the number of users to fetch.
+            pages (queue.Queue): the queue to put pages on.
+            stop (threading.Event): set by the writer to stop fetching early.
+
+        Returns: None
+        """
+
+        try:
+            while remaining > 0 and not stop.is_set():
+                page, etag = self.fetch_page_if_changed(since)
+                if not page:
+                    break
+                self._put(pages, (since, page, etag), stop)
+                since = page[-1]["id"]
+                remaining -= len(page)
+        except Exception as e:
+            self._put(pages, e, stop)
+            return
+
+        self._put(pages, None, stop)
+
+    @staticmethod
+    def _put(pages, item, stop):
+        """
+        Put an item on the page queue, giving up if the writer has stopped.
+
+        Parameters:
+            pages (queue.Queue): the queue to put the item on.
+            item: the item to put.
+            stop (threading.Event): set by the writer when it stops reading the queue.
+
+        Returns: None
+        """
+
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _retry(self, attempt, message):
+        """
+        Wait before retrying a failed request, with exponential backoff.
+
+        Parameters:
+            attempt (int): the number of retries already made.
+            message (str): a description of the failure.
+
+        Returns:
+            int: the number of retries made including this one.
+        """
+
+        if attempt >= self.max_retries:
+            raise requests.exceptions.RetryError(f"{message}; giving up after {attempt} retries")
+
+        delay = self.backoff * pow(2, attempt)
+        logging.warning(f"{message}; retrying in {delay} seconds")
+        self.sleep(delay)
+        return attempt + 1
+
+    def _retry_after(self, value):
+        """
+        Read the delay a Retry-After header asks for, given either as seconds or as an HTTP date.
+
+        Parameters:
+            value (str): the value of the Retry-After header.
+
+        Returns:
+            float: the seconds to wait, never negative. Unreadable values wait for the first backoff delay.
+        """
+
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                logging.warning(f"Unable to read Retry-After header {value!r}")
+                delay = self.backoff
+        return max(delay, 0.0)
+
+    def _wait_until(self, timestamp):
+        """
+        Wait until the passed time.
+
+        Parameters:
+            timestamp (float): the time to wait for, in seconds since the epoch.
+
+        Returns: None
+        """
+
+        delay = timestamp - time.time()
+        if delay > 0:
+            self.sleep(delay + 1)
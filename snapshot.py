@@ -0,0 +1,344 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import logging
+import threading
+import time
+
+# SQLite's LOWER only folds ASCII letters, so sort keys must do the same to match the database's order
+ascii_lower = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def sort_key(value, fold):
+    """
+    Get a key that sorts a value the way SQLite orders it: NULLs, then numbers, then text, then blobs.
+
+    Parameters:
+        value: the value to sort.
+        fold (bool): fold ASCII letters to lower case, as the LOWER sort expression of a text column does?
+
+    Returns:
+        tuple: the sort key.
+    """
+
+    if value is None:
+        return 0, 0
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value.translate(ascii_lower) if fold else value
+    return 3, value
+
+
+class TextColumn:
+    """
+    This is a compact, immutable column of strings, stored as one UTF-8 buffer and the offset of each string in it.
+    """
+
+    def __init__(self, values):
+        """
+        This TextColumn class constructor.
+
+        Parameters:
+            values (list): the strings in the column.
+        """
+
+        encoded = [value.encode() for value in values]
+        self.offsets = array("q", [0])
+        total = 0
+        for value in encoded:
+            total += len(value)
+            self.offsets.append(total)
+        self.data = b''.join(encoded)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+class _KeyedSequence:
+    """
+    This is a read-only view of a sequence through a key function, so bisect can search it by key on Python versions
+    whose bisect functions take no key argument. Keys are computed only for the items bisect looks at.
+    """
+
+    __slots__ = ("items", "key")
+
+    def __init__(self, items, key):
+        """
+        This _KeyedSequence class constructor.
+
+        Parameters:
+            items (sequence): the items to view.
+            key (callable): the function giving the key of an item.
+        """
+
+        self.items = items
+        self.key = key
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.key(self.items[index])
+
+
+class TableSnapshot:
+    """
+    This is an in-memory, read-only copy of a table for serving pages without querying the database. Each column is
+    held as a compact array and each sortable column and compound sort has a permutation of the records in its order,
+    so a page at any offset is read in O(page size) and a page after a cursor in O(log n + page size).
+
+    The snapshot only serves reads while the table's data version matches the one it was built from. When the table
+    changes, reads fall back to the database while a new snapshot is built on a background thread.
+
+    Attributes:
+        TableSnapshot.dao (GenericDao): the table being copied.
+        TableSnapshot.version (int): the data version of the table the snapshot was built from, or None before the
+            first build.
+    """
+
+    def __init__(self, dao, connect=None):
+        """
+        This TableSnapshot class constructor.
+
+        Parameters:
+            dao (GenericDao): the table to copy.
+            connect (callable): returns a Db to rebuild the snapshot from on a background thread, or None to only
+                rebuild when refresh is called.
+        """
+
+        self.dao = dao
+        self.connect = connect
+        self.version = None
+
+        self._lock = threading.Lock()
+        self._data = None
+        self._building = False
+        self._hits = 0
+        self._misses = 0
+        self._builds = 0
+        self._build_seconds = 0.0
+
+    def refresh(self, db):
+        """
+        Rebuild the snapshot from the passed database if the table has changed since it was built.
+
+        Parameters:
+            db (Db): the database to read the table from.
+
+        Returns:
+            bool: Is the snapshot current?
+        """
+
+        version = db.get_data_version(self.dao)
+        if version is None:
+            return False
+        if version == self.version:
+            return True
+
+        started = time.perf_counter()
+        data = self._load(db)
+
+        # Only keep the copy if nothing was written while it was read
+        if db.get_data_version(self.dao) != version:
+            logging.info(f"{self.dao.table_name} changed while its snapshot was built, discarding it")
+            return False
+
+        data["version"] = version
+        with self._lock:
+            self._data = data
+            self.version = version
+            self._builds += 1
+            self._build_seconds = time.perf_counter() - started
+        logging.info(f"Built snapshot of {self.dao.table_name} at version {version} with {data['size']} records in "
+                     f"{self._build_seconds:.2f} seconds")
+        return True
+
+    def read(self, db, offset, limit, order_terms, cursor=None):
+        """
+        Read a page of records the way GenericDao.read does, if the snapshot is current and holds the ordering.
+
+        Parameters:
+            db (Db): the database the page is read for, used to check the table's data version.
+            offset (int): the number of records to skip, ignored when a cursor is passed.
+            limit (int): the largest number of records to return.
+            order_terms (list): the (column name, descending flag) terms returned by GenericDao.get_order_terms.
+            cursor (dict): a decoded cursor to seek from, as returned by GenericDao.decode_cursor.
+
+        Returns:
+            list: the records in the page, or None if the page must be read from the database.
+        """
+
+        data = self._data
+        if data is None or db.get_data_version(self.dao) != data["version"]:
+            self._count(False)
+            self._rebuild_in_background()
+            return None
+
+        # The terms after the primary key never change the order; the rest must share a direction to be served, and the
+        # primary key must sort as stored since the records are held in its order
+        schema = self.dao.schema
+        terms = []
+        for column, desc in order_terms:
+            terms.append((column, desc))
+            if column == schema.primary_key:
+                break
+        key_columns = tuple(column for column, _ in terms[:-1])
+        if terms[-1][0] != schema.primary_key or schema.sort_expressions[schema.primary_key] != schema.primary_key or \
+                len(set(desc for _, desc in terms)) != 1 or (key_columns and key_columns not in data["permutations"]):
+            self._count(False)
+            return None
+
+        order = data["permutations"][key_columns] if key_columns else range(data["size"])
+        desc = terms[0][1]
+
+        if cursor is None:
+            start = data["size"] - offset - limit if desc else offset
+            indexes = order[max(start, 0):max(start + limit, 0)]
+        else:
+            # Seek past the cursor's key, walking the ordering in reverse for a backward cursor
+            folds = [schema.sort_expressions[column] != column for column in key_columns]
+            key = tuple(sort_key(value, fold) for value, fold in zip(cursor["key"], folds)) + \
+                (cursor["key"][len(key_columns)],)
+            columns = [data["columns"][schema.column_index[column]] for column in key_columns]
+            primary_key = data["columns"][schema.primary_key_index]
+
+            def row_key(i):
+                return tuple(sort_key(column[i], fold) for column, fold in zip(columns, folds)) + (primary_key[i],)
+
+            if desc != cursor["backward"]:
+                end = bisect_left(_KeyedSequence(order, row_key), key)
+                indexes = order[max(end - limit, 0):end]
+            else:
+                start = bisect_right(_KeyedSequence(order, row_key), key)
+                indexes = order[start:start + limit]
+
+        # Every slice above is in ascending order
+        if desc:
+            indexes = indexes[::-1]
+
+        self._count(True)
+        columns = data["columns"]
+        return [tuple(column[i] for column in columns) for i in indexes]
+
+    def stats(self):
+        """
+        Get usage metrics for the snapshot.
+
+        Parameters: None
+
+        Returns:
+            dict: the version, number of records and bytes held, reads served and passed to the database, and the
+                number and duration in seconds of the last build.
+        """
+
+        with self._lock:
+            data = self._data
+            return {
+                "version": self.version,
+                "records": data["size"] if data else 0,
+                "bytes": data["bytes"] if data else 0,
+                "hits": self._hits,
+                "misses": self._misses,
+                "builds": self._builds,
+                "build_seconds": self._build_seconds
+            }
+
+    def _load(self, db):
+        """
+        Read the whole table into compact columns and build the permutation of each ordering.
+
+        Parameters:
+            db (Db): the database to read the table from.
+
+        Returns:
+            dict: the number of records, columns, permutations keyed by sort column tuple and bytes held.
+        """
+
+        schema = self.dao.schema
+        values = [[] for _ in schema.columns]
+        for row in self.dao.iterate(db, batch_size=10000):
+            for column, value in zip(values, row):
+                column.append(value)
+        size = len(values[0])
+        primary_key = values[schema.primary_key_index]
+
+        # Let the database order each sort through its index, with the primary key as the tiebreaker, so the snapshot
+        # orders records exactly as the database does
+        positions = {key: i for i, key in enumerate(primary_key)}
+        permutations = {}
+        typecode = "i" if size < pow(2, 31) else "q"
+        sorts = [(column,) for column in schema.sortable_columns if column != schema.primary_key] + \
+            list(schema.compound_sorts)
+        cursor = db.connection.cursor()
+        try:
+            for sort in sorts:
+                order_string = ', '.join([schema.sort_expressions[column] for column in sort] + [schema.primary_key])
+                cursor.execute(f"SELECT {schema.primary_key} FROM {schema.table_name} ORDER BY {order_string}")
+                permutations[sort] = array(typecode, [positions[row[0]] for row in cursor])
+        finally:
+            cursor.close()
+
+        # Store each column in the most compact form its values allow
+        columns = []
+        for column, column_type in zip(values, schema.column_types):
+            if column_type == "integer" and all(type(value) is int for value in column):
+                columns.append(array("q", column))
+            elif all(type(value) is str for value in column):
+                columns.append(TextColumn(column))
+            else:
+                columns.append(column)
+
+        nbytes = sum(c.nbytes() if isinstance(c, TextColumn) else c.itemsize * len(c) if isinstance(c, array)
+                     else 8 * len(c) for c in columns) + sum(p.itemsize * len(p) for p in permutations.values())
+        return {"size": size, "columns": columns, "permutations": permutations, "bytes": nbytes}
+
+    def _rebuild_in_background(self):
+        """
+        Start rebuilding the snapshot on a background thread, unless a rebuild is running or there is no way to
+        connect to the database.
+
+        Parameters: None
+        Returns: None
+        """
+
+        with self._lock:
+            if self.connect is None or self._building:
+                return
+            self._building = True
+
+        def rebuild():
+            try:
+                db = self.connect()
+                try:
+                    self.refresh(db)
+                finally:
+                    db.close()
+            except Exception:
+                logging.exception(f"Unable to build snapshot of {self.dao.table_name}")
+            finally:
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=rebuild, name=f"{self.dao.table_name}_snapshot", daemon=True).start()
+
+    def _count(self, hit):
+        """
+        Count a read served by the snapshot or passed to the database.
+
+        Parameters:
+            hit (bool): Was the read served by the snapshot?
+
+        Returns: None
+        """
+
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
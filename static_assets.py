@@ -0,0 +1,208 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from response_encoder import brotli, gzip_compress, parse_accept_encoding
+
+
+class Asset:
+    """
+    This is one static file held in memory with its precompressed variants.
+
+    Attributes:
+        Asset.path (str): the path of the file relative to the asset root, with forward slashes.
+        Asset.content_type (str): the MIME type of the file.
+        Asset.fingerprint (str): a hash of the file's content, changing whenever the content does.
+        Asset.variants (dict): the body of the file in each content coding, keyed "identity", "gzip" or "br", holding
+            only the codings that make it smaller.
+    """
+
+    __slots__ = ("path", "content_type", "fingerprint", "variants")
+
+    def __init__(self, path, content_type, data):
+        """
+        This Asset class constructor, compressing the file with every available coding.
+
+        Parameters:
+            path (str): the path of the file relative to the asset root, with forward slashes.
+            content_type (str): the MIME type of the file.
+            data (bytes): the content of the file.
+        """
+
+        self.path = path
+        self.content_type = content_type
+        self.fingerprint = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = {"identity": data}
+
+        compressed = {"gzip": gzip_compress(data, 9)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=11)
+        for coding, body in compressed.items():
+            if len(body) < len(data):
+                self.variants[coding] = body
+
+    def get_etag(self, coding):
+        """
+        Get the entity tag of a variant of the file. Each coding has its own tag as the bodies differ.
+
+        Parameters:
+            coding (str): the variant's content coding.
+
+        Returns:
+            str: the quoted entity tag.
+        """
+
+        return f'"{self.fingerprint}"' if coding == "identity" else f'"{self.fingerprint}-{coding}"'
+
+
+class StaticAssets:
+    """
+    This serves the page and its images from memory. Every file is read, fingerprinted and compressed once when the
+    assets are loaded; references to the images in the page are rewritten to carry their fingerprint, so a browser
+    can keep a fingerprinted URL forever and a changed image gets a new URL. Files are not reread until load is called
+    again.
+
+    Attributes:
+        StaticAssets.root (str): the directory holding the assets.
+        StaticAssets.index (str): the path of the page, which is always revalidated.
+        StaticAssets.directories (tuple): the directories under root whose files are served.
+        StaticAssets.max_age (int): the number of seconds a browser may keep a fingerprinted URL.
+    """
+
+    def __init__(self, root=".", index="index.html", directories=("images",), max_age=31536000):
+        """
+        This StaticAssets class constructor, loading the assets.
+
+        Parameters:
+            root (str): the directory holding the assets.
+            index (str): the path of the page under root.
+            directories (tuple): the directories under root whose files are served.
+            max_age (int): the number of seconds a browser may keep a fingerprinted URL.
+        """
+
+        self.root = root
+        self.index = index
+        self.directories = directories
+        self.max_age = max_age
+        self._assets = {}
+        self.load()
+
+    def load(self):
+        """
+        Read, fingerprint and compress every asset, replacing those held.
+
+        Parameters: None
+        Returns: None
+        """
+
+        assets = {}
+        for directory in self.directories:
+            for name in sorted(os.listdir(os.path.join(self.root, directory))):
+                filename = os.path.join(self.root, directory, name)
+                if os.path.isfile(filename):
+                    with open(filename, "rb") as file:
+                        assets[f"{directory}/{name}"] = Asset(f"{directory}/{name}", self._guess_type(name),
+                                                              file.read())
+
+        # Point the page's references to the files at their fingerprinted URLs
+        with open(os.path.join(self.root, self.index), encoding="utf-8") as file:
+            page = file.read()
+        pattern = re.compile("|".join(re.escape(path) for path in sorted(assets, key=len, reverse=True))
+                             + r"(?=[\"'?#])") if assets else None
+        if pattern is not None:
+            page = pattern.sub(lambda match: f"{match.group(0)}?v={assets[match.group(0)].fingerprint}", page)
+        assets[self.index] = Asset(self.index, "text/html; charset=utf-8", page.encode())
+
+        self._assets = assets
+        logging.info(f"Loaded {len(assets)} static assets in "
+                     f"{sum(len(asset.variants['identity']) for asset in assets.values())} bytes")
+
+    def get(self, path):
+        """
+        Get a loaded asset.
+
+        Parameters:
+            path (str): the path of the file relative to the asset root, with forward slashes.
+
+        Returns:
+            Asset: the asset, or None if there is no such file.
+        """
+
+        return self._assets.get(path)
+
+    def respond(self, path, version=None, accept_encoding=None, if_none_match=None):
+        """
+        Answer a request for an asset with the smallest variant the client accepts, or 304 if it holds it already.
+
+        Parameters:
+            path (str): the path of the file relative to the asset root, with forward slashes.
+            version (str): the fingerprint in the request's v query parameter, if any.
+            accept_encoding (str): the value of the request's Accept-Encoding header, if any.
+            if_none_match (str): the value of the request's If-None-Match header, if any.
+
+        Returns:
+            tuple: the status code, the response body and a dict of response headers.
+        """
+
+        asset = self._assets.get(path)
+        if asset is None:
+            return 404, b"Not Found", {"Content-Type": "text/plain"}
+
+        # Pick the smallest variant in a coding the client accepts
+        codings = parse_accept_encoding(accept_encoding)
+        coding = min((c for c in asset.variants if c == "identity" or codings.get(c, codings.get("*", 0.0)) > 0),
+                     key=lambda c: len(asset.variants[c]))
+
+        # A URL carrying the current fingerprint never changes; anything else is revalidated on every use
+        immutable = path != self.index and version == asset.fingerprint
+        headers = {
+            "Content-Type": asset.content_type,
+            "ETag": asset.get_etag(coding),
+            "Cache-Control": f"public, max-age={self.max_age}, immutable" if immutable else "no-cache"
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+
+        # Any variant of the current content satisfies a conditional request
+        tags = [tag.strip() for tag in (if_none_match or "").split(",")]
+        tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        if "*" in tags or any(asset.get_etag(c) in tags for c in asset.variants):
+            return 304, b"", headers
+
+        return 200, asset.variants[coding], headers
+
+    def stats(self):
+        """
+        Get the assets held.
+
+        Parameters: None
+
+        Returns:
+            dict: the number of assets and the bytes held in each content coding.
+        """
+
+        assets = list(self._assets.values())
+        return {
+            "assets": len(assets),
+            "bytes": {coding: sum(len(asset.variants[coding]) for asset in assets if coding in asset.variants)
+                      for coding in ("identity", "gzip", "br")}
+        }
+
+    @staticmethod
+    def _guess_type(name):
+        """
+        Guess the MIME type of a file from its name.
+
+        Parameters:
+            name (str): the file name.
+
+        Returns:
+            str: the MIME type, with a UTF-8 charset for text.
+        """
+
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return f"{content_type}; charset=utf-8" if content_type.startswith("text/") else content_type
@@ -0,0 +1,30 @@
+from generic_dao import GenericDao
+
+
+class SyncPageDao(GenericDao):
+    """
+    This defines the name and structure of the sync_page table, which records the last user and the ETag of each page
+    of the GitHub users API written to the database, so a later sync can ask GitHub for changed pages only.
+
+     Attributes:
+            SyncPageDao.table_name (str): the name of this table in the database.
+            SyncPageDao.columns (list): the names of the columns in this table.
+            SyncPageDao.column_types (list): the data types of the columns in this table.
+            SyncPageDao.primary_key_index (int): the index of the table primary key.
+    """
+
+    @property
+    def table_name(self):
+        return "sync_page"
+
+    @property
+    def columns(self):
+        return ["since", "last_id", "etag"]
+
+    @property
+    def column_types(self):
+        return ["integer", "integer", "text"]
+
+    @property
+    def primary_key_index(self):
+        return 0
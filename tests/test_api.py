@@ -0,0 +1,381 @@
+import asyncio
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from os.path import exists
+import shutil
+import threading
+import time
+import unittest
+
+from urllib.parse import urlencode
+
+from avatar_cache import AvatarCache
+from db import Db
+from user_dao import UserDao
+
+os.environ["USER_API_DB"] = "api_test"
+import api
+import asgi_api
+
+
+class TestApi(unittest.TestCase):
+
+    db_name = "api_test"
+
+    test_users = [
+        {
+            "login": f"user{i:02d}",
+            "id": i,
+            "node_id": f"node{i:02d}",
+            "avatar_url": f"https://avatars.example.com/u/{i}",
+            "html_url": f"https://github.example.com/user{i:02d}",
+            "type": "Organization" if i % 3 == 0 else "User",
+            "site_admin": i == 1
+        } for i in range(1, 31)
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestApi.db_name}.db'):
+            raise unittest.SkipTest(f"Database test file '{TestApi.db_name}.db' already exists. Aborting.")
+
+        db = Db(TestApi.db_name)
+        user_dao = UserDao()
+        db.create_table(user_dao)
+        for user in TestApi.test_users:
+            user_dao.create(db, user)
+        db.commit()
+        db.close()
+
+        cls.client = api.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        api.pool.close()
+        if exists(f'{TestApi.db_name}.db'):
+            os.remove(f'{TestApi.db_name}.db')
+
+    @staticmethod
+    def user_query(start, length, column=0, direction="asc", cursor=""):
+        return {
+            "draw": 1,
+            "start": start,
+            "length": length,
+            "order[0][column]": column,
+            "order[0][dir]": direction,
+            "columns[0][name]": "id",
+            "columns[1][name]": "login",
+            "cursor": cursor
+        }
+
+    @staticmethod
+    def asgi_get(path, query, headers=()):
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": urlencode(query).encode(),
+                 "headers": [(name.lower().encode(), value.encode()) for name, value in headers], "http_version": "1.1"}
+        events = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(event):
+            events.append(event)
+
+        asyncio.run(asgi_api.app(scope, receive, send))
+        headers = {name.decode(): value.decode() for name, value in events[0]["headers"]}
+        return events[0]["status"], headers, b''.join(event.get("body", b"") for event in events[1:])
+
+    def test_user(self):
+
+        # Read a page by offset
+        response = self.client.get('/user', query_string=TestApi.user_query(10, 10, 1, "desc"))
+        self.assertEqual(response.status_code, 200, f"User request failed with status {response.status_code}")
+        payload = response.get_json()
+        self.assertEqual(payload["recordsTotal"], 30, f"recordsTotal of {payload['recordsTotal']} is not 30")
+        self.assertFalse(payload["estimated"], f"Exact counts are flagged as estimated")
+        self.assertEqual([row[1] for row in payload["data"]], list(range(20, 10, -1)),
+                         f"Offset page returned the wrong users")
+
+        # Follow the cursors to the neighbouring pages
+        cursor = ','.join([payload["cursor_next"], payload["cursor_prev"]])
+        payload = self.client.get('/user', query_string=TestApi.user_query(20, 10, 1, "desc", cursor)).get_json()
+        self.assertEqual([row[1] for row in payload["data"]], list(range(10, 0, -1)),
+                         f"Next page cursor returned the wrong users")
+
+        payload = self.client.get('/user', query_string=TestApi.user_query(0, 10, 1, "desc", cursor)).get_json()
+        self.assertEqual([row[1] for row in payload["data"]], list(range(30, 20, -1)),
+                         f"Previous page cursor returned the wrong users")
+
+        # Sort on several columns
+        query = TestApi.user_query(0, 12, 2, "desc")
+        query.update({"columns[2][name]": "type", "order[1][column]": 0, "order[1][dir]": "asc"})
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual([row[1] for row in payload["data"]], [1, 2, 4, 5, 7, 8, 10, 11, 13, 14, 16, 17],
+                         f"Multi-column sort returned the wrong users")
+
+        # Filter by the search box
+        query = TestApi.user_query(0, 10)
+        query["search[value]"] = "user2"
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual((payload["recordsTotal"], payload["recordsFiltered"]), (30, 10),
+                         f"Search counts {payload['recordsTotal']}, {payload['recordsFiltered']} are not 30, 10")
+        self.assertEqual([row[1] for row in payload["data"]], list(range(20, 30)), f"Search returned the wrong users")
+
+        # Terms shorter than three characters only match the start of a column
+        for term, filtered in [("27", 0), ("r27", 1), ("us", 30)]:
+            query["search[value]"] = term
+            payload = self.client.get('/user', query_string=query).get_json()
+            self.assertEqual(payload["recordsFiltered"], filtered,
+                             f"Search for {term} matched {payload['recordsFiltered']} users, not {filtered}")
+
+        # Reject unknown sort columns
+        query = TestApi.user_query(0, 10)
+        query["columns[0][name]"] = "password"
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertIn("error", payload, f"Sorting on an unknown column did not return an error")
+
+    def test_projection(self):
+
+        # Only the row values read by the columns' data indexes are sent, each at its index
+        query = TestApi.user_query(0, 5, 1, "asc")
+        query.update({"columns[0][data]": 1, "columns[1][data]": 0, "columns[2][data]": 5})
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual(payload["data"][0], ["user01", 1, None, None, None, "User"],
+                         f"Projected row {payload['data'][0]} does not hold only the requested values")
+
+        # Cursors are still made from whole rows
+        query["cursor"] = payload["cursor_next"]
+        query["start"] = 5
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual([row[1] for row in payload["data"]], list(range(6, 11)), f"Projected cursor page is wrong")
+
+        # Columns reading anything other than a row index get whole rows
+        query["columns[2][data]"] = "type"
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual(len(payload["data"][0]), 7, f"Rows were projected for a non-index column")
+
+    def test_compression(self):
+
+        min_size = api.response_encoder.min_size
+        api.response_encoder.min_size = 100
+        try:
+            query = TestApi.user_query(0, 10)
+            response = self.client.get('/user', query_string=query, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers.get("Content-Encoding"), "gzip", f"/user was not gzipped")
+            payload = json.loads(gzip.decompress(response.get_data()))
+            identity = self.client.get('/user', query_string=query)
+            self.assertEqual(payload, identity.get_json(), f"gzipped /user payload differs from the identity one")
+
+            # Each coding of the page has its own entity tag, and either revalidates the page
+            etag = response.headers["ETag"]
+            self.assertEqual(etag, f'{identity.headers["ETag"][:-1]}-gzip"', f"gzipped /user has ETag {etag}")
+            response = self.client.get('/user', query_string=query, headers={"If-None-Match": etag})
+            self.assertEqual((response.status_code, response.headers["ETag"]), (304, etag),
+                             f"Conditional request with the gzip ETag was not answered with it")
+
+            status, headers, body = TestApi.asgi_get("/user", query, [("Accept-Encoding", "gzip")])
+            self.assertEqual(headers.get("content-encoding"), "gzip", f"ASGI /user was not gzipped")
+            self.assertEqual(json.loads(gzip.decompress(body)), payload, f"ASGI gzipped payload differs")
+            self.assertEqual(headers["etag"], etag, f"ASGI gzipped /user ETag differs from the Flask route")
+        finally:
+            api.response_encoder.min_size = min_size
+
+    def test_avatar(self):
+
+        class Avatars(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.end_headers()
+                self.wfile.write(b"\x89PNG avatar " + self.path.encode())
+
+            def log_message(self, format, *args):
+                pass
+
+        if exists("avatar_cache_api_test"):
+            raise unittest.SkipTest(f"Cache test directory 'avatar_cache_api_test' already exists. Aborting.")
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Avatars)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host = f"127.0.0.1:{server.server_address[1]}"
+        avatar_cache = api.avatar_cache
+        api.avatar_cache = AvatarCache("avatar_cache_api_test", size=50, allowed_hosts=[host])
+        db = Db(TestApi.db_name)
+        db.cursor.execute(f"UPDATE git_user SET avatar_url = 'http://{host}/u/2?v=4' WHERE id = 2")
+        db.commit()
+        try:
+            # Avatars are served as cacheable thumbnails, and revalidated by ETag
+            response = self.client.get('/avatar/2')
+            self.assertEqual(response.status_code, 200, f"Avatar request failed with status {response.status_code}")
+            self.assertEqual(response.get_data(), b"\x89PNG avatar /u/2?v=4&s=50", f"Avatar was not a thumbnail")
+            self.assertEqual(response.mimetype, "image/png", f"Avatar served as {response.mimetype}")
+            self.assertIn("max-age", response.headers.get("Cache-Control", ""), f"Avatar is not cacheable")
+            response = self.client.get('/avatar/2', headers={"If-None-Match": response.headers["ETag"]})
+            self.assertEqual(response.status_code, 304, f"Conditional avatar request returned {response.status_code}")
+
+            # Unknown users and avatars on other hosts are refused
+            self.assertEqual(self.client.get('/avatar/999').status_code, 404, f"Avatar of unknown user served")
+            self.assertEqual(self.client.get('/avatar/3').status_code, 403, f"Avatar on a disallowed host served")
+        finally:
+            db.cursor.execute("UPDATE git_user SET avatar_url = 'https://avatars.example.com/u/2' WHERE id = 2")
+            db.commit()
+            db.close()
+            api.avatar_cache = avatar_cache
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree("avatar_cache_api_test", ignore_errors=True)
+            api.response_cache.clear()
+
+    def test_response_cache(self):
+
+        api.response_cache.clear()
+        query = TestApi.user_query(0, 5, 1, "asc")
+
+        # The first request misses and the repeat hits, whatever its draw counter
+        response = self.client.get('/user', query_string=query)
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag, f"User response has no ETag")
+        hits = api.response_cache.stats()["hits"]
+
+        query["draw"] = 2
+        payload = self.client.get('/user', query_string=query).get_json()
+        self.assertEqual(payload["draw"], 2, f"Cached response did not echo the request's draw counter")
+        self.assertEqual(api.response_cache.stats()["hits"], hits + 1, f"Repeated request was not served from cache")
+
+        # A conditional request for an unchanged page is not modified
+        response = self.client.get('/user', query_string=query, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304, f"Conditional request returned {response.status_code}")
+
+        # A write changes the data version, so the page is rebuilt with a new ETag
+        db = Db(TestApi.db_name)
+        db.cursor.execute("UPDATE git_user SET login = 'aardvark' WHERE id = 3")
+        db.commit()
+        api.response_cache.clear()
+
+        response = self.client.get('/user', query_string=query, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200, f"Conditional request for a changed page was not modified")
+        self.assertNotEqual(response.headers.get("ETag"), etag, f"ETag did not change after a write")
+        self.assertEqual(response.get_json()["data"][0][0], "aardvark", f"Cached data served after a write")
+
+        db.cursor.execute("UPDATE git_user SET login = 'user03' WHERE id = 3")
+        db.commit()
+        db.close()
+        api.response_cache.clear()
+
+    def test_export(self):
+
+        # Newline-delimited JSON of every user
+        response = self.client.get('/user/export')
+        self.assertEqual(response.status_code, 200, f"Export failed with status {response.status_code}")
+        users = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([user["id"] for user in users], list(range(1, 31)), f"Export did not stream every user")
+        self.assertEqual(users[0]["login"], "user01", f"Export did not include every column")
+
+        # CSV of some columns, gzipped
+        response = self.client.get('/user/export?format=csv&columns=id,login', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip", f"Export was not gzipped")
+        lines = gzip.decompress(response.get_data()).decode().splitlines()
+        self.assertEqual(lines[:2], ["id,login", "1,user01"], f"CSV export starts with {lines[:2]}")
+        self.assertEqual(len(lines), 31, f"CSV export has {len(lines)} lines rather than 31")
+
+        # Codings the client refuses with q=0 are not used
+        response = self.client.get('/user/export?format=csv&columns=id', headers={"Accept-Encoding": "gzip;q=0, br"})
+        self.assertIsNone(response.headers.get("Content-Encoding"), f"Export was gzipped for a client refusing gzip")
+        self.assertEqual(response.get_data(as_text=True).split("\n")[:2], ["id", "1"], f"Uncompressed export is wrong")
+
+        # Unknown formats and columns are rejected
+        self.assertEqual(self.client.get('/user/export?format=xml').status_code, 400, f"Unknown format accepted")
+        self.assertEqual(self.client.get('/user/export?columns=password').status_code, 400, f"Unknown column accepted")
+
+    def test_static(self):
+
+        # The page links fingerprinted images, which are served as immutable
+        page = self.client.get('/').get_data(as_text=True)
+        star = api.static_assets.get("images/star.png")
+        self.assertIn(f"images/star.png?v={star.fingerprint}", page, f"Page does not link the fingerprinted image")
+        response = self.client.get(f'/images/star.png?v={star.fingerprint}')
+        self.assertEqual(response.get_data(), star.variants["identity"], f"Image content differs from the file")
+        self.assertIn("immutable", response.headers["Cache-Control"], f"Fingerprinted image is not immutable")
+
+        # The page is sent gzipped and revalidated
+        response = self.client.get('/', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip", f"Page was not gzipped")
+        self.assertEqual(gzip.decompress(response.get_data()).decode(), page, f"gzipped page differs")
+        response = self.client.get('/', headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304, f"Conditional page request returned {response.status_code}")
+        self.assertEqual(self.client.get('/images/missing.png').status_code, 404, f"Missing image was found")
+
+    def test_stats(self):
+
+        self.client.get('/user', query_string=TestApi.user_query(0, 10))
+        payload = self.client.get('/stats').get_json()
+        self.assertGreater(payload["pool"]["checkouts"], 0, f"Pool stats do not count checkouts")
+        self.assertEqual(payload["pool"]["idle"], payload["pool"]["open"],
+                         f"Connections were not returned to the pool after requests")
+        self.assertIn("hits", payload["response_cache"], f"Stats do not report response cache hits")
+        self.assertIn("SELECT git_user", payload["queries"]["statements"], f"Stats do not report statement timings")
+        self.assertIn("hit_rate", payload["prefetch"], f"Stats do not report the prefetch hit rate")
+
+        # Only searches are prefetched
+        api.response_cache.clear()
+        misses = api.page_prefetcher.stats()["misses"]
+        self.client.get('/user', query_string=TestApi.user_query(10, 10))
+        self.assertEqual(api.page_prefetcher.stats()["misses"], misses, f"A page without a search was prefetched")
+        query = TestApi.user_query(0, 5)
+        query["search[value]"] = "user"
+        self.client.get('/user', query_string=query)
+        self.assertEqual(api.page_prefetcher.stats()["misses"], misses + 1, f"A search page was not prefetched")
+
+    def test_metrics(self):
+
+        self.client.get('/user', query_string=TestApi.user_query(0, 10))
+        response = self.client.get('/metrics')
+        text = response.get_data(as_text=True)
+        self.assertTrue(response.mimetype.startswith("text/plain"), f"Metrics returned as {response.mimetype}")
+        self.assertIn('user_api_requests_total{endpoint="/user",method="GET",status="200"}', text,
+                      f"Metrics do not count /user requests")
+        self.assertIn('user_api_db_statement_seconds_count{operation="SELECT",table="git_user"}', text,
+                      f"Metrics do not time user reads")
+        self.assertIn('user_api_pool_connections{state="open"}', text, f"Metrics do not report the pool")
+        self.assertIn('user_api_response_cache_events_total{event="hits"}', text,
+                      f"Metrics do not report the response cache")
+
+    def test_asgi(self):
+
+        # The ASGI app answers /user with the same payload and entity tag as the Flask route
+        query = TestApi.user_query(10, 10, 1, "desc")
+        expected = self.client.get('/user', query_string=query)
+        status, headers, body = TestApi.asgi_get("/user", query)
+        self.assertEqual(status, 200, f"ASGI /user returned status {status}")
+        self.assertEqual(json.loads(body), expected.get_json(), f"ASGI /user payload differs from the Flask route")
+        self.assertEqual(headers["etag"], expected.headers["ETag"], f"ASGI /user ETag differs from the Flask route")
+        self.assertEqual(headers["content-type"], "application/json", f"ASGI /user is not JSON")
+
+        status, _, body = TestApi.asgi_get("/user", query, [("If-None-Match", headers["etag"])])
+        self.assertEqual((status, body), (304, b""), f"ASGI /user did not answer a conditional request with 304")
+
+        # Other routes are passed through to the Flask app
+        status, headers, body = TestApi.asgi_get("/user/export", {"format": "csv", "columns": "id"})
+        self.assertEqual(status, 200, f"ASGI export returned status {status}")
+        self.assertEqual(body.decode().split("\n")[:3], ["id", "1", "2"], f"ASGI export did not stream the users")
+
+        # Passed through routes do not wait for threads busy with database work
+        released = threading.Event()
+        blockers = [asgi_api.executor.submit(released.wait, 5) for _ in range(asgi_api.executor._max_workers)]
+        try:
+            started = time.perf_counter()
+            status, _, _ = TestApi.asgi_get("/user/export", {"format": "csv", "columns": "id"})
+            elapsed = time.perf_counter() - started
+        finally:
+            released.set()
+            for blocker in blockers:
+                blocker.result()
+        self.assertEqual(status, 200, f"ASGI export returned status {status} with the database executor busy")
+        self.assertLess(elapsed, 4, f"ASGI export waited {elapsed:.1f}s for the database executor")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+from os.path import exists
+import shutil
+import threading
+import unittest
+from urllib.parse import parse_qs, urlparse
+
+from avatar_cache import AvatarCache, AvatarError
+
+
+class StandInAvatars(BaseHTTPRequestHandler):
+    """
+    A stand-in image host serving a PNG of the requested size for each avatar, and a 404 for avatar 0.
+    """
+
+    requests = []
+
+    def do_GET(self):
+        StandInAvatars.requests.append(self.path)
+        parts = urlparse(self.path)
+        if parts.path.endswith("/0"):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        size = int(parse_qs(parts.query).get("s", ["460"])[0])
+        body = b"\x89PNG\r\n\x1a\n" + parts.path.encode() + bytes(size * 10)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAvatarCache(unittest.TestCase):
+
+    directory = "avatar_cache_test"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInAvatars)
+        cls.host = f"127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_avatar_cache(self):
+
+        # Make sure we're not overwriting a cache
+        if exists(TestAvatarCache.directory):
+            raise unittest.SkipTest(f"Cache test directory '{TestAvatarCache.directory}' already exists. Aborting.")
+
+        host = TestAvatarCache.host
+        cache = AvatarCache(TestAvatarCache.directory, max_bytes=1100, size=50, allowed_hosts=[host])
+        StandInAvatars.requests = []
+
+        # Avatars are fetched once at the thumbnail size, then served from disk
+        data, content_type, etag = cache.get(f"http://{host}/u/1?v=4")
+        self.assertEqual(content_type, "image/png", f"Avatar content type is {content_type}")
+        self.assertEqual(len(data), 8 + len("/u/1") + 500, f"Avatar was not fetched at the thumbnail size")
+        self.assertEqual(StandInAvatars.requests, ["/u/1?v=4&s=50"], f"Avatar requests {StandInAvatars.requests}")
+        self.assertEqual(cache.get(f"http://{host}/u/1?v=4"), (data, content_type, etag), f"Cached avatar differs")
+        self.assertEqual(len(StandInAvatars.requests), 1, f"Cached avatar was fetched again")
+
+        # The least recently served thumbnails are evicted once the cache is full
+        cache.get(f"http://{host}/u/2?v=4")
+        cache.get(f"http://{host}/u/1?v=4")
+        cache.get(f"http://{host}/u/3?v=4")
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (2, 1), f"Cache stats {stats} after eviction")
+        self.assertEqual(len(os.listdir(TestAvatarCache.directory)), 2, f"Evicted thumbnail left on disk")
+        cache.get(f"http://{host}/u/1?v=4")
+        self.assertEqual(len(StandInAvatars.requests), 3, f"Recently served avatar was evicted")
+
+        # Thumbnails on disk are picked up by a new cache
+        cache = AvatarCache(TestAvatarCache.directory, max_bytes=1100, size=50, allowed_hosts=[host])
+        cache.get(f"http://{host}/u/3?v=4")
+        self.assertEqual(len(StandInAvatars.requests), 3, f"Thumbnail on disk was fetched again")
+
+        # A thumbnail removed behind the cache's back is fetched again, keeping the byte count true
+        def stored_bytes():
+            return sum(os.path.getsize(os.path.join(TestAvatarCache.directory, name))
+                       for name in os.listdir(TestAvatarCache.directory))
+
+        def read(path):
+            with open(path, "rb") as file:
+                return file.read()
+
+        url = f"http://{host}/u/3?v=4"
+        thumbnail = next(path for path in (os.path.join(TestAvatarCache.directory, name)
+                                           for name in os.listdir(TestAvatarCache.directory)) if b"/u/3" in read(path))
+        os.remove(thumbnail)
+        data = cache.get(url)[0]
+        self.assertEqual(len(StandInAvatars.requests), 4, f"Removed thumbnail was not fetched again")
+        self.assertEqual(cache.stats()["bytes"], stored_bytes(), f"Cache counts {cache.stats()['bytes']} bytes")
+
+        # A thumbnail that can never be read is served straight from its host
+        os.remove(thumbnail)
+        os.mkdir(thumbnail)
+        self.assertEqual(cache.get(url)[0], data, f"Unreadable thumbnail was not served")
+        os.rmdir(thumbnail)
+        self.assertEqual(cache.stats()["bytes"], stored_bytes(), f"Cache counts {cache.stats()['bytes']} bytes")
+
+        # Only allowed hosts are fetched, and host failures are reported
+        with self.assertRaises(AvatarError) as context:
+            cache.get("http://169.254.169.254/latest/meta-data")
+        self.assertEqual(context.exception.status, 403, f"Disallowed host answered {context.exception.status}")
+        with self.assertRaises(AvatarError) as context:
+            cache.get(f"http://{host}/u/0")
+        self.assertEqual(context.exception.status, 404, f"Missing avatar answered {context.exception.status}")
+
+        # Clean up
+        shutil.rmtree(TestAvatarCache.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,10 @@
 import logging
 from os.path import exists
+import sqlite3
+import threading
 import unittest
 
-from db import Db
+from db import ConnectionPool, Db, WriteQueue
 from generic_dao import GenericDao
 
 
@@ -77,6 +79,287 @@ class TestDb(unittest.TestCase):
         self.assertFalse(exists(f"{TestDb.db_name}.db"),
                          f"Database file '{TestDb.db_name}.db' exists after destruction")
 
+    # Test trigger-maintained row counts
+    def test_row_counter(self):
+
+        db_name = f"{TestDb.db_name}_count"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        # A table created without a counter is counted once the counter is added
+        db = Db(db_name)
+        dao = TestDb.TestDao()
+        db.cursor.execute(f"CREATE TABLE {dao.table_name} (id integer primary key, data text)")
+        db.cursor.executemany(f"INSERT INTO {dao.table_name} VALUES (?, ?)", [(1, "a"), (2, "b")])
+        db.commit()
+        self.assertIsNone(db.get_row_count(dao), f"Row count exists before the counter was created")
+
+        db.create_table_stats(dao)
+        self.assertEqual(db.get_row_count(dao), 2, f"Row counter did not start from the existing rows")
+
+        # Writes on another connection are counted once committed
+        other = Db(db_name)
+        dao.create(other, {"id": 3, "data": "c"})
+        other.cursor.execute(f"DELETE FROM {dao.table_name} WHERE id = 1")
+        self.assertEqual(db.get_row_count(dao), 2, f"Uncommitted writes changed the row count")
+        other.commit()
+        self.assertEqual(db.get_row_count(dao), 2, f"Row count does not match after an insert and a delete")
+
+        other.cursor.execute(f"INSERT INTO {dao.table_name} VALUES (4, 'd')")
+        other.commit()
+        self.assertEqual(dao.get_count(db), 3, f"Row count does not match after a committed insert")
+        other.close()
+
+        # Deleting the table removes its count
+        db.delete_table(dao)
+        self.assertIsNone(db.get_row_count(dao), f"Row count exists after the table was deleted")
+
+        db.destroy()
+
+    # Test the performance profile and read-only connections
+    def test_performance_profile(self):
+
+        db_name = f"{TestDb.db_name}_wal"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        writer = Db(db_name, profile="performance")
+        self.assertEqual(writer.cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal",
+                         f"Performance profile did not switch to WAL")
+        self.assertEqual(writer.cursor.execute("PRAGMA synchronous").fetchone()[0], 1,
+                         f"Performance profile did not set synchronous=NORMAL")
+
+        dao = TestDb.TestDao()
+        writer.create_table(dao)
+        dao.create_many(writer, [{"id": i, "data": "committed"} for i in range(100)])
+        writer.commit()
+
+        # Hold a long write transaction open while a read-only connection reads
+        writer.cursor.execute("BEGIN IMMEDIATE")
+        dao.create_many(writer, [{"id": i, "data": "uncommitted"} for i in range(100, 10000)])
+
+        reader = Db(db_name, profile="performance", read_only=True)
+        self.assertEqual(dao.get_count(reader), 100, f"Reader did not see the committed rows during a write")
+        self.assertEqual(dao.read(reader, 99, 10, "id"), [(99, "committed")],
+                         f"Reader saw uncommitted rows during a write")
+        with self.assertRaises(sqlite3.OperationalError):
+            reader.cursor.execute(f"DELETE FROM {dao.table_name}")
+
+        writer.commit()
+        self.assertEqual(dao.get_count(reader), 10000, f"Reader did not see the rows once committed")
+
+        with self.assertRaises(ValueError):
+            Db(db_name, profile="bogus")
+
+        reader.close()
+        writer.destroy()
+        self.assertFalse(exists(f"{db_name}.db-wal"), f"Write-ahead log exists after destruction")
+
+    # Test migrating a table to new versions of its definition
+    def test_migrate_table(self):
+
+        db_name = f"{TestDb.db_name}_migrate"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        class AddedDao(TestDb.TestDao):
+
+            @property
+            def columns(self):
+                return ["id", "data", "extra"]
+
+            @property
+            def column_types(self):
+                return ["integer", "text", "text"]
+
+            @property
+            def sortable_columns(self):
+                return ["extra"]
+
+            @property
+            def schema_version(self):
+                return 2
+
+        class CopiedDao(TestDb.TestDao):
+
+            @property
+            def columns(self):
+                return ["id", "extra"]
+
+            @property
+            def column_types(self):
+                return ["integer", "text"]
+
+            @property
+            def schema_version(self):
+                return 3
+
+        db = Db(db_name)
+        dao = TestDb.TestDao()
+        db.create_table(dao)
+        dao.create_many(db, [{"id": i, "data": f"row {i}"} for i in range(1, 101)])
+        db.commit()
+        self.assertEqual(db.get_schema_version(dao), 1, f"Schema version was not stored with the table")
+        self.assertEqual(db.migrate_table(dao), "current", f"A current table was migrated")
+
+        # An appended column and a new index are added in place
+        added_dao = AddedDao()
+        self.assertEqual(db.migrate_table(added_dao), "altered", f"An appended column was not added in place")
+        self.assertEqual(db.get_schema_version(added_dao), 2, f"Schema version was not updated in place")
+        self.assertEqual(added_dao.read_by_key(db, 7), (7, "row 7", None), f"Existing rows changed in place")
+        indexes = [row[0] for row in db.cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+        self.assertIn("test_table_extra_sort", indexes, f"New sort index was not created in place")
+        added_dao.create(db, {"id": 101, "data": "row 101", "extra": "new"})
+        db.commit()
+
+        # Dropping a column copies the table, keeping writes made by another connection during the copy
+        other = Db(db_name)
+
+        def write(copied):
+            if copied == 10:
+                added_dao.create(other, {"id": 200, "data": "row 200", "extra": "during"})
+                other.cursor.execute(f"UPDATE {dao.table_name} SET extra = 'updated' WHERE id = 5")
+                other.cursor.execute(f"UPDATE {dao.table_name} SET extra = 'updated later' WHERE id = 50")
+                other.cursor.execute(f"DELETE FROM {dao.table_name} WHERE id IN (3, 60)")
+                other.commit()
+
+        copied_dao = CopiedDao()
+        self.assertEqual(db.migrate_table(copied_dao, batch_size=10, progress=write), "copied",
+                         f"A dropped column did not copy the table")
+        other.close()
+        self.assertEqual(db.get_schema_version(copied_dao), 3, f"Schema version was not updated by the copy")
+        self.assertEqual([row[1] for row in db.cursor.execute(f"PRAGMA table_info({dao.table_name})")],
+                         ["id", "extra"], f"Copied table does not have the new columns")
+        self.assertEqual(copied_dao.get_count(db), 100, f"Copied table does not hold every row")
+        self.assertEqual(copied_dao.read_by_key(db, 101), (101, "new"), f"Copied row lost its values")
+        self.assertEqual(copied_dao.read_by_key(db, 200), (200, "during"), f"Insert during the copy was lost")
+        self.assertEqual(copied_dao.read_by_key(db, 5), (5, "updated"), f"Update of a copied row was lost")
+        self.assertEqual(copied_dao.read_by_key(db, 50), (50, "updated later"), f"Update before its copy was lost")
+        self.assertIsNone(copied_dao.read_by_key(db, 3), f"Delete of a copied row was lost")
+        self.assertIsNone(copied_dao.read_by_key(db, 60), f"Delete before its copy was lost")
+        self.assertFalse(db.does_table_exist(copied_dao.get_shadow()), f"Shadow table exists after the copy")
+        triggers = [row[0] for row in db.cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger'")]
+        self.assertFalse([name for name in triggers if "_migrate_" in name], f"Copy triggers exist after the copy")
+
+        # A table newer than the definition is left alone
+        with self.assertRaises(ValueError):
+            db.migrate_table(dao)
+
+        db.destroy()
+
+    # Test queued, group-committed writes
+    def test_write_queue(self):
+
+        db_name = f"{TestDb.db_name}_queue"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name, profile="performance")
+        dao = TestDb.TestDao()
+        db.create_table(dao)
+        write_queue = WriteQueue(db_name, profile="performance", max_batch=50, max_delay=0.5)
+
+        # Writes queued together share commits of up to max_batch records
+        futures = [write_queue.create(dao, {"id": i, "data": "single"}) for i in range(20)]
+        futures.append(write_queue.create_many(dao, [{"id": i, "data": "many"} for i in range(20, 100)]))
+        write_queue.flush()
+        self.assertTrue(all(future.done() for future in futures), f"Flush returned before the queued writes")
+        self.assertEqual(futures[-1].result(), 80, f"Queued create_many did not return its count")
+        self.assertEqual(dao.get_count(db), 100, f"Queued writes were not committed")
+        stats = write_queue.stats()
+        self.assertEqual((stats["writes"], stats["records"]), (21, 100), f"Queue stats {stats} are wrong")
+        self.assertLessEqual(stats["commits"], 2, f"Queued writes took {stats['commits']} commits")
+
+        # A failed write is rolled back alone
+        futures = [write_queue.create(dao, {"id": 100, "data": "new"}), write_queue.create(dao, {"id": 1}),
+                   write_queue.create(dao, {"id": 101, "data": "new"})]
+        write_queue.flush()
+        with self.assertRaises(sqlite3.IntegrityError):
+            futures[1].result()
+        self.assertEqual(dao.get_count(db), 102, f"A failed write undid the writes committed with it")
+        self.assertEqual(write_queue.stats()["failures"], 1, f"Queue did not count the failed write")
+
+        # Writes wait at most max_delay for a group, and are committed on close
+        future = write_queue.submit(lambda writer: dao.create(writer, {"id": 102, "data": "late"}))
+        future.result(2)
+        self.assertEqual(dao.get_count(db), 103, f"A lone write waited for a full group")
+        write_queue.create(dao, {"id": 103, "data": "closing"})
+        write_queue.close()
+        self.assertEqual(dao.get_count(db), 104, f"Closing the queue did not commit the queued write")
+        with self.assertRaises(RuntimeError):
+            write_queue.create(dao, {"id": 104, "data": "closed"})
+
+        db.destroy()
+
+    # Test pooled connections
+    def test_connection_pool(self):
+
+        db_name = f"{TestDb.db_name}_pool"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        pool = ConnectionPool(db_name, size=2, timeout=0.1)
+
+        # Nested Db objects on one thread share a connection
+        outer = Db(pool=pool)
+        inner = Db(pool=pool)
+        self.assertIs(outer.connection, inner.connection,
+                      f"Nested Db objects on one thread were given different connections")
+        inner.close()
+
+        # Other threads get their own connections until the pool is exhausted
+        connections = []
+        errors = []
+        release = threading.Event()
+
+        def borrow():
+            try:
+                db = Db(pool=pool)
+            except TimeoutError as e:
+                errors.append(e)
+                return
+            connections.append(db.connection)
+            release.wait()
+            db.close()
+
+        threads = [threading.Thread(target=borrow) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(0.5)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(connections), 1, f"Pool of 2 lent {len(connections)} extra connections")
+        self.assertNotIn(outer.connection, connections, f"Pool lent a connection held by another thread")
+        self.assertEqual(len(errors), 1, f"Exhausted pool did not time out")
+
+        # Returned connections are reused
+        outer.close()
+        db = Db(pool=pool)
+        self.assertTrue(db.connection in connections or db.connection is outer.connection,
+                        f"Pool opened a new connection while idle ones were available")
+
+        stats = pool.stats()
+        self.assertEqual(stats["open"], 2, f"Pool reports {stats['open']} open connections rather than 2")
+        self.assertEqual(stats["checkouts"], 3, f"Pool reports {stats['checkouts']} checkouts rather than 3")
+        self.assertEqual(stats["timeouts"], 1, f"Pool reports {stats['timeouts']} timeouts rather than 1")
+
+        # Closing the pool refuses further checkouts
+        db.close()
+        pool.close()
+        self.assertEqual(pool.stats()["open"], 0, f"Connections remain open after the pool is closed")
+        with self.assertRaises(RuntimeError):
+            Db(pool=pool)
+
+        Db(db_name).destroy()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,11 @@
 import logging
 from os.path import exists
+import sqlite3
 import unittest
 
-from db import Db
+from db import Db, ShardedDb
 from generic_dao import GenericDao
+from page_prefetcher import PagePrefetcher
 
 
 class TestGenericDao(unittest.TestCase):
@@ -161,6 +163,331 @@ class TestGenericDao(unittest.TestCase):
         db.delete_table(dao)
         db.destroy()
 
+    def test_create_many(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_many"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = TestGenericDao.TestDao()
+        db.create_table(dao)
+
+        # Insert from a generator, skipping anything that is not a dict
+        values = (value for value in TestGenericDao.test_data + ["not a dict", {"id": 3}])
+        self.assertEqual(dao.create_many(db, values), 3, f"create_many did not report 3 inserted records")
+        self.assertEqual(dao.read(db, 0, 3, "id"), [(1, TestGenericDao.test_data[0]["data"]),
+                                                    (2, TestGenericDao.test_data[1]["data"]), (3, None)],
+                         f"create_many did not insert the passed records")
+
+        # Duplicate keys raise by default
+        with self.assertRaises(sqlite3.IntegrityError):
+            dao.create_many(db, [{"id": 1, "data": "duplicate"}])
+
+        # Ignore keeps existing records
+        count = dao.create_many(db, [{"id": 1, "data": "ignored"}, {"id": 4, "data": "new"}], on_conflict="ignore")
+        self.assertEqual(count, 1, f"create_many ignoring conflicts reported {count} records rather than 1")
+        self.assertEqual(dao.read(db, 0, 1, "id"), [(1, TestGenericDao.test_data[0]["data"])],
+                         f"create_many ignoring conflicts changed an existing record")
+
+        # Update overwrites existing records
+        count = dao.create_many(db, [{"id": 1, "data": "updated"}, {"id": 5, "data": "new"}], on_conflict="update")
+        self.assertEqual(count, 2, f"create_many updating conflicts reported {count} records rather than 2")
+        self.assertEqual(dao.read(db, 0, 1, "id"), [(1, "updated")],
+                         f"create_many updating conflicts did not change an existing record")
+        self.assertEqual(dao.get_count(db), 5, f"Incorrect number of records after create_many")
+
+        with self.assertRaises(ValueError):
+            dao.create_many(db, [], on_conflict="replace")
+
+        # Iterate over every record in batches
+        result = list(dao.iterate(db, ["id"], batch_size=2))
+        self.assertEqual(result, [(1,), (2,), (3,), (4,), (5,)], f"Iterate returned {result}")
+        with self.assertRaises(ValueError):
+            dao.iterate(db, ["bogus"])
+
+        # Clean up
+        db.delete_table(dao)
+        db.destroy()
+
+    def test_multi_column_sort(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_sort"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = TestGenericDao.TestDao()
+        db.create_table(dao)
+        dao.create_many(db, [{"id": i, "data": "b" if i % 2 else "A"} for i in range(1, 7)])
+
+        # The primary key breaks ties in the direction of the last sort column
+        self.assertEqual(dao.get_order_terms([("data", "desc")]), [("data", True), ("id", True)],
+                         f"Primary key was not appended as a tiebreaker")
+        self.assertEqual(dao.get_order_terms([("DATA", "asc"), ("bogus", "asc"), ("data", "desc"), ("id", "desc")]),
+                         [("data", False), ("id", True)],
+                         f"Sort terms were not verified and deduplicated")
+        self.assertEqual(dao.get_order_terms([("bogus", True)]), [("id", False)],
+                         f"Invalid sort terms did not fall back to the default sort")
+
+        # Mixed directions sort and seek correctly
+        sort_by = [("data", "asc"), ("id", "desc")]
+        expected = [(6, "A"), (4, "A"), (2, "A"), (5, "b"), (3, "b"), (1, "b")]
+        result = dao.read(db, 0, 6, sort_by)
+        self.assertEqual(result, expected, f"Mixed direction sort returned {result}")
+
+        for position in range(5):
+            token = dao.encode_cursor(expected[position], position, sort_by)
+            cursor = dao.decode_cursor(token, position + 1, 1, sort_by)
+            result = dao.read(db, position + 1, 1, sort_by, cursor=cursor)
+            self.assertEqual(result, [expected[position + 1]], f"Mixed direction seek from {position} gave {result}")
+
+            token = dao.encode_cursor(expected[position + 1], position + 1, sort_by, backward=True)
+            cursor = dao.decode_cursor(token, position, 1, sort_by)
+            result = dao.read(db, position, 1, sort_by, cursor=cursor)
+            self.assertEqual(result, [expected[position]], f"Mixed direction seek back from {position} gave {result}")
+
+        # Clean up
+        db.destroy()
+
+    def test_cursor_read(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_cursor"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        # Create the database and a table with duplicate sort values
+        db = Db(db_name)
+        dao = TestGenericDao.TestDao()
+        db.create_table(dao)
+        for i in range(1, 11):
+            dao.create(db, {"id": i, "data": "even" if i % 2 == 0 else "Odd"})
+
+        for sort_by, desc_flag in [("id", False), ("id", True), ("data", False), ("data", True)]:
+            expected = dao.read(db, 0, 10, sort_by, desc_flag)
+
+            # Page forward through the table by cursor
+            result = dao.read(db, 0, 3, sort_by, desc_flag)
+            while len(result) < 10:
+                token = dao.encode_cursor(result[-1], len(result) - 1, sort_by, desc_flag)
+                cursor = dao.decode_cursor(token, len(result), 3, sort_by, desc_flag)
+                self.assertIsNotNone(cursor, f"Forward cursor rejected for sort {sort_by} {desc_flag}")
+                result += dao.read(db, len(result), 3, sort_by, desc_flag, cursor)
+
+            self.assertEqual(result, expected,
+                             f"Forward cursor results {result} do not match offset results {expected}")
+
+            # Page backward through the table by cursor
+            result = dao.read(db, 6, 3, sort_by, desc_flag)
+            for position in [3, 0]:
+                token = dao.encode_cursor(result[0], position + 3, sort_by, desc_flag, backward=True)
+                cursor = dao.decode_cursor(token, position, 3, sort_by, desc_flag)
+                self.assertIsNotNone(cursor, f"Backward cursor rejected for sort {sort_by} {desc_flag}")
+                result = dao.read(db, position, 3, sort_by, desc_flag, cursor) + result
+
+            self.assertEqual(result, expected[:9],
+                             f"Backward cursor results {result} do not match offset results {expected[:9]}")
+
+        # A cursor must not be used for a different ordering or page
+        token = dao.encode_cursor(expected[2], 2, "id", False)
+        self.assertIsNone(dao.decode_cursor(token, 3, 3, "data", False),
+                          f"Cursor accepted for a different sort column")
+        self.assertIsNone(dao.decode_cursor(token, 6, 3, "id", False),
+                          f"Cursor accepted for a different page")
+        self.assertIsNone(dao.decode_cursor("not a cursor", 3, 3, "id", False),
+                          f"Invalid cursor accepted")
+        token = dao.encode_cursor((3, {"data": "Odd"}), 2, "data", False)
+        self.assertIsNone(dao.decode_cursor(token, 3, 3, "data", False),
+                          f"Cursor accepted with a key value that is not NULL, a number or text")
+
+        # Clean up
+        db.delete_table(dao)
+        db.destroy()
+
+    def test_null_seek(self):
+
+        class NullDao(GenericDao):
+
+            @property
+            def table_name(self):
+                return "null_table"
+
+            @property
+            def columns(self):
+                return ["id", "kind", "data"]
+
+            @property
+            def column_types(self):
+                return ["integer", "text", "text"]
+
+            @property
+            def primary_key_index(self):
+                return 0
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_null"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        # Create the database and a table with NULLs in both sort columns
+        db = Db(db_name)
+        dao = NullDao()
+        db.create_table(dao)
+        dao.create_many(db, [{"id": i, "kind": None if i % 4 == 0 else ["a", "B"][i % 2],
+                              "data": None if i % 3 == 0 else f"d{i % 5}"} for i in range(1, 13)])
+
+        # Seeking a page at a time forward and backward must match reading by offset, with NULLs sorted lowest
+        for sort_by in [[("data", "asc")], [("data", "desc")], [("kind", "asc"), ("data", "desc")],
+                        [("kind", "desc"), ("data", "desc")], [("kind", "desc"), ("data", "asc"), ("id", "desc")]]:
+            expected = dao.read(db, 0, 12, sort_by)
+            self.assertEqual(len(expected), 12, f"Offset read of {sort_by} returned {expected}")
+            for position in range(11):
+                token = dao.encode_cursor(expected[position], position, sort_by)
+                cursor = dao.decode_cursor(token, position + 1, 2, sort_by)
+                result = dao.read(db, position + 1, 2, sort_by, cursor=cursor)
+                self.assertEqual(result, expected[position + 1:position + 3],
+                                 f"Seek by {sort_by} from {expected[position]} gave {result}")
+
+                token = dao.encode_cursor(expected[position + 1], position + 1, sort_by, backward=True)
+                cursor = dao.decode_cursor(token, position, 1, sort_by)
+                result = dao.read(db, position, 1, sort_by, cursor=cursor)
+                self.assertEqual(result, [expected[position]],
+                                 f"Seek back by {sort_by} from {expected[position + 1]} gave {result}")
+
+        # Clean up
+        db.destroy()
+
+    def test_prefetch(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_prefetch"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = TestGenericDao.TestDao()
+        db.create_table(dao)
+        dao.create_many(db, [{"id": i, "data": "even" if i % 2 == 0 else "Odd"} for i in range(1, 21)])
+        db.commit()
+
+        prefetcher = PagePrefetcher(pages=2)
+        for sort_by, desc_flag in [("id", False), ("data", True)]:
+            expected = dao.read(db, 0, 20, sort_by, desc_flag)
+
+            # Paging forward by cursor is served from the windows read around earlier pages
+            result = dao.read(db, 0, 3, sort_by, desc_flag, prefetcher=prefetcher)
+            while len(result) < 20:
+                token = dao.encode_cursor(result[-1], len(result) - 1, sort_by, desc_flag)
+                cursor = dao.decode_cursor(token, len(result), 3, sort_by, desc_flag)
+                result += dao.read(db, len(result), 3, sort_by, desc_flag, cursor, prefetcher=prefetcher)
+            self.assertEqual(result, expected, f"Prefetched pages {result} do not match offset results {expected}")
+
+            # And so is paging backward
+            result = dao.read(db, 15, 3, sort_by, desc_flag, prefetcher=prefetcher)
+            for position in [12, 9, 6, 3, 0]:
+                token = dao.encode_cursor(result[0], position + 3, sort_by, desc_flag, backward=True)
+                cursor = dao.decode_cursor(token, position, 3, sort_by, desc_flag)
+                result = dao.read(db, position, 3, sort_by, desc_flag, cursor, prefetcher=prefetcher) + result
+            self.assertEqual(result, expected[:18], f"Prefetched backward pages do not match offset results")
+
+        stats = prefetcher.stats()
+        self.assertGreater(stats["hits"], stats["misses"], f"Sequential paging missed the prefetched pages: {stats}")
+
+        # A write replaces the windows read before it
+        db.cursor.execute(f"UPDATE {dao.table_name} SET data = 'changed' WHERE id = 2")
+        db.commit()
+        self.assertEqual(dao.read(db, 0, 3, "id", prefetcher=prefetcher), [(1, "Odd"), (2, "changed"), (3, "Odd")],
+                         f"Prefetched page was served after the table changed")
+
+        # Clean up
+        db.destroy()
+
+    def test_sharded_db(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestGenericDao.db_name}_sharded"
+        if any(exists(f'{name}.db') for name in [db_name] + [f"{db_name}_{i}" for i in range(3)]):
+            logging.fatal(f"Database test files '{db_name}*.db' already exist. Aborting.")
+            return
+
+        # Compare every sharding against the same records in one file
+        dao = TestGenericDao.TestDao()
+        records = [{"id": i, "data": ["even", "Odd", "third"][i % 3]} for i in range(1, 21)]
+        db = Db(db_name)
+        db.create_table(dao)
+        dao.create_many(db, records)
+
+        for sharding in [{"shard_count": 3}, {"boundaries": [8, 15]}]:
+            sharded_db = ShardedDb(db_name, **sharding)
+            sharded_db.create_table(dao)
+            dao.create_many(sharded_db, records[1:])
+            dao.create(sharded_db, records[0])
+            sharded_db.commit()
+
+            self.assertTrue(sharded_db.does_table_exist(dao), f"Sharded table was not created on every shard")
+            self.assertTrue(all(dao.get_count(shard) < 20 for shard in sharded_db.shards),
+                            f"Records were not spread across the shards")
+            self.assertEqual(dao.get_count(sharded_db), 20, f"Sharded count is {dao.get_count(sharded_db)}")
+            self.assertEqual(dao.read_by_key(sharded_db, 7), (7, "Odd"), f"Sharded read by key is wrong")
+
+            for sort_by, desc_flag in [("id", False), ("id", True), ("data", False), ("data", True),
+                                       ([("data", "asc"), ("id", "desc")], False)]:
+                for offset in [0, 5, 17]:
+                    expected = dao.read(db, offset, 4, sort_by, desc_flag)
+                    result = dao.read(sharded_db, offset, 4, sort_by, desc_flag)
+                    self.assertEqual(result, expected, f"Sharded page at {offset} by {sort_by} {desc_flag} is {result}")
+
+                # Seek forward and back from the middle of the table
+                expected = dao.read(db, 0, 20, sort_by, desc_flag)
+                token = dao.encode_cursor(expected[9], 9, sort_by, desc_flag)
+                cursor = dao.decode_cursor(token, 10, 4, sort_by, desc_flag)
+                self.assertEqual(dao.read(sharded_db, 10, 4, sort_by, desc_flag, cursor), expected[10:14],
+                                 f"Sharded forward seek by {sort_by} {desc_flag} is wrong")
+                token = dao.encode_cursor(expected[9], 9, sort_by, desc_flag, backward=True)
+                cursor = dao.decode_cursor(token, 5, 4, sort_by, desc_flag)
+                self.assertEqual(dao.read(sharded_db, 5, 4, sort_by, desc_flag, cursor), expected[5:9],
+                                 f"Sharded backward seek by {sort_by} {desc_flag} is wrong")
+
+            dao.clear_table(sharded_db)
+            self.assertEqual(dao.get_count(sharded_db), 0, f"Sharded table was not cleared")
+            sharded_db.destroy()
+
+        # Clean up
+        db.destroy()
+
+    def test_schema(self):
+
+        dao = TestGenericDao.TestDao()
+
+        # The schema is built once per class and cannot be changed
+        self.assertIs(dao.schema, TestGenericDao.TestDao().schema, f"Schema was rebuilt for a second instance")
+        self.assertEqual(dao.schema.column_index["data"], 1, f"Schema column index is wrong")
+        self.assertEqual(dao.schema.sort_expressions["data"], "LOWER(data)", f"Schema sort expression is wrong")
+        with self.assertRaises(AttributeError):
+            dao.schema.table_name = "other_table"
+        with self.assertRaises(TypeError):
+            dao.schema.column_index["other"] = 2
+
+        # Generated SQL is reused while parameters follow each call
+        cursor = {"key": ["dozy", 1], "backward": False}
+        sql_string, params = dao.build_read_sql([("data", "desc")], cursor=cursor)
+        cursor = {"key": ["score", 2], "backward": False}
+        self.assertIs(dao.build_read_sql([("data", "desc")], cursor=cursor)[0], sql_string,
+                      f"Read SQL was rebuilt for the same ordering and seek")
+        self.assertEqual(dao.build_read_sql([("data", "desc")], cursor=cursor)[1], ["score", "score", 2],
+                         f"Seek parameters were not taken from the call")
+        self.assertEqual(dao.get_order_terms("DATA", True), [("data", True), ("id", True)],
+                         f"Order terms {dao.get_order_terms('DATA', True)} are wrong")
+        with self.assertRaises(ValueError):
+            dao.create_many(None, [], on_conflict="replace")
 
 if __name__ == '__main__':
     unittest.main()
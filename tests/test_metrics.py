@@ -0,0 +1,73 @@
+import logging
+from os.path import exists
+import unittest
+
+from db import Db
+from metrics import Metrics
+from user_dao import UserDao
+
+
+class TestMetrics(unittest.TestCase):
+
+    db_name = "metrics_test"
+
+    def test_metrics(self):
+
+        metrics = Metrics("test", slow_seconds=0.05)
+
+        # Statements are grouped by operation and table, and only slow ones are kept
+        metrics.observe_query(None, "SELECT id FROM git_user WHERE id > ?", [1], 0.002, 25)
+        metrics.observe_query(None, "INSERT INTO git_user VALUES (?)", (), 0.5, 100)
+        stats = metrics.stats()
+        self.assertEqual(stats["statements"]["SELECT git_user"]["rows"], 25, f"Statement stats {stats} are wrong")
+        self.assertEqual(stats["slow_statements"], 1, f"Slow statement count {stats['slow_statements']} is not 1")
+        self.assertEqual(metrics.slow_queries()[0]["sql"], "INSERT INTO git_user VALUES (?)",
+                         f"Slow statement log does not hold the slow statement")
+
+        # Histograms are cumulative in the Prometheus text format
+        metrics.observe_request("/user", "GET", 200, 0.003)
+        text = metrics.render()
+        self.assertIn('test_db_statement_seconds_bucket{operation="SELECT",table="git_user",le="0.0025"} 1', text,
+                      f"Statement histogram is missing from {text}")
+        self.assertIn('test_db_statement_seconds_bucket{operation="INSERT",table="git_user",le="+Inf"} 1', text,
+                      f"Statement histogram is missing from {text}")
+        self.assertIn('test_requests_total{endpoint="/user",method="GET",status="200"} 1', text,
+                      f"Request counter is missing from {text}")
+
+    def test_instrumented_cursor(self):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestMetrics.db_name}.db'):
+            logging.fatal(f"Database test file '{TestMetrics.db_name}.db' already exists. Aborting.")
+            return
+
+        metrics = Metrics("test", slow_seconds=0.0)
+        db = Db(TestMetrics.db_name, metrics=metrics)
+        user_dao = UserDao()
+        db.create_table(user_dao)
+        user_dao.create_many(db, [{"login": f"user{i}", "id": i, "node_id": f"node{i}", "avatar_url": "",
+                                   "html_url": "", "type": "User", "site_admin": False} for i in range(1, 51)])
+        db.commit()
+
+        # Rows are still handed out by the cursor after being counted
+        rows = user_dao.read(db, 10, 25, "login")
+        self.assertEqual(len(rows), 25, f"Instrumented read returned {len(rows)} rows rather than 25")
+        self.assertEqual(user_dao.get_count(db), 50, f"Instrumented count is not 50")
+        self.assertEqual([row[0] for row in db.cursor.execute("SELECT id FROM git_user WHERE id <= 3")], [1, 2, 3],
+                         f"Instrumented cursor did not iterate over its rows")
+
+        statements = metrics.stats()["statements"]
+        self.assertEqual(statements["INSERT git_user"]["rows"], 50, f"Insert stats {statements} are wrong")
+        self.assertGreaterEqual(statements["SELECT git_user"]["rows"], 25, f"Select stats {statements} are wrong")
+
+        # Every statement is slow at a zero threshold, and reads are logged with their query plan
+        read = [query for query in metrics.slow_queries() if query["sql"].startswith("SELECT login")][0]
+        self.assertTrue(any("git_user_login_sort" in step for step in read["plan"]),
+                        f"Slow read plan {read['plan']} does not use the login index")
+
+        # Clean up
+        db.destroy()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from page_prefetcher import PagePrefetcher
+
+
+class TestPagePrefetcher(unittest.TestCase):
+
+    table = list(range(100))
+
+    def read_window(self, offset, limit, cursor):
+        self.reads.append((offset, limit, cursor))
+        if cursor is None:
+            return TestPagePrefetcher.table[offset:offset + limit]
+        if cursor["backward"]:
+            return TestPagePrefetcher.table[max(cursor["key"] - limit, 0):cursor["key"]]
+        return TestPagePrefetcher.table[cursor["key"] + 1:cursor["key"] + 1 + limit]
+
+    def test_page_prefetcher(self):
+
+        now = [0.0]
+        self.reads = []
+        prefetcher = PagePrefetcher(pages=2, ttl=10.0, max_entries=2, clock=lambda: now[0])
+
+        # A miss reads the pages either side of the requested one, which are then served from memory
+        self.assertEqual(prefetcher.read("a", 1, 30, 10, None, self.read_window), list(range(30, 40)),
+                         f"Prefetcher returned the wrong page")
+        self.assertEqual(self.reads, [(10, 50, None)], f"Prefetcher read {self.reads} rather than a window of 5 pages")
+        for offset in [10, 20, 40, 50]:
+            self.assertEqual(prefetcher.read("a", 1, offset, 10, None, self.read_window),
+                             list(range(offset, offset + 10)), f"Prefetched page at {offset} is wrong")
+        self.assertEqual(len(self.reads), 1, f"Pages in the window were read again")
+        self.assertEqual(prefetcher.read("a", 1, 60, 10, None, self.read_window), list(range(60, 70)),
+                         f"Page after the window is wrong")
+        self.assertEqual(len(self.reads), 2, f"Page after the window was not read")
+
+        # Windows are only served at the data version they were read at and until they expire
+        prefetcher.read("a", 2, 60, 10, None, self.read_window)
+        self.assertEqual(len(self.reads), 3, f"Window from an old data version was served")
+        now[0] = 11.0
+        prefetcher.read("a", 2, 60, 10, None, self.read_window)
+        self.assertEqual(len(self.reads), 4, f"Expired window was served")
+
+        # The window at the end of the table serves short pages
+        self.assertEqual(prefetcher.read("b", 1, 90, 10, None, self.read_window), list(range(90, 100)),
+                         f"Last page is wrong")
+        self.assertEqual(prefetcher.read("b", 1, 95, 10, None, self.read_window), list(range(95, 100)),
+                         f"Short last page is wrong")
+        self.assertEqual(len(self.reads), 5, f"Short last page was read again")
+
+        # A cursor reads onwards in its direction, and its window only serves requests with cursors
+        self.assertEqual(prefetcher.read("c", 1, 20, 10, {"key": 19, "backward": False}, self.read_window),
+                         list(range(20, 30)), f"Forward cursor page is wrong")
+        self.assertEqual(self.reads[-1], (20, 30, {"key": 19, "backward": False}), f"Forward window was not 3 pages")
+        self.assertEqual(prefetcher.read("c", 1, 40, 10, {"key": 39, "backward": False}, self.read_window),
+                         list(range(40, 50)), f"Page in a forward window is wrong")
+        self.assertEqual(len(self.reads), 6, f"Page in a forward window was read again")
+        prefetcher.read("c", 1, 30, 10, None, self.read_window)
+        self.assertEqual(len(self.reads), 7, f"Cursor window served a request without a cursor")
+
+        self.assertEqual(prefetcher.read("d", 1, 50, 10, {"key": 60, "backward": True}, self.read_window),
+                         list(range(50, 60)), f"Backward cursor page is wrong")
+        self.assertEqual(self.reads[-1], (50, 30, {"key": 60, "backward": True}), f"Backward window was not 3 pages")
+        self.assertEqual(prefetcher.read("d", 1, 30, 10, {"key": 40, "backward": True}, self.read_window),
+                         list(range(30, 40)), f"Page in a backward window is wrong")
+        self.assertEqual(len(self.reads), 8, f"Page in a backward window was read again")
+
+        # The least recently used windows are evicted
+        stats = prefetcher.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"], stats["evictions"]), (2, 7, 8, 2),
+                         f"Prefetcher stats {stats} do not match the reads performed")
+        self.assertAlmostEqual(stats["hit_rate"], 7 / 15, msg=f"Hit rate {stats['hit_rate']} is not 7/15")
+
+
+if __name__ == '__main__':
+    unittest.main()
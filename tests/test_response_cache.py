@@ -0,0 +1,59 @@
+import unittest
+
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_response_cache(self):
+
+        now = [0.0]
+        cache = ResponseCache(max_entries=2, ttl=10.0, version_ttl=1.0, clock=lambda: now[0])
+
+        # Misses, hits and version mismatches
+        self.assertIsNone(cache.get("a", 1), f"Empty cache returned a payload")
+        cache.put("a", 1, {"data": "a"})
+        self.assertEqual(cache.get("a", 1), {"data": "a"}, f"Cache did not return a stored payload")
+        self.assertIsNone(cache.get("a", 2), f"Cache returned a payload built from an old data version")
+
+        # Least recently used entries are evicted first
+        cache.put("a", 1, {"data": "a"})
+        cache.put("b", 1, {"data": "b"})
+        cache.get("a", 1)
+        cache.put("c", 1, {"data": "c"})
+        self.assertIsNone(cache.get("b", 1), f"Cache did not evict the least recently used payload")
+        self.assertIsNotNone(cache.get("a", 1), f"Cache evicted a recently used payload")
+
+        # Entries expire after their time to live
+        now[0] = 11.0
+        self.assertIsNone(cache.get("a", 1), f"Cache returned an expired payload")
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (3, 4, 1),
+                         f"Cache stats {stats} do not match the operations performed")
+
+        # The data version is only read again once it is older than version_ttl
+        reads = []
+        self.assertEqual(cache.get_version(lambda: reads.append(1) or 5), 5, f"Cache did not read the data version")
+        self.assertEqual(cache.get_version(lambda: reads.append(1) or 6), 5, f"Cache read a fresh data version again")
+        now[0] = 12.5
+        self.assertEqual(cache.get_version(lambda: reads.append(1) or 6), 6, f"Cache kept a stale data version")
+        self.assertEqual(len(reads), 2, f"Data version was read {len(reads)} times rather than 2")
+
+        # Conditional requests match the entity tag of the key and version
+        etag = ResponseCache.make_etag("a", 6)
+        self.assertTrue(cache.is_not_modified("a", 6, f'"other", {etag}'), f"Matching ETag was not recognized")
+        self.assertFalse(cache.is_not_modified("a", 7, etag), f"ETag from an old data version was accepted")
+        self.assertFalse(cache.is_not_modified("b", 6, etag), f"ETag of another request was accepted")
+
+        # Each content coding has its own tag, and any of them, weak or strong, matches the payload
+        gzip_etag = ResponseCache.make_etag("a", 6, "gzip")
+        self.assertEqual(gzip_etag, f'{etag[:-1]}-gzip"', f"gzip ETag {gzip_etag} does not extend {etag}")
+        self.assertEqual(ResponseCache.make_etag("a", 6, "identity"), etag, f"Identity ETag has a coding suffix")
+        self.assertEqual(cache.is_not_modified("a", 6, f'"other", W/{gzip_etag}'), f"W/{gzip_etag}",
+                         f"Weak gzip ETag was not recognized")
+        self.assertIsNone(cache.is_not_modified("a", 6, f'{etag[:-1]}-deflate"'), f"Unknown coding was accepted")
+
+
+if __name__ == '__main__':
+    unittest.main()
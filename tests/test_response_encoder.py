@@ -0,0 +1,53 @@
+import gzip
+import json
+import unittest
+
+import response_encoder
+from response_encoder import parse_accept_encoding, ResponseEncoder
+
+
+class TestResponseEncoder(unittest.TestCase):
+
+    payload = {"data": [["user01", 1, "node01", None, None, "User", "0"]] * 50, "login": "ünïcode"}
+
+    def test_encoders(self):
+
+        # Every available encoder produces the same document
+        for name in response_encoder.json_encoders:
+            body, headers = ResponseEncoder(name, min_size=None).encode(TestResponseEncoder.payload, "gzip")
+            self.assertEqual(json.loads(body), TestResponseEncoder.payload, f"{name} encoder changed the payload")
+            self.assertEqual(headers, {}, f"{name} encoder sent encoding headers with compression disabled")
+
+        with self.assertRaises(ValueError, msg=f"Unknown encoder accepted"):
+            ResponseEncoder("pickle")
+
+    def test_compression(self):
+
+        encoder = ResponseEncoder("json", min_size=100)
+
+        # Bodies at least min_size long are gzipped for clients that accept it
+        body, headers = encoder.encode(TestResponseEncoder.payload, "deflate, gzip;q=0.5")
+        self.assertEqual(headers.get("Content-Encoding"), "gzip", f"Accepted gzip was not used")
+        self.assertEqual(json.loads(gzip.decompress(body)), TestResponseEncoder.payload, f"gzip body is corrupt")
+        self.assertEqual(headers.get("Vary"), "Accept-Encoding", f"Compressed response does not vary by encoding")
+
+        # Small bodies, refused codings and clients without Accept-Encoding get identity
+        for payload, accept_encoding in [({"data": []}, "gzip"), (TestResponseEncoder.payload, "gzip;q=0"),
+                                         (TestResponseEncoder.payload, None)]:
+            body, headers = encoder.encode(payload, accept_encoding)
+            self.assertNotIn("Content-Encoding", headers, f"Body compressed for Accept-Encoding {accept_encoding}")
+            self.assertEqual(json.loads(body), payload, f"Identity body is corrupt")
+
+        stats = encoder.stats()
+        self.assertEqual(stats["responses"], {"gzip": 1, "identity": 3}, f"Encoder stats {stats} are wrong")
+        self.assertLess(stats["sent_bytes"], stats["json_bytes"], f"Compression did not reduce the bytes sent")
+
+    def test_parse_accept_encoding(self):
+
+        self.assertEqual(parse_accept_encoding("gzip, BR;q=0.8, identity; q=0"),
+                         {"gzip": 1.0, "br": 0.8, "identity": 0.0}, f"Accept-Encoding was parsed incorrectly")
+        self.assertEqual(parse_accept_encoding(None), {}, f"Missing Accept-Encoding was not empty")
+
+
+if __name__ == '__main__':
+    unittest.main()
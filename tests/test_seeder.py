@@ -0,0 +1,261 @@
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import logging
+from os.path import exists
+import threading
+import time
+import unittest
+from urllib.parse import parse_qs, urlparse
+
+import sqlite3
+
+import requests
+
+from db import Db, WriteQueue
+from seeder import GithubSeeder
+from user_dao import UserDao
+
+
+class StandInGithub(BaseHTTPRequestHandler):
+    """
+    A stand-in for the GitHub users API serving 250 users with ETags, with scripted failures for each request number.
+    """
+
+    all_users = [{"login": f"user{i}", "id": i, "node_id": f"node{i}",
+                  "avatar_url": f"https://avatars.example.com/u/{i}",
+                  "html_url": f"https://github.example.com/user{i}", "type": "User", "site_admin": False}
+                 for i in range(1, 251)]
+    users = all_users
+    failures = {}
+    requests = []
+    on_request = None
+
+    def do_GET(self):
+        StandInGithub.requests.append(self.path)
+        if StandInGithub.on_request:
+            StandInGithub.on_request(self.path)
+        failure = StandInGithub.failures.get(len(StandInGithub.requests))
+        if failure:
+            self.send_response(failure[0])
+            for name, value in failure[1].items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        since = int(query["since"][0])
+        per_page = int(query["per_page"][0])
+        body = json.dumps([user for user in StandInGithub.users if user["id"] > since][:per_page]).encode()
+        etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Remaining", "59")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSeeder(unittest.TestCase):
+
+    db_name = "seeder_test"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInGithub)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/users"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandInGithub.users = [dict(user) for user in StandInGithub.all_users]
+        StandInGithub.failures = {}
+        StandInGithub.requests = []
+        StandInGithub.on_request = None
+        self.sleeps = []
+
+    def make_seeder(self, db, **kwargs):
+        return GithubSeeder(db, url=TestSeeder.url, per_page=100, backoff=0.5, sleep=self.sleeps.append, **kwargs)
+
+    def test_seeder(self):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestSeeder.db_name}.db'):
+            logging.fatal(f"Database test file '{TestSeeder.db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(TestSeeder.db_name)
+        user_dao = UserDao()
+
+        # Retry transient failures and honour rate limit headers
+        StandInGithub.failures = {
+            1: (503, {}),
+            2: (429, {"Retry-After": "7"}),
+            3: (429, {"Retry-After": formatdate(time.time() + 30, usegmt=True)}),
+            4: (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 60)})
+        }
+        count = self.make_seeder(db).run(150)
+        self.assertEqual(count, 150, f"Seeder reported {count} users rather than 150")
+        self.assertEqual(user_dao.get_count(db), 150, f"Seeder wrote {user_dao.get_count(db)} users rather than 150")
+        self.assertEqual(self.sleeps[:2], [0.5, 7.0], f"Seeder did not back off and honour Retry-After")
+        self.assertTrue(25 < self.sleeps[2] <= 30, f"Seeder did not wait for the Retry-After date")
+        self.assertGreater(self.sleeps[3], 50, f"Seeder did not wait for the rate limit to reset")
+
+        # Stop on a persistent failure, keeping the checkpoint of the pages already written
+        StandInGithub.failures = {n: (500, {}) for n in range(3, 10)}
+        StandInGithub.requests = []
+        seeder = self.make_seeder(db, max_retries=2)
+        with self.assertRaises(requests.exceptions.RetryError):
+            seeder.run(250)
+        self.assertEqual(seeder.get_checkpoint(), (200, 200),
+                         f"Checkpoint {seeder.get_checkpoint()} is not (200, 200)")
+        self.assertEqual(user_dao.get_count(db), 200, f"Table does not hold the users written before the failure")
+
+        # Resume from the checkpoint
+        StandInGithub.failures = {}
+        StandInGithub.requests = []
+        count = self.make_seeder(db).run(250, resume=True)
+        self.assertEqual(count, 250, f"Resumed seeder reported {count} users rather than 250")
+        self.assertIn("since=200", StandInGithub.requests[0], f"Resumed seeder did not start from its checkpoint")
+        self.assertEqual([row[1] for row in user_dao.read(db, 0, 100, "id", True)][:3], [250, 249, 248],
+                         f"Resumed seeder did not write the remaining users")
+        self.assertEqual(user_dao.get_count(db), 250, f"Table does not hold 250 users after resuming")
+
+        # Queue the writes on a writer thread, stopping at the first failed page
+        write_queue = WriteQueue(TestSeeder.db_name)
+        seeder = self.make_seeder(db, write_queue=write_queue)
+        self.assertEqual(seeder.run(200), 200, f"Queued seeder did not report 200 users")
+        self.assertEqual(seeder.get_checkpoint(), (200, 200), f"Queued seeder checkpoint is {seeder.get_checkpoint()}")
+        self.assertEqual(user_dao.get_count(db), 200, f"Queued seeder wrote {user_dao.get_count(db)} users")
+
+        original = seeder.checkpoint_dao.create_many
+        seeder.checkpoint_dao.create_many = lambda *args, **kwargs: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            seeder.run(250, resume=True)
+        seeder.checkpoint_dao.create_many = original
+        self.assertEqual(user_dao.get_count(db), 200, f"A failed queued page was partly written")
+        write_queue.close()
+
+        # Clean up
+        db.destroy()
+
+    def test_sync(self):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestSeeder.db_name}.db'):
+            logging.fatal(f"Database test file '{TestSeeder.db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(TestSeeder.db_name)
+        user_dao = UserDao()
+        self.make_seeder(db).run(150)
+
+        # Unchanged pages are answered with 304, and a partly written page is kept to the stored users
+        stats = self.make_seeder(db).sync(150)
+        self.assertEqual((stats["not_modified"], stats["refreshed"], stats["added"]), (1, 1, 0),
+                         f"Sync of an unchanged table returned {stats}")
+        self.assertEqual(user_dao.get_count(db), 150, f"Sync of an unchanged table changed its size")
+
+        # Changed users are updated, deleted users removed and new users added
+        StandInGithub.users[49]["login"] = "renamed"
+        del StandInGithub.users[19]
+        stats = self.make_seeder(db).sync(250)
+        self.assertEqual((stats["deleted"], stats["added"]), (1, 100), f"Sync of a changed table returned {stats}")
+        self.assertEqual(user_dao.read_by_key(db, 50)[0], "renamed", f"Sync did not update a changed user")
+        self.assertIsNone(user_dao.read_by_key(db, 20), f"Sync did not delete a removed user")
+        self.assertEqual(user_dao.get_count(db), 249, f"Table holds {user_dao.get_count(db)} users rather than 249")
+
+        stats = self.make_seeder(db).sync(250)
+        self.assertEqual((stats["not_modified"], stats["refreshed"]), (3, 0), f"Repeated sync returned {stats}")
+
+        # Clean up
+        db.destroy()
+
+    def test_rebuild(self):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestSeeder.db_name}.db'):
+            logging.fatal(f"Database test file '{TestSeeder.db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(TestSeeder.db_name)
+        user_dao = UserDao()
+        self.make_seeder(db).run(100)
+        version = db.get_data_version(user_dao)
+
+        # Readers see the old table for the whole rebuild
+        counts = []
+        reader = sqlite3.connect(f'{TestSeeder.db_name}.db', check_same_thread=False)
+        StandInGithub.on_request = lambda path: counts.append(
+            reader.execute("SELECT COUNT(*) FROM git_user").fetchone()[0])
+        count = self.make_seeder(db).rebuild(250)
+        StandInGithub.on_request = None
+        reader.close()
+        self.assertEqual(count, 250, f"Rebuild loaded {count} users rather than 250")
+        self.assertEqual(set(counts), {100}, f"Readers saw {counts} users during the rebuild rather than 100")
+
+        # The new table is complete, indexed and searchable, and the shadow is gone
+        self.assertEqual(user_dao.get_count(db), 250, f"Rebuilt table holds {user_dao.get_count(db)} users")
+        self.assertGreater(db.get_data_version(user_dao), version, f"Rebuild did not change the data version")
+        self.assertEqual(user_dao.get_count(db, "user24"), 11, f"Rebuilt table is not searchable")
+        self.assertFalse(db.does_table_exist(user_dao.get_shadow()), f"Shadow table was left behind")
+        indexes = [row[0] for row in db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn("git_user_login_sort", indexes, f"Rebuilt table has no sort indexes")
+
+        # Rebuild through a write queue
+        write_queue = WriteQueue(TestSeeder.db_name)
+        self.assertEqual(self.make_seeder(db, write_queue=write_queue).rebuild(250), 250,
+                         f"Queued rebuild did not load 250 users")
+        write_queue.close()
+        self.assertEqual(user_dao.get_count(db), 250, f"Queued rebuild holds {user_dao.get_count(db)} users")
+
+        # The rebuild recorded page ETags for the next sync
+        stats = self.make_seeder(db).sync(250)
+        self.assertEqual(stats["not_modified"], 3, f"Sync after a rebuild returned {stats}")
+
+        # An interrupted rebuild keeps the pages it loaded and carries on from them, even before the table exists
+        db.delete_table(user_dao)
+        StandInGithub.failures = {n: (500, {}) for n in range(3, 10)}
+        StandInGithub.requests = []
+        with self.assertRaises(requests.exceptions.RetryError):
+            self.make_seeder(db, max_retries=2).rebuild(250)
+        self.assertFalse(db.does_table_exist(user_dao), f"An interrupted rebuild replaced the table")
+        self.assertEqual(user_dao.get_shadow().get_count(db), 200, f"Interrupted rebuild lost its loaded pages")
+
+        StandInGithub.failures = {}
+        StandInGithub.requests = []
+        self.assertEqual(self.make_seeder(db).rebuild(250), 250, f"Resumed rebuild did not load 250 users")
+        self.assertIn("since=200", StandInGithub.requests[0], f"Resumed rebuild did not start from its checkpoint")
+        self.assertEqual(user_dao.get_count(db), 250, f"Resumed rebuild holds {user_dao.get_count(db)} users")
+        stats = self.make_seeder(db).sync(250)
+        self.assertEqual(stats["not_modified"], 3, f"Sync after a resumed rebuild returned {stats}")
+
+        # Clean up
+        db.destroy()
+
+    def test_client_error(self):
+
+        # Client errors other than rate limits are not retried
+        StandInGithub.failures = {1: (404, {})}
+        seeder = self.make_seeder(None)
+        with self.assertRaises(requests.HTTPError):
+            seeder.fetch_page(0)
+        self.assertEqual(len(StandInGithub.requests), 1, f"Seeder retried a client error")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import logging
+from os.path import exists
+import random
+import unittest
+
+from db import Db
+from snapshot import TableSnapshot
+from user_dao import UserDao
+
+
+class TestSnapshot(unittest.TestCase):
+
+    db_name = "snapshot_test"
+
+    def test_snapshot(self):
+
+        # Make sure we're not overwriting a database
+        if exists(f'{TestSnapshot.db_name}.db'):
+            logging.fatal(f"Database test file '{TestSnapshot.db_name}.db' already exists. Aborting.")
+            return
+
+        # Logins repeat and mix case and accented letters, which LOWER does not fold
+        db = Db(TestSnapshot.db_name)
+        dao = UserDao()
+        db.create_table(dao)
+        rng = random.Random(0)
+        names = ["alpha", "Alpha", "beta", "Ärger", "ärger", "zed", "Éclair", "eclair", "Bob"]
+        dao.create_many(db, [{"login": f"{rng.choice(names)}{rng.randint(0, 20)}", "id": i, "node_id": f"N{i:04d}",
+                              "avatar_url": "", "html_url": "", "type": rng.choice(["User", "Organization", "Bot"]),
+                              "site_admin": False} for i in range(1, 301)])
+        db.commit()
+
+        snapshot = TableSnapshot(dao)
+        self.assertTrue(snapshot.refresh(db), f"Snapshot was not built")
+
+        # Pages match the database for every ordering the snapshot holds, by offset and by cursor
+        sorts = [("id", False), ("id", True), ("login", False), ("login", True), ("node_id", True),
+                 ([("type", "asc"), ("login", "asc")], False), ([("type", "desc"), ("login", "desc")], False)]
+        for sort_by, desc_flag in sorts:
+            order_terms = dao.get_order_terms(sort_by, desc_flag)
+            for offset in [0, 10, 290, 400]:
+                expected = dao.read(db, offset, 25, sort_by, desc_flag)
+                result = snapshot.read(db, offset, 25, order_terms)
+                self.assertEqual(result, expected, f"Snapshot page at {offset} for {sort_by} {desc_flag} differs")
+
+            rows = dao.read(db, 100, 3, sort_by, desc_flag)
+            for row, position, backward in [(rows[0], 100, True), (rows[-1], 102, False)]:
+                cursor = {"key": [row[dao.schema.column_index[c]] for c, _ in order_terms], "backward": backward}
+                expected = dao.read(db, 0, 25, sort_by, desc_flag, cursor)
+                result = snapshot.read(db, 0, 25, order_terms, cursor)
+                self.assertEqual(result, expected, f"Snapshot seek from {position} for {sort_by} {desc_flag} differs")
+
+        # Orderings without a permutation are left to the database
+        mixed = [("type", "asc"), ("login", "desc")]
+        self.assertIsNone(snapshot.read(db, 0, 25, dao.get_order_terms(mixed)), f"Snapshot served a mixed sort")
+        self.assertEqual(dao.read(db, 0, 25, mixed, snapshot=snapshot), dao.read(db, 0, 25, mixed),
+                         f"Read with a snapshot did not fall back to the database")
+
+        # A write makes the snapshot stale until it is refreshed
+        dao.create(db, {"login": "aaa", "id": 301, "node_id": "N0301", "avatar_url": "", "html_url": "",
+                        "type": "User", "site_admin": False})
+        db.commit()
+        self.assertIsNone(snapshot.read(db, 0, 25, dao.get_order_terms("login")), f"Stale snapshot served a read")
+        self.assertTrue(snapshot.refresh(db), f"Snapshot was not rebuilt")
+        self.assertEqual(snapshot.read(db, 0, 1, dao.get_order_terms("login"))[0][1], 301,
+                         f"Rebuilt snapshot does not hold the new record")
+
+        stats = snapshot.stats()
+        self.assertEqual((stats["records"], stats["builds"]), (301, 2), f"Snapshot stats {stats} are wrong")
+
+        # Clean up
+        db.destroy()
+
+
+if __name__ == '__main__':
+    unittest.main()
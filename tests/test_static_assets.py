@@ -0,0 +1,61 @@
+import gzip
+import os
+from os.path import exists
+import shutil
+import unittest
+
+from static_assets import StaticAssets
+
+
+class TestStaticAssets(unittest.TestCase):
+
+    root = "static_assets_test"
+
+    def test_static_assets(self):
+
+        # Make sure we're not overwriting a directory
+        if exists(TestStaticAssets.root):
+            raise unittest.SkipTest(f"Test directory '{TestStaticAssets.root}' already exists. Aborting.")
+
+        os.makedirs(f"{TestStaticAssets.root}/images")
+        with open(f"{TestStaticAssets.root}/index.html", "w") as file:
+            file.write('<img src="images/logo.svg"><img src=\'images/dot.png\'>' + "<p>padding</p>" * 100)
+        with open(f"{TestStaticAssets.root}/images/logo.svg", "w") as file:
+            file.write("<svg>" + "<rect/>" * 200 + "</svg>")
+        with open(f"{TestStaticAssets.root}/images/dot.png", "wb") as file:
+            file.write(os.urandom(100))
+
+        assets = StaticAssets(TestStaticAssets.root)
+        logo = assets.get("images/logo.svg")
+        dot = assets.get("images/dot.png")
+
+        # References in the page carry their file's fingerprint
+        status, body, headers = assets.respond("index.html")
+        self.assertIn(f'images/logo.svg?v={logo.fingerprint}"'.encode(), body, f"Page reference was not fingerprinted")
+        self.assertIn(f"images/dot.png?v={dot.fingerprint}'".encode(), body, f"Page reference was not fingerprinted")
+        self.assertEqual(headers["Cache-Control"], "no-cache", f"Page is not revalidated")
+
+        # Compressible files are sent precompressed to clients that accept it, others as they are
+        status, body, headers = assets.respond("images/logo.svg", logo.fingerprint, "gzip, deflate")
+        self.assertEqual(headers.get("Content-Encoding"), "gzip", f"Compressible asset was not gzipped")
+        self.assertEqual(gzip.decompress(body), logo.variants["identity"], f"gzip variant is corrupt")
+        self.assertIn("immutable", headers["Cache-Control"], f"Fingerprinted URL is not immutable")
+        self.assertEqual(assets.respond("images/logo.svg", "stale")[2]["Cache-Control"], "no-cache",
+                         f"Stale fingerprint was cached as immutable")
+        self.assertNotIn("gzip", dot.variants, f"Incompressible asset kept a larger gzip variant")
+
+        # Conditional requests for any variant of the current content are not modified
+        self.assertEqual(assets.respond("images/logo.svg", if_none_match=headers["ETag"])[0], 304,
+                         f"Conditional request for a gzip variant was modified")
+        self.assertEqual(assets.respond("images/logo.svg", if_none_match=f'"other", W/{headers["ETag"]}')[0], 304,
+                         f"Conditional request with a weak tag was modified")
+        self.assertEqual(assets.respond("images/logo.svg", if_none_match='"other"')[0], 200,
+                         f"Conditional request for old content was not modified")
+        self.assertEqual(assets.respond("images/missing.png")[0], 404, f"Missing asset was found")
+
+        # Clean up
+        shutil.rmtree(TestStaticAssets.root)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -50,6 +50,161 @@ class TestUserDao(unittest.TestCase):
         # Clean up
         db.destroy()
 
+    def test_search(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestUserDao.db_name}_search"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = UserDao()
+        db.create_table(dao)
+        logins = ["mojombo", "defunkt", "pjhyett", "wycats", "ezmobius", "ivey", "evanphx", "vanpelt"]
+        dao.create_many(db, [{"login": login, "id": i, "node_id": f"MDQ6VXNlcj{i}", "type": "User"}
+                             for i, login in enumerate(logins, 1)])
+        db.commit()
+
+        # Substrings of three or more characters match anywhere, case-insensitively
+        result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="VAN")]
+        self.assertEqual(result, ["evanphx", "vanpelt"], f"Substring search returned {result}")
+        self.assertEqual(dao.get_count(db, "van"), 2, f"Substring search count is not 2")
+
+        # Shorter terms match the start of a column
+        result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="ev")]
+        self.assertEqual(result, ["evanphx"], f"Prefix search returned {result}")
+        self.assertEqual(dao.get_count(db, "e"), 2, f"Prefix search count is not 2")
+        result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="mo")]
+        self.assertEqual(result, ["mojombo"], f"Short search matched inside a column: {result}")
+        result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="mob")]
+        self.assertEqual(result, ["ezmobius"], f"Three character search returned {result}")
+
+        # Quotes in the term are matched literally
+        self.assertEqual(dao.read(db, 0, 10, "login", False, search='"mo'), [], f"Quoted search matched records")
+
+        # The index follows updates and deletes
+        db.cursor.execute("UPDATE git_user SET login = 'mojombo2' WHERE id = 1")
+        db.cursor.execute("DELETE FROM git_user WHERE id = 5")
+        db.commit()
+        result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="bo2")]
+        self.assertEqual(result, ["mojombo2"], f"Search after update returned {result}")
+        self.assertEqual(dao.get_count(db, "mob"), 0, f"Search after delete matched the deleted record")
+
+        # Cursors only serve the search they were made for
+        rows = dao.read(db, 0, 1, "login", False, search="van")
+        token = dao.encode_cursor(rows[0], 0, "login", False, search="van")
+        self.assertIsNone(dao.decode_cursor(token, 1, 1, "login", False), f"Cursor accepted without its search")
+        cursor = dao.decode_cursor(token, 1, 1, "login", False, search="van")
+        result = [row[0] for row in dao.read(db, 1, 1, "login", False, cursor, "van")]
+        self.assertEqual(result, ["vanpelt"], f"Cursor read within a search returned {result}")
+
+        # SQLite without the trigram tokenizer gets no search index, and longer terms still match anywhere
+        trigram_search = Db.trigram_search
+        Db.trigram_search = False
+        try:
+            db.delete_table(dao)
+            db.create_table(dao)
+            dao.create_many(db, [{"login": login, "id": i, "node_id": f"MDQ6VXNlcj{i}", "type": "User"}
+                                 for i, login in enumerate(logins + ["under_score", "under7score"], 1)])
+            db.commit()
+            self.assertFalse(db.cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'git_user_search'")
+                             .fetchone()[0], f"Search index created without the trigram tokenizer")
+            result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="VAN")]
+            self.assertEqual(result, ["evanphx", "vanpelt"], f"Unindexed substring search returned {result}")
+            self.assertEqual(dao.count_records(db, "van", "estimated"), (2, False),
+                             f"Unindexed search count is not exactly 2")
+            result = [row[0] for row in dao.read(db, 0, 10, "login", False, search="r_s")]
+            self.assertEqual(result, ["under_score"], f"Unindexed search did not match _ literally: {result}")
+        finally:
+            Db.trigram_search = trigram_search
+
+        # Clean up
+        db.destroy()
+
+    def test_count_strategies(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestUserDao.db_name}_counts"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = UserDao()
+        db.create_table(dao)
+        dao.create_many(db, [{"login": f"user{i}" if i % 2 else f"member{i}", "id": i, "node_id": f"MDQ6VXNlcj{i}",
+                              "type": "User"} for i in range(1, 4001)])
+        db.commit()
+
+        # Exact and cached counts agree, and the cache follows writes
+        self.assertEqual(dao.count_records(db, "member"), (2000, False), f"Exact search count is not 2000")
+        self.assertEqual(dao.count_records(db, "member", "cached"), (2000, False), f"Cached search count is not 2000")
+        dao.create(db, {"login": "member4002", "id": 4002, "node_id": "MDQ6VXNlcj4002", "type": "User"})
+        db.commit()
+        self.assertEqual(dao.get_count(db, "member", "cached"), 2001, f"Cached count was not renewed after a write")
+        with self.assertRaises(ValueError):
+            dao.count_records(db, strategy="guess")
+
+        # The row counter is exact, so only searches with more matches than the sample are estimated
+        self.assertEqual(dao.count_records(db, strategy="estimated"), (4001, False), f"Row count was estimated")
+        self.assertEqual(dao.count_records(db, "member4", "estimated"), (58, False),
+                         f"Search with fewer matches than the sample was estimated")
+        count, estimated = dao.count_records(db, "member", "estimated")
+        self.assertTrue(estimated, f"Search with more matches than the sample was not estimated")
+        self.assertLess(abs(count - 2001), 100, f"Estimated search count of {count} is far from 2001")
+
+        # Without a row counter, tables are estimated from their rowids and then from ANALYZE
+        db.cursor.execute("DELETE FROM table_stats")
+        db.cursor.execute("DELETE FROM git_user WHERE id = 4000")
+        db.commit()
+        self.assertEqual(dao.count_records(db, strategy="estimated"), (4002, True), f"Rowid estimate is not 4002")
+        db.cursor.execute("ANALYZE")
+        db.commit()
+        self.assertEqual(dao.count_records(db, strategy="estimated"), (4000, True), f"ANALYZE estimate is not 4000")
+
+        # Clean up
+        db.destroy()
+
+    def test_sort_indexes(self):
+
+        # Make sure we're not overwriting a database
+        db_name = f"{TestUserDao.db_name}_indexes"
+        if exists(f'{db_name}.db'):
+            logging.fatal(f"Database test file '{db_name}.db' already exists. Aborting.")
+            return
+
+        db = Db(db_name)
+        dao = UserDao()
+        db.create_table(dao)
+
+        # Every sort offered by the API must be served by an index, whether paging by offset or by cursor
+        for columns in [[column] for column in dao.sortable_columns] + dao.compound_sorts:
+            key = ["a"] * len(dao.get_order_terms([(column, False) for column in columns]))
+            for desc_flag in [False, True]:
+                sort_by = [(column, desc_flag) for column in columns]
+                for cursor in [None, {"key": key, "backward": False}, {"key": key, "backward": True}]:
+                    sql_string, params = dao.build_read_sql(sort_by, desc_flag, cursor)
+                    plan = db.cursor.execute(f"EXPLAIN QUERY PLAN {sql_string}", params + [25, 0]).fetchall()
+                    details = ' '.join(row[-1] for row in plan)
+                    self.assertNotIn("TEMP B-TREE", details,
+                                     f"Sort on {sort_by} (desc={desc_flag}, cursor={cursor}) is not index-served: "
+                                     f"{details}")
+                    if cursor is not None:
+                        self.assertIn("SEARCH", details,
+                                      f"Seek on {sort_by} (desc={desc_flag}) does not search an index: {details}")
+
+        # Recreating the indexes leaves the declared ones in place and removes stale ones
+        db.cursor.execute(f"CREATE INDEX {dao.table_name}_html_url_sort ON {dao.table_name} (html_url)")
+        db.create_indexes(dao)
+        names = [row[0] for row in db.cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=?", (dao.table_name,))]
+        self.assertEqual(sorted(names), sorted(dao.get_sort_indexes().keys()),
+                         f"Indexes {names} do not match the declared sort indexes")
+
+        # Clean up
+        db.destroy()
+
 
 if __name__ == '__main__':
     unittest.main()
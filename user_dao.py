@@ -10,6 +10,10 @@ class UserDao(GenericDao):
             UserDao.columns (list): the names of the columns in this table.
             UserDao.column_types (list): the data types of the columns in this table.
             UserDao.primary_key_index (int): the index of the table primary key.
+            UserDao.sortable_columns (list): the names of the columns offered for sorting, each backed by an index.
+            UserDao.searchable_columns (list): the names of the text columns covered by the search index.
+            UserDao.compound_sorts (list): tuples of sortable column names commonly sorted on together, each backed by
+                an index.
     """
 
     @property
@@ -27,3 +31,15 @@ class UserDao(GenericDao):
     @property
     def primary_key_index(self):
         return 1
+
+    @property
+    def sortable_columns(self):
+        return ["id", "node_id", "login", "type"]
+
+    @property
+    def searchable_columns(self):
+        return ["login", "node_id", "type"]
+
+    @property
+    def compound_sorts(self):
+        return [("type", "login")]